@@ -8,12 +8,12 @@ Cost function v4
 """
 
 
-from sklearn.metrics import mean_squared_error
-import math
 import numpy as np
 
+from histogram_bins import TraitBins
 
-def cost_function(obs, mod):
+
+def cost_function(obs, mod, trait_bins=None):
     """
     Compute a cost between two distributions.
     Penalized the cost for the lipids (max_obs > 1) if the model 
@@ -24,132 +24,209 @@ def cost_function(obs, mod):
     obs: array
         Observed values.
     mod: array
-        Modeled values.
+        Modeled values, or modeled values and weights (fitness) as two columns.
+    trait_bins: TraitBins
+        Bins and histogram of the observations, computed from obs with the
+        default binning (10 bins) if None. Computing them once allows to reuse
+        them for many model outputs.
 
     Returns
     -------
     cost: float
         Cost.
     obs_interp: array
-        Interpolated observations on histogramm.
+        Observed histogram.
     mod_interp: array
-        Interpolated modeled values on histogramm.
+        Modeled histogram on the same bins.
     bins: array
         Bins from the histogramm (for figure reproduction).
     """
     
-    ## Statistics distributions
+    if trait_bins is None:
+        trait_bins = TraitBins(obs)
+    
+    mod = np.asarray(mod, dtype=float)
+    
+    if mod.ndim == 1:
+        mod_hist = trait_bins.histogram(mod)
+    
+    elif np.sum(mod[:,1]) > 0:
+        mod_hist = trait_bins.histogram(mod[:,0], weights=mod[:,1])
+    
+    else:
+        return np.nan, trait_bins.obs_hist, np.full(trait_bins.n_bins, np.nan), trait_bins.edges
+    
+    # Compute the RMSE
+    RMSE = np.sqrt(np.mean((trait_bins.obs_hist - mod_hist)**2))
+    
+    cost = RMSE * penalty_factor(obs, mod)
+    
+    return cost, trait_bins.obs_hist, mod_hist, trait_bins.edges
+
+
+def joint_cost_function(obs, mod, lip_bins=None, full_bins=None):
+    """
+    Compute the cost between the joint (lipids x fullness) distributions and
+    the costs between the lipids and the fullness distributions, from a single
+    2-D histogram of each: the 1-D histograms are its marginals and the lipids
+    and fullness costs are the ones of cost_function.
+    The joint cost is penalized as the lipids cost.
+
+    Parameters
+    ----------
+    obs: array
+        Observed lipids and fullness (two columns).
+    mod: array
+        Modeled lipids and fullness, and optionally weights (fitness) as a third column.
+    lip_bins, full_bins: TraitBins
+        Bins and histograms of the observed lipids and fullness (computed with 
+        the default binning if None).
+
+    Returns
+    -------
+    costs: tuple
+        Joint, lipids and fullness costs.
+    obs_hists: tuple
+        Observed joint (2-D), lipids and fullness histograms.
+    mod_hists: tuple
+        Modeled joint (2-D), lipids and fullness histograms on the same bins.
+    bins: tuple
+        Bins of the lipids and of the fullness.
+    """
+    
+    obs = np.asarray(obs, dtype=float)
+    mod = np.asarray(mod, dtype=float)
+    
+    if lip_bins is None:
+        lip_bins = TraitBins(obs[:,0])
+    if full_bins is None:
+        full_bins = TraitBins(obs[:,1])
+    
+    bins = (lip_bins.edges, full_bins.edges)
+    
+    # Observed histograms, the missing values are in the last row and column
+    n_lip, n_full = lip_bins.n_bins + 1, full_bins.n_bins + 1
+    obs_counts = np.bincount(lip_bins.obs_index * n_full + full_bins.obs_index, 
+                             minlength=n_lip * n_full).reshape(n_lip, n_full)
+    obs_hists = _joint_histograms(obs_counts, bins)
+    
+    weights = mod[:,2] if mod.shape[1] > 2 else None
+    
+    if weights is not None and np.sum(weights) <= 0:
+        mod_hists = (np.full((n_lip - 1, n_full - 1), np.nan), np.full(n_lip - 1, np.nan), np.full(n_full - 1, np.nan))
+        return (np.nan, np.nan, np.nan), obs_hists, mod_hists, bins
+    
+    # Modeled histograms in one pass
+    mod_counts = np.bincount(lip_bins.index(mod[:,0]) * n_full + full_bins.index(mod[:,1]), 
+                             weights=weights, 
+                             minlength=n_lip * n_full).reshape(n_lip, n_full)
+    mod_hists = _joint_histograms(mod_counts, bins)
+    
+    # Compute the RMSE, with the penalties of cost_function
+    mod_lip = mod[:,[0,2]] if weights is not None else mod[:,0]
+    mod_full = mod[:,[1,2]] if weights is not None else mod[:,1]
+    
+    RMSE = [np.sqrt(np.mean((o - m)**2)) for o, m in zip(obs_hists, mod_hists)]
+    
+    costs = (RMSE[0] * penalty_factor(obs[:,0], mod_lip),
+             RMSE[1] * penalty_factor(obs[:,0], mod_lip),
+             RMSE[2] * penalty_factor(obs[:,1], mod_full))
+    
+    return costs, obs_hists, mod_hists, bins
+
+
+def _joint_histograms(counts, bins):
+    """Joint and marginal densities from the counts of a 2-D histogram with an extra row and column of missing values."""
+    
+    lip_edges, full_edges = bins
+    
+    joint = counts[:-1, :-1]
+    joint = joint / (joint.sum() * np.outer(np.diff(lip_edges), np.diff(full_edges)))
+    
+    lip = counts[:-1, :].sum(axis=1)
+    lip = lip / (lip.sum() * np.diff(lip_edges))
+    
+    full = counts[:, :-1].sum(axis=0)
+    full = full / (full.sum() * np.diff(full_edges))
+    
+    return joint, lip, full
+
+
+def penalty_factor(obs, mod):
+    """
+    Factor applied to the RMSE: 1 for the fullness, 1000 for the lipids and 3000
+    for the lipids if the model gives higher or lower values than the observations.
+    """
+    
     min_obs = np.nanmin(obs)
     max_obs = np.nanmax(obs)
     
-    range_obs = max_obs - min_obs
+    if max_obs < 1: # Fullness
+        return 1
     
-    dim_mod = len(np.shape(mod))
+    min_mod = np.nanmin(mod)
+    max_mod = np.nanmax(mod)
     
-    if max_obs < 1: # Fullness
-        
-        if dim_mod == 1:
-            # Compute normalized histograms for mod and obs
-            obs_hist, obs_bins = np.histogram(obs, bins=10, range=(min_obs, max_obs), density=True)
-            mod_hist, mod_bins = np.histogram(mod.clip(min=min_obs, max=max_obs), 
-                                              bins=10, 
-                                              range=(min_obs, max_obs), 
-                                              density=True)
-            
-            # Interpolate both histograms
-            obs_interp = np.interp(obs_bins[:-1], obs_bins[:-1], obs_hist)
-            mod_interp = np.interp(mod_bins[:-1], mod_bins[:-1], mod_hist)
-        
-        else:
-            # Compute normalized histograms for mod and obs
-            obs_hist, obs_bins = np.histogram(obs, bins=10, range=(min_obs, max_obs), density=True)
-            
-            if np.sum(mod[:,1]) > 0:
-                 mod_hist, mod_bins = np.histogram(np.clip(mod[:,0],a_min=min_obs, a_max=max_obs), 
-                                              bins=10, 
-                                              range=(min_obs, max_obs), 
-                                              density=True, 
-                                              weights=mod[:,1])
-                 
-            else:
-                obs_interp = np.interp(obs_bins[:-1], obs_bins[:-1], obs_hist)
-                bins = obs_bins
-                mod_interp = np.full(10, np.nan)
-                cost=np.nan
-                
-                return cost, obs_interp, mod_interp, bins
-            
-            # Interpolate both histograms
-            obs_interp = np.interp(obs_bins[:-1], obs_bins[:-1], obs_hist)
-            mod_interp = np.interp(mod_bins[:-1], mod_bins[:-1], mod_hist)
-            
-        bins = obs_bins
-        
-        # Compute the RMSE
-        MSE = mean_squared_error(obs_interp, mod_interp)
-        RMSE = math.sqrt(MSE)
-        
-        cost = RMSE
-    
-    else: # Total lipids
-        
-        if dim_mod == 1:
-            # Compute normalized histograms for mod and obs
-            obs_hist, obs_bins = np.histogram(obs, 
-                                              bins=10,
-                                              #bins=int(range_obs/100), 
-                                              range=(min_obs, max_obs), 
-                                              density=True)
-            mod_hist, mod_bins = np.histogram(mod.clip(min=min_obs, max=max_obs), 
-                                              bins=10,
-                                              #bins=int(range_obs/0.2), 
-                                              range=(min_obs, max_obs), 
-                                              density=True)
-            
-        else:
-            # Compute normalized histograms for mod and obs
-            obs_hist, obs_bins = np.histogram(obs, 
-                                              bins=10,
-                                              #bins=int(range_obs/100), 
-                                              range=(min_obs, max_obs), 
-                                              density=True)
-            
-            if np.sum(mod[:,1]) > 0:
-                mod_hist, mod_bins = np.histogram(np.clip(mod[:,0],a_min=min_obs, a_max=max_obs), 
-                                                bins=10,
-                                                #bins=int(range_obs/0.2), 
-                                                range=(min_obs, max_obs), 
-                                                density=True,
-                                                weights=mod[:,1])
-            else:
-                obs_interp = np.interp(obs_bins[:-1], obs_bins[:-1], obs_hist)
-                bins = obs_bins
-                mod_interp = np.full(10, np.nan)
-                cost=np.nan
-                
-                return cost, obs_interp, mod_interp, bins
-            
-        # Interpolate both histograms
-        obs_interp = np.interp(obs_bins[:-1], obs_bins[:-1], obs_hist)
-        mod_interp = np.interp(mod_bins[:-1], mod_bins[:-1], mod_hist)
-            
-        bins = obs_bins
-    
-        # Compute the RMSE
-        MSE = mean_squared_error(obs_interp, mod_interp)
-        RMSE = math.sqrt(MSE)
-
-        min_mod = np.nanmin(mod)
-        max_mod = np.nanmax(mod)
-        
-        if (min_mod < min_obs) or (max_mod > max_obs):
-            cost = RMSE * 3000
-            
-        else:
-            cost = RMSE * 1000
-        
-    
-    return cost, obs_interp, mod_interp, bins
+    if (min_mod < min_obs) or (max_mod > max_obs):
+        return 3000
+    
+    return 1000
+
+
+def cost_function_bootstrap(obs, mod, boot_idx, trait_bins=None):
+    """
+    Compute the cost of cost_function and its bootstrap distribution over 
+    resamples of the observations.
+    The bins are the ones of all the observations: the modeled histogram is thus 
+    computed once, and the observed histograms of all the resamples are computed
+    together with a single np.bincount.
+
+    Parameters
+    ----------
+    obs: array
+        Observed values.
+    mod: array
+        Modeled values.
+    boot_idx: array
+        n_boot x n matrix of observation indices (from bootstrap_indices).
+    trait_bins: TraitBins
+        Bins and histogram of the observations (see cost_function).
+
+    Returns
+    -------
+    cost: float
+        Cost, as in cost_function.
+    cost_boot: array
+        Cost of each bootstrap resample.
+    """
+    
+    obs = np.asarray(obs, dtype=float)
+    n_boot = boot_idx.shape[0]
+    
+    if trait_bins is None:
+        trait_bins = TraitBins(obs)
+    
+    cost, obs_interp, mod_interp, bins = cost_function(obs, mod, trait_bins)
+    
+    if np.all(np.isnan(mod_interp)):
+        return cost, np.full(n_boot, np.nan)
+    
+    n_bins = trait_bins.n_bins
+    
+    # Histograms of all the resamples (missing observations are in the extra bin n_bins)
+    offsets = np.arange(n_boot)[:, None] * (n_bins + 1)
+    counts = np.bincount((trait_bins.obs_index[boot_idx] + offsets).ravel(), 
+                         minlength=n_boot * (n_bins + 1)).reshape(n_boot, n_bins + 1)[:, :n_bins]
+    
+    obs_hist_boot = counts / (counts.sum(axis=1, keepdims=True) * np.diff(bins))
+    
+    # Compute the RMSE of each resample
+    RMSE_boot = np.sqrt(np.mean((obs_hist_boot - mod_interp)**2, axis=1))
+    
+    cost_boot = RMSE_boot * penalty_factor(obs, mod)
+    
+    return cost, cost_boot
+
 
 # import matplotlib.pyplot as plt
 
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ABC-SMC calibration of one species and scenario with the MMD cost
+
+Approximate Bayesian computation by sequential Monte Carlo (population Monte
+Carlo of Beaumont et al. 2009) instead of the selection of the best runs of
+a flat LHS sweep. The discrepancy of a paramosome is its MMD cost
+(compute_weighted_mmd, summed over the stages and months with observations):
+
+    - generation 0: N_particles paramosomes drawn by Latin hypercube in
+      PARAM_BOUNDS (uniform prior), all accepted;
+    - generation t: the tolerance is the alpha-quantile of the discrepancies
+      of the previous population, and new paramosomes are proposed by
+      perturbing particles of the previous population (drawn by weight) with
+      a Gaussian kernel truncated to PARAM_BOUNDS (twice the weighted variance
+      of the population), until N_particles of them are within the tolerance.
+      The particles are weighted by prior / proposal density.
+
+The proposals of a generation are run in batches of the expected number of
+runs needed (from the acceptance rate of the previous generation) by a pool
+of workers, each run being a coltrane_batch_costs.py record of the paramosome
+for the species and scenario. The runs are thus cached (a generation run
+again, with the same seed, only reads its records) and can be merged with
+the other records (python coltrane_batch_costs.py merge). The forcing is
+computed once and shared with the workers (see shared_arrays.py).
+
+The algorithm stops after max_generations, when the acceptance rate of a
+generation falls below MIN_ACCEPTANCE (the tolerance reached the noise of the
+cost), or when max_simulations runs are done. An unfinished generation is
+discarded. The weighted posterior ({prefix}_posterior.csv) and the
+tolerance, number of runs, acceptance rate and effective sample size of each
+generation ({prefix}_generations.csv) are written after each generation.
+
+    python abc_smc.py "Calanus glacialis" now_icealg ./abc_batch_glacialis_IA ./ observations_for_calibration.npy C4,C5,C6 8 5 32 500 abc_glacialis_IA 4000
+
+The diapause days are truncated as in the sweeps (the particles themselves
+are continuous).
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from pyDOE2 import lhs
+from scipy.special import ndtr, logsumexp
+
+sys.path.append('./model')
+
+from coltrane_forcing import coltrane_forcing
+from coltrane_batch_costs import run_batch, batch_key, batch_file_path
+from compute_all_costs import observation_cells, BINNING
+from create_txt_file_paramosomes_multisp_u0fix import PARAM_BOUNDS
+from ingest_observations import load_observations
+from paramosome_index import denormalize
+from rank_costs import SCENARIOS
+from run_cache import FORCING_ARGS, atomic_write
+from run_manifest import run_record
+from run_profiler import profile_run
+from shard_store import load_output
+from shared_arrays import forcing_environment
+
+## Quantile of the discrepancies of a population giving the tolerance of the next generation
+ALPHA = 0.5
+
+## Stop when the acceptance rate of a generation falls below this rate
+MIN_ACCEPTANCE = 0.02
+
+## Maximum number of generations (generation 0 included)
+MAX_GENERATIONS = 10
+
+## Maximum number of runs of a calibration
+MAX_SIMULATIONS = 4000
+
+## Parameters truncated to days by the simulation drivers
+DAY_PARAMS = ['tdia_exit', 'tdia_enter']
+
+def particle_params(particle):
+    """LHS parameters of a particle (normalized values), as run by coltrane_batch_costs."""
+    values = denormalize(np.asarray(particle)[None]).iloc[0]
+    return {param: int(values[param]) if param in DAY_PARAMS else float(values[param]) for param in PARAM_BOUNDS}
+
+## Worker state, set once per process by init_worker
+_worker = {}
+
+def init_worker(species, preySatVersion, folder_path, obs_path, stages, months, gamma, cells):
+    """Settings of the runs, once per worker process."""
+    _worker['variants'] = [(species, preySatVersion)]
+    _worker['folder_path'] = folder_path
+    _worker['obs_path'] = obs_path
+    _worker['stages'] = stages
+    _worker['months'] = months
+    _worker['gamma'] = gamma
+    _worker['cells'] = cells
+
+def discrepancy(particle):
+    """
+    MMD cost of a particle summed over the stages and months with
+    observations (inf if a stage and month has no simulated individuals).
+    The record of the run is read if it exists.
+    """
+    lhs_params = particle_params(particle)
+    run_id = ','.join(str(value) for value in lhs_params.values())
+
+    with run_record('coltrane_batch_costs', run_id) as record, profile_run('coltrane_batch_costs', run_id, record):
+
+        key = batch_key(lhs_params, _worker['obs_path'], _worker['stages'], _worker['months'], [_worker['gamma']],
+                        0, BINNING, False, _worker['variants'])
+
+        batch = run_batch(lhs_params, _worker['folder_path'], _worker['obs_path'], _worker['stages'], _worker['months'],
+                          [_worker['gamma']], variants=_worker['variants'])
+        record['cached'] = batch is None
+
+        if batch is None:
+            batch = load_output(batch_file_path(_worker['folder_path'], key))
+        else:
+            record['metrics'] = batch['metrics']
+
+    costs = next(iter(batch['variants'][0]['MMD'].values()))['cost']
+
+    return sum(costs.get(f'{cell}_cost', np.inf) for cell in _worker['cells'])
+
+def propose(population, weights, sigma, n, rng):
+    """
+    n particles drawn from the population by weight and perturbed by the
+    Gaussian kernel of standard deviations sigma truncated to [0, 1] (the
+    values outside are drawn again).
+    """
+    centers = population[rng.choice(len(population), size=n, p=weights)]
+    particles = centers + sigma * rng.standard_normal(centers.shape)
+
+    outside = (particles < 0) | (particles > 1)
+    while outside.any():
+        particles = np.where(outside, centers + sigma * rng.standard_normal(centers.shape), particles)
+        outside = (particles < 0) | (particles > 1)
+
+    return particles
+
+def importance_weights(particles, population, weights, sigma):
+    """
+    Normalized weights of the particles: uniform prior over the density of
+    the proposal (mixture of the truncated kernels centred on the population).
+    """
+    z = (particles[:, None, :] - population[None]) / sigma
+    log_kernel = -0.5 * (z**2).sum(axis=2)
+
+    # Mass of each truncated kernel in [0, 1]
+    log_mass = np.log(ndtr((1 - population) / sigma) - ndtr(-population / sigma)).sum(axis=1)
+
+    log_proposal = logsumexp(log_kernel - log_mass + np.log(weights), axis=1)
+    new_weights = np.exp(log_proposal.min() - log_proposal)
+
+    return new_weights / new_weights.sum()
+
+def write_results(prefix, population, weights, distances, generation, history):
+    """Weighted posterior and summary of the generations, in csv files."""
+    posterior = pd.DataFrame([particle_params(particle) for particle in population])
+    posterior['weight'] = weights
+    posterior['distance'] = distances
+    posterior['generation'] = generation
+
+    atomic_write(f'{prefix}_posterior.csv', lambda file: file.write(posterior.to_csv(index=False).encode()))
+    atomic_write(f'{prefix}_generations.csv', lambda file: file.write(pd.DataFrame(history).to_csv(index=False).encode()))
+
+    return posterior
+
+def abc_smc(pool, n_workers, n_particles, prefix, alpha=ALPHA, max_generations=MAX_GENERATIONS,
+            max_simulations=MAX_SIMULATIONS, min_acceptance=MIN_ACCEPTANCE, seed=0):
+    """
+    Run the generations of the ABC-SMC with the workers of the pool.
+
+    Parameters
+    ----------
+    pool : Pool
+        Workers initialized by init_worker.
+    n_workers : int
+        Number of workers (the batches are multiples of it).
+    n_particles : int
+        Number of particles of each population.
+    prefix : str
+        Prefix of the result files.
+    alpha : float
+        Quantile of the discrepancies giving the next tolerance.
+    max_generations : int
+        Maximum number of generations.
+    max_simulations : int
+        Maximum number of runs.
+    min_acceptance : float
+        Minimum acceptance rate of a generation.
+    seed : int
+        Seed of the proposals (the proposals of each generation and batch
+        only depend on it and on the previous populations).
+
+    Returns
+    -------
+    posterior : DataFrame
+        Parameters, weight, discrepancy ('distance') and generation of the
+        particles of the last population.
+    history : list
+        Tolerance ('epsilon'), number of runs, acceptance rate and effective
+        sample size ('ess') of each generation.
+    """
+    d = len(PARAM_BOUNDS)
+    history = []
+
+    ## Generation 0: Latin hypercube over the prior
+    population = lhs(d, samples=n_particles, random_state=seed)
+    distances = np.array(pool.map(discrepancy, list(population), chunksize=1))
+    n_simulations = n_particles
+
+    finite = np.isfinite(distances)
+    population, distances = population[finite], distances[finite]
+    weights = np.full(len(population), 1 / len(population))
+    acceptance = finite.mean()
+
+    history.append({'generation': 0, 'epsilon': np.inf, 'n_particles': len(population), 'n_simulations': n_particles,
+                    'acceptance': acceptance, 'ess': len(population)})
+    posterior = write_results(prefix, population, weights, distances, 0, history)
+    print(json.dumps(history[-1]), flush=True)
+
+    for generation in range(1, max_generations):
+
+        if acceptance < min_acceptance or n_simulations >= max_simulations:
+            break
+
+        epsilon = np.quantile(distances, alpha)
+        # Twice the weighted variance of the population (Beaumont et al. 2009)
+        mean = weights @ population
+        sigma = np.maximum(np.sqrt(2 * weights @ (population - mean)**2), 1e-6)
+
+        accepted = []
+        accepted_distances = []
+        n_runs = 0
+        rate = max(acceptance * alpha, min_acceptance)
+
+        while len(accepted) < n_particles and n_simulations < max_simulations:
+
+            # Expected number of runs needed, in multiples of the number of workers
+            n_batch = int(np.ceil((n_particles - len(accepted)) / rate / n_workers)) * n_workers
+            n_batch = min(n_batch, max_simulations - n_simulations)
+
+            rng = np.random.default_rng([seed, generation, n_runs])
+            proposals = propose(population, weights, sigma, n_batch, rng)
+            batch_distances = np.array(pool.map(discrepancy, list(proposals), chunksize=1))
+
+            n_runs += n_batch
+            n_simulations += n_batch
+
+            within = batch_distances <= epsilon
+            accepted.extend(proposals[within])
+            accepted_distances.extend(batch_distances[within])
+            rate = len(accepted) / n_runs
+
+            if rate < min_acceptance:
+                break
+
+        if len(accepted) < n_particles:
+            print(f"Generation {generation} unfinished after {n_runs} runs (acceptance {len(accepted) / n_runs:.3f}), "
+                  f"{len(accepted)} of {n_particles} particles accepted: stop", flush=True)
+            break
+
+        accepted = np.array(accepted[:n_particles])
+        weights = importance_weights(accepted, population, weights, sigma)
+        population, distances = accepted, np.array(accepted_distances[:n_particles])
+        acceptance = len(accepted_distances) / n_runs
+
+        history.append({'generation': generation, 'epsilon': epsilon, 'n_particles': n_particles,
+                        'n_simulations': n_runs, 'acceptance': acceptance, 'ess': 1 / np.sum(weights**2)})
+        posterior = write_results(prefix, population, weights, distances, generation, history)
+        print(json.dumps(history[-1]), flush=True)
+
+    print(f"{n_simulations} runs, posterior of {len(posterior)} particles "
+          f"(generation {history[-1]['generation']}) written in {prefix}_posterior.csv")
+
+    return posterior, history
+
+if __name__ == '__main__':
+
+    species = sys.argv[1]
+    preySatVersion = sys.argv[2]
+    folder_path = sys.argv[3]
+    folder_path_calibration = sys.argv[4]
+    file_obs_data = sys.argv[5]
+    stages = sys.argv[6].split(',')
+    months = [int(m) for m in sys.argv[7].split(',')]
+    gamma = float(sys.argv[8])
+    n_workers = int(sys.argv[9])
+    n_particles = int(sys.argv[10])
+    prefix = sys.argv[11]
+    max_simulations = int(sys.argv[12]) if len(sys.argv) > 12 else MAX_SIMULATIONS
+    alpha = float(sys.argv[13]) if len(sys.argv) > 13 else ALPHA
+    max_generations = int(sys.argv[14]) if len(sys.argv) > 14 else MAX_GENERATIONS
+
+    if preySatVersion not in SCENARIOS:
+        raise ValueError(f"Unknown preySatVersion: {preySatVersion} ({', '.join(SCENARIOS)})")
+
+    obs_path = f"{folder_path_calibration}{file_obs_data}"
+    cells = list(observation_cells(load_observations(obs_path), species, stages, months))
+    os.makedirs(folder_path, exist_ok=True)
+
+    # Forcing computed once, shared copy-on-write with the workers
+    shared, env = forcing_environment(coltrane_forcing(*FORCING_ARGS), FORCING_ARGS)
+    os.environ.update(env)
+
+    try:
+        with Pool(n_workers, initializer=init_worker,
+                  initargs=(species, preySatVersion, folder_path, obs_path, stages, months, gamma, cells)) as pool:
+            abc_smc(pool, n_workers, n_particles, prefix, alpha, max_generations, max_simulations)
+    finally:
+        shared.close()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the calibration hot paths on synthetic Coltrane outputs
+
+Generate synthetic pop/popts dicts (time x copepod x strategy), model outputs
+and observation tables at several scales, time the selection, extraction, cost
+and merging functions with their peak memory and write the results as JSON.
+Two JSON files can then be compared to spot regressions:
+
+    python benchmark_calibration.py bench.json small,medium
+    python benchmark_calibration.py compare bench_before.json bench_after.json
+
+If the model submodule is not available, the selection and summary
+benchmarks run on private copies of their modules using synthetic D_to_stage
+and yearday functions (see synthetic_model_modules): their results are
+labelled 'synthetic' and compare warns if the label differs between the two
+files. The benchmarks that need the model itself (extraction) are skipped and
+reported as such.
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import sys
+
+sys.path.append('./model')
+
+from RMSE_cost_function import cost_function
+from compute_MMD_cost import compute_weighted_mmd
+from compute_all_costs import score_model_outputs
+from merge_pickle_files import merge_pickle_files
+from popts_store import save_popts, load_popts
+from ingest_observations import OBS_DTYPE, SPECIES_CODES, STAGES
+
+import os
+import gc
+import json
+import time
+import types
+import pickle
+import importlib.util
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+import pandas as pd
+from contextlib import redirect_stdout
+from datetime import datetime
+
+## Shapes of popts (time, copepod, strategy) and sizes of the model outputs
+SCALES = {'small': {'n_years': 2, 'n_cop': 12, 'n_strat': 4, 'n_ind': 200, 'n_obs': 100, 'n_files': 50},
+          'medium': {'n_years': 4, 'n_cop': 36, 'n_strat': 16, 'n_ind': 1000, 'n_obs': 300, 'n_files': 200},
+          'large': {'n_years': 6, 'n_cop': 73, 'n_strat': 64, 'n_ind': 4000, 'n_obs': 1000, 'n_files': 1000}
+          }
+
+## Modules loaded with the synthetic model functions if the model submodule is not available
+SYNTHETIC_MODULES = ['select_C4_C6_ind_repro', 'summary_data_sp_scenario_10best_for_figures']
+
+def synthetic_D_to_stage(D):
+    """Stage (1-13) from the development D (0-1), all the stages lasting the same D (NaN kept)."""
+    return np.clip(1 + np.floor(np.asarray(D, dtype=float) * 12), 1, 13)
+
+def synthetic_yearday(t):
+    """Day of the year (1-365) of the model days t (1-365*n)."""
+    return np.mod(np.asarray(t) - 1, 365) + 1
+
+def synthetic_model_modules():
+    """
+    Private copies of the SYNTHETIC_MODULES whose D_to_stage and yearday are
+    synthetic_D_to_stage and synthetic_yearday, for the benchmarks without
+    the model submodule. The synthetic modules are only in sys.modules while
+    the copies are loaded, the state of sys.modules is restored after.
+
+    Returns
+    -------
+    modules : dict
+        Module name -> private copy of the module.
+
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    synthetic = {'D_to_stage': synthetic_D_to_stage, 'yearday': synthetic_yearday}
+    names = [*synthetic, *SYNTHETIC_MODULES]
+    saved = {name: sys.modules.get(name) for name in names}
+    modules = {}
+
+    try:
+        for name, func in synthetic.items():
+            sys.modules[name] = types.ModuleType(name)
+            setattr(sys.modules[name], name, func)
+
+        # In order, the summary script importing the selection module
+        for name in SYNTHETIC_MODULES:
+            spec = importlib.util.spec_from_file_location(name, os.path.join(root, f'{name}.py'))
+            modules[name] = sys.modules[name] = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(modules[name])
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+    return modules
+
+def synthetic_population(n_years, n_cop, n_strat, seed=0):
+    """
+    Synthetic pop and popts dicts shaped like the outputs of coltrane_population.
+    Each copepod spawns at a different date, develops linearly (D from 0 to 1),
+    and popts are NaN before spawning and after death.
+
+    Parameters
+    ----------
+    n_years : int
+        Number of simulated years (daily time step).
+    n_cop : int
+        Number of copepods (spawning dates).
+    n_strat : int
+        Number of strategies.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    pop : dict
+        Population metrics ('tEcen', 'F2', 'capfrac', 't0', 'Wa'), n_cop x n_strat.
+    popts : dict
+        Time series ('D', 'R', 'W', 't'), n_time x n_cop x n_strat.
+
+    """
+    rng = np.random.default_rng(seed)
+    n_time = 365 * n_years
+
+    t = np.broadcast_to(np.arange(1., n_time + 1)[:, None, None], (n_time, n_cop, n_strat)).copy()
+    t0 = np.broadcast_to(np.linspace(1, 365, n_cop)[:, None], (n_cop, n_strat)).copy()
+    death = t0 + rng.uniform(300, 365 * n_years, (n_cop, n_strat))
+
+    D = np.minimum((t - t0) * rng.uniform(1 / 500, 1 / 250, (n_cop, n_strat)), 1.)
+    D[(t < t0) | (t > death)] = np.nan
+
+    W = 1 + 1000 * D
+    R = W * rng.uniform(0.2, 0.8, (n_cop, n_strat))
+
+    pop = {'tEcen': np.where(rng.random((n_cop, n_strat)) < 0.7, t0 + 365, np.nan),
+           'F2': rng.random((n_cop, n_strat)),
+           'capfrac': rng.random((n_cop, n_strat)),
+           't0': t0,
+           'Wa': rng.uniform(100, 1000, (n_cop, n_strat))
+           }
+    popts = {'D': D, 'R': R, 'W': W, 't': t}
+
+    return pop, popts
+
+def synthetic_model_outputs(n_ind, n_days=40, species='Calanus hyperboreus', seed=0):
+    """
+    Synthetic model outputs shaped like the ones of run_coltrane_save_outputs:
+    n_ind individuals per stage, each seen during n_days days around August.
+    """
+    rng = np.random.default_rng(seed)
+
+    outputs = {'params': {'u0': 0.006, 'I0': 0.4, 'Ks': 1., 'KsIA': 0.3, 'maxReserveFrac': 0.8, 'rm': 0.1,
+                          'tdia_exit': 60, 'tdia_enter': 280, 'preySatVersion': 'default'},
+               'species': species
+               }
+
+    for stage in STAGES:
+        n = n_ind * n_days
+        outputs[f'{stage}_reserves_all'] = rng.gamma(3, 300, n)
+        outputs[f'{stage}_weight_all'] = outputs[f'{stage}_reserves_all'] / rng.uniform(0.4, 0.9, n)
+        outputs[f'{stage}_fitness_all'] = rng.random(n_ind)
+        outputs[f'{stage}_yday'] = (np.tile(np.arange(200., 200 + n_days), n_ind) + 365 * rng.integers(0, 3, n))
+        outputs[f'{stage}_ind_idx'] = np.repeat(np.arange(n_ind), n_days)
+
+    return outputs
+
+def synthetic_observations(n_obs, seed=0):
+    """Synthetic observation table (n_obs per species and stage, in August)."""
+    rng = np.random.default_rng(seed)
+
+    n = n_obs * len(SPECIES_CODES) * len(STAGES)
+    obs = np.empty(n, dtype=OBS_DTYPE)
+    obs['species'] = np.repeat(list(SPECIES_CODES.values()), n_obs * len(STAGES))
+    obs['stage'] = np.tile(np.repeat(list(STAGES.values()), n_obs), len(SPECIES_CODES))
+    obs['month'] = 8
+    obs['month_true'] = 8
+    obs['total_lipids_ugC'] = rng.gamma(3, 300, n)
+    obs['fullness_ratio_carbon_volume'] = rng.uniform(0.4, 0.95, n)
+
+    return pd.DataFrame(obs)
+
+def measure(func, repeat):
+    """
+    Time a function (best and mean of repeat calls) and measure its peak
+    memory with tracemalloc on an additional call.
+    """
+    times = []
+
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'time_min_s': min(times),
+            'time_mean_s': float(np.mean(times)),
+            'peak_memory_mb': peak / 1e6,
+            'repeat': repeat
+            }
+
+def benchmarks(scale, tmp_dir):
+    """
+    Benchmarks of one scale, as (name, function, repeat) tuples, the
+    benchmarks that were skipped with the reason and the names of the
+    benchmarks run with the synthetic model functions.
+    """
+    size = SCALES[scale]
+    pop, popts = synthetic_population(size['n_years'], size['n_cop'], size['n_strat'])
+    model = synthetic_model_outputs(size['n_ind'])
+    obs = synthetic_observations(size['n_obs'])
+
+    obs_lip = obs['total_lipids_ugC'].values[:size['n_obs']]
+    mod_lip = np.column_stack([model['C5_reserves_all'][::40], model['C5_fitness_all']])
+
+    rng = np.random.default_rng(1)
+    X = rng.random((size['n_obs'], 2))
+    Y = rng.random((size['n_ind'], 2))
+    w = rng.random(size['n_ind'])
+
+    cases = [('cost_function', lambda: cost_function(obs_lip, mod_lip), 20),
+             ('compute_weighted_mmd', lambda: compute_weighted_mmd(X, Y, w, gamma=5), 5),
+             ('score_model_outputs', lambda: score_model_outputs(model, obs, list(STAGES), [8], [5]), 3)]
+    skipped = {}
+
+    ## Compressed and chunked popts (zlib, float32)
+    popts_path = os.path.join(tmp_dir, f'popts_{scale}.chunks')
+    save_popts(popts, popts_path, float32=True)
+
+    cases += [('save_popts', lambda: save_popts(popts, popts_path, float32=True), 3),
+              ('load_popts', lambda: load_popts(popts_path), 3)]
+
+    ## Merge of small cost files
+    merge_dir = os.path.join(tmp_dir, f'costs_{scale}')
+    os.makedirs(merge_dir, exist_ok=True)
+    outputs_rmse, _ = score_model_outputs(model, obs, list(STAGES), [8], [5])
+    for n in range(size['n_files']):
+        with open(os.path.join(merge_dir, f'cost_{n}.pkl'), 'wb') as f:
+            pickle.dump(outputs_rmse, f)
+
+    def merge():
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            merge_pickle_files(merge_dir, tmp_dir, f'merged_{scale}.pkl')
+
+    cases.append(('merge_pickle_files', merge, 3))
+
+    ## Functions depending on the Coltrane model (synthetic D_to_stage and yearday if not available)
+    synthetic = set()
+    try:
+        from select_C4_C6_ind_repro import select_C4_C6_repro
+        from summary_data_sp_scenario_10best_for_figures import run_summary_sp_scenario_for_figures
+    except ImportError:
+        modules = synthetic_model_modules()
+        select_C4_C6_repro = modules['select_C4_C6_ind_repro'].select_C4_C6_repro
+        run_summary_sp_scenario_for_figures = modules['summary_data_sp_scenario_10best_for_figures'].run_summary_sp_scenario_for_figures
+        synthetic = {'select_C4_C6_repro', 'select_C4_C6_repro_august', 'summary_10best_for_figures'}
+
+    try:
+        from coltrane_save_outputs_for_multiple_costs import extract_C4_C6_outputs
+    except ImportError as e:
+        skipped['extract_C4_C6_outputs'] = f'model submodule not available ({e})'
+    else:
+        select_popts = select_C4_C6_repro(popts, pop)
+        cases.append(('extract_C4_C6_outputs', lambda: extract_C4_C6_outputs(select_popts, pop, {}), 3))
+
+    cases.append(('select_C4_C6_repro', lambda: select_C4_C6_repro(popts, pop), 3))
+    cases.append(('select_C4_C6_repro_august', lambda: select_C4_C6_repro(popts, pop, [8]), 3))
+
+    summary_dir = os.path.join(tmp_dir, f'figures_{scale}')
+    save_dir = os.path.join(tmp_dir, f'summary_{scale}')
+    os.makedirs(summary_dir, exist_ok=True)
+    os.makedirs(save_dir, exist_ok=True)
+    with open(os.path.join(summary_dir, 'coltrane_outputs_hyperboreus_IA_0_pop.pkl'), 'wb') as f:
+        pickle.dump(pop, f)
+    with open(os.path.join(summary_dir, 'coltrane_outputs_hyperboreus_IA_0_popts.pkl'), 'wb') as f:
+        pickle.dump(popts, f)
+
+    params_df = pd.DataFrame([{**model['params'], 'id': 0, 'species': 'hyperboreus', 'scenario': 'IA', 'cost': 0.}])
+    path_params_df = os.path.join(tmp_dir, 'params_to_run_for_figures_cost.txt')
+    params_df.to_csv(path_params_df, index=False)
+
+    def summary():
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            run_summary_sp_scenario_for_figures(path_params_df, summary_dir, save_dir)
+
+    cases.append(('summary_10best_for_figures', summary, 1))
+
+    return cases, skipped, synthetic
+
+def git_commit():
+    """Commit of the repository, if available."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(output_file, scales):
+    """
+    Run the benchmarks at the given scales and write the results as JSON.
+
+    Parameters
+    ----------
+    output_file : str
+        Path of the JSON file.
+    scales : list
+        Scales to run (keys of SCALES).
+
+    Returns
+    -------
+    results : dict
+        Benchmark results.
+
+    """
+    results = {'meta': {'date': datetime.now().isoformat(timespec='seconds'),
+                        'commit': git_commit(),
+                        'python': platform.python_version(),
+                        'numpy': np.__version__,
+                        'pandas': pd.__version__,
+                        'machine': platform.platform(),
+                        'scales': {scale: SCALES[scale] for scale in scales}
+                        },
+               'results': [],
+               'skipped': []
+               }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in scales:
+            cases, skipped, synthetic = benchmarks(scale, tmp_dir)
+
+            for name, func, repeat in cases:
+                result = {'name': name, 'scale': scale, 'synthetic': name in synthetic, **measure(func, repeat)}
+                results['results'].append(result)
+                label = ' (synthetic D_to_stage)' if result['synthetic'] else ''
+                print(f"{scale:>6} {name:<28} {result['time_min_s']:10.4f} s {result['peak_memory_mb']:10.1f} MB{label}")
+
+            for name, reason in skipped.items():
+                results['skipped'].append({'name': name, 'scale': scale, 'reason': reason})
+                print(f"{scale:>6} {name:<28} skipped: {reason}")
+
+    if results['skipped']:
+        print(f"{len(results['skipped'])} benchmarks skipped")
+
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    return results
+
+def compare_benchmarks(file_before, file_after):
+    """
+    Print the time and memory ratios (after / before) of the benchmarks
+    present in both files, then the benchmarks missing or skipped in one of
+    them.
+    """
+    with open(file_before) as f:
+        results_before = json.load(f)
+    with open(file_after) as f:
+        results_after = json.load(f)
+
+    before = {(r['name'], r['scale']): r for r in results_before['results']}
+    after = {(r['name'], r['scale']): r for r in results_after['results']}
+
+    print(f"{'scale':>6} {'benchmark':<28} {'time':>10} {'memory':>10}")
+    for key in sorted(before.keys() & after.keys(), key=lambda k: (k[1], k[0])):
+        time_ratio = after[key]['time_min_s'] / before[key]['time_min_s']
+        memory_ratio = after[key]['peak_memory_mb'] / max(before[key]['peak_memory_mb'], 1e-9)
+
+        # The timings with the synthetic model functions are not comparable with the model ones
+        synthetic = (before[key].get('synthetic', False), after[key].get('synthetic', False))
+        label = f" (synthetic D_to_stage {'after' if synthetic[1] else 'before'} only)" if synthetic[0] != synthetic[1] else ''
+        print(f"{key[1]:>6} {key[0]:<28} {time_ratio:9.2f}x {memory_ratio:9.2f}x{label}")
+
+    reasons = {label: {(r['name'], r['scale']): r['reason'] for r in results.get('skipped', [])}
+               for label, results in [('before', results_before), ('after', results_after)]}
+    for key in sorted(before.keys() ^ after.keys(), key=lambda k: (k[1], k[0])):
+        label = 'after' if key in before else 'before'
+        print(f"{key[1]:>6} {key[0]:<28} not run {label}: {reasons[label].get(key, 'not in the file')}")
+
+if __name__ == '__main__':
+
+    if sys.argv[1] == 'compare':
+        compare_benchmarks(sys.argv[2], sys.argv[3])
+    else:
+        scales = sys.argv[2].split(',') if len(sys.argv) > 2 else ['small', 'medium']
+        run_benchmarks(sys.argv[1], scales)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bootstrap resampling of the observations for the costs uncertainty.
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import numpy as np
+
+def bootstrap_indices(n, n_boot, rng):
+    """
+    Draw n_boot resamples (with replacement) of n observations at once.
+
+    Parameters
+    ----------
+    n : int
+        Number of observations.
+    n_boot : int
+        Number of bootstrap resamples.
+    rng : numpy.random.Generator
+        Random generator. Using the same seed for all the model outputs gives
+        the same resamples to all of them, which keeps their costs comparable.
+
+    Returns
+    -------
+    boot_idx : array
+        n_boot x n matrix of observation indices.
+
+    """
+    return rng.integers(0, n, size=(n_boot, n))
+
+def bootstrap_counts(boot_idx, n):
+    """
+    Number of times each observation is drawn in each resample.
+
+    Parameters
+    ----------
+    boot_idx : array
+        n_boot x n matrix of observation indices (from bootstrap_indices).
+    n : int
+        Number of observations.
+
+    Returns
+    -------
+    counts : array
+        n_boot x n matrix of counts, computed with a single np.bincount.
+
+    """
+    n_boot = boot_idx.shape[0]
+    offsets = np.arange(n_boot)[:, None] * n
+
+    return np.bincount((boot_idx + offsets).ravel(), minlength=n_boot * n).reshape(n_boot, n)
+
+def bootstrap_summary(cost_boot, alpha=0.05):
+    """
+    Summarize the bootstrap costs of one stage and month.
+
+    Parameters
+    ----------
+    cost_boot : array
+        Bootstrap costs.
+    alpha : float
+        The confidence interval is the (alpha/2, 1-alpha/2) percentile interval.
+
+    Returns
+    -------
+    summary : dict
+        Mean, standard deviation and confidence interval of the costs.
+
+    """
+    cost_boot = np.asarray(cost_boot, dtype=float)
+
+    if np.all(np.isnan(cost_boot)):
+        return {'mean': np.nan, 'std': np.nan, 'ci_low': np.nan, 'ci_high': np.nan}
+
+    ci_low, ci_high = np.nanpercentile(cost_boot, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+
+    return {'mean': np.nanmean(cost_boot),
+            'std': np.nanstd(cost_boot),
+            'ci_low': ci_low,
+            'ci_high': ci_high
+            }
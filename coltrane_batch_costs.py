@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run Coltrane and compute the costs of all the species and scenarios of one paramosome
+
+The LHS paramosomes are the same for C. glacialis and C. hyperboreus (only u0
+differs) and for the IA and noIA scenarios (only preySatVersion differs). A
+batch runs all these variants of one LHS point in the same process: the
+forcing is computed once, the observations are loaded once and their cells
+(per species, stage and month) and bins are prepared once, the model outputs
+are scored in memory, and the costs and run statistics of all the variants
+are written in one record.
+
+    python coltrane_batch_costs.py 0.35 1.01 0.23 0.89 0.06 127 324 ./batch_sim2 ./ observations_for_calibration.npy C4,C5,C6 8 5
+
+The records are merged into the usual merged cost files (see merge_pickle_files.py):
+
+    python coltrane_batch_costs.py merge ./batch_sim2 ./ sim2
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import sys
+
+sys.path.append('./model')
+
+from coltrane_forcing import coltrane_forcing
+from coltrane_save_outputs_for_multiple_costs import simulate_outputs
+from compute_all_costs import model_individuals, score_individuals, observation_cells, parse_binning, BINNING, ALL_MONTHS
+from create_txt_file_paramosomes_multisp_u0fix import SPECIES_DEV_RATES, PARAM_BOUNDS
+from ingest_observations import load_observations, STAGES
+from merge_pickle_files import append_outputs, newest_records, report_conflicts, record_time
+from prefetch_loader import load_pickles
+from rank_costs import SCENARIOS
+from run_cache import FORCING_ARGS, SIMULATION_SOURCES, COST_SOURCES, run_key, simulation_key, code_version, file_digest, dedup_key, atomic_pickle_dump
+from run_manifest import run_record
+from run_metrics import RunMetrics
+from shard_store import output_exists, save_output, list_outputs, read_output
+from shared_arrays import shared_forcing
+from run_profiler import profile_run
+
+import os
+import copy
+import json
+import time
+
+## Parameters sampled by the Latin hypercube, shared by all the variants
+LHS_PARAMS = list(PARAM_BOUNDS)
+
+## Variants of a paramosome: all the species and scenarios (preySatVersion)
+VARIANTS = [(species, preySatVersion) for species in SPECIES_DEV_RATES for preySatVersion in SCENARIOS]
+
+def variant_params(lhs_params, species, preySatVersion):
+    """Paramosome of one variant, as built by run_coltrane_save_outputs."""
+
+    return {'u0': SPECIES_DEV_RATES[species],
+            **{param: lhs_params[param] for param in LHS_PARAMS},
+            'preySatVersion': preySatVersion
+            }
+
+def batch_file_path(folder_path, key):
+    """Path of the record of a batch."""
+
+    return f'{folder_path}/coltrane_batch_{key}.pkl'
+
+def batch_key(lhs_params, obs_path, stages, months, gammas, n_boot, binning, joint, variants):
+    """Key of the record of a batch: paramosome, variants, observations, code and cost settings."""
+
+    return run_key(lhs=lhs_params, variants=variants, forcing=FORCING_ARGS,
+                   simulation=code_version(SIMULATION_SOURCES), cost=code_version(COST_SOURCES),
+                   obs=file_digest(obs_path), stages=sorted(stages), months=sorted(months),
+                   gammas=sorted(float(g) for g in gammas), n_boot=int(n_boot), binning=binning, joint=joint)
+
+def run_batch(lhs_params, folder_path, obs_path, stages, months, gammas, n_boot=0, binning=None, joint=False, shard=False, variants=None):
+    """
+    Run Coltrane for all the variants of one LHS paramosome and compute their
+    RMSE and MMD costs, sharing the forcing, the observations and the bins.
+
+    Parameters
+    ----------
+    lhs_params: dict
+        Values of the LHS_PARAMS.
+    folder_path: str
+        Folder of the batch records.
+    obs_path: str
+        Observations file (csv or npy from ingest_observations).
+    stages: list
+        Stages to consider (C4, C5 and/or C6).
+    months: list
+        Months to consider.
+    gammas: list
+        Kernel widths of the MMD costs.
+    n_boot: int
+        Number of bootstrap resamples of the observations (0 for no bootstrap).
+    binning: dict
+        Binning of each trait for the RMSE cost (default BINNING).
+    joint: bool
+        Add the joint (lipids x fullness) RMSE cost.
+    shard: bool
+        Append the record to the shard of the worker (see shard_store.py).
+    variants: list
+        (species, preySatVersion) to run (default VARIANTS).
+
+    Returns
+    -------
+    record: dict
+        'lhs_params', 'run_key', 'metrics' (shared phases) and 'variants', one
+        dict per variant with 'species', 'scenario', 'params',
+        'simulation_key', the 'RMSE' outputs, the 'MMD' outputs per gamma, the
+        'individuals' of all the stages and months (run statistics) and its
+        'metrics' (None if the record already exists).
+    """
+
+    metrics = RunMetrics()
+
+    variants = VARIANTS if variants is None else variants
+    binning = BINNING if binning is None else binning
+
+    ## Skip the paramosomes already run and scored with the same observations and code
+    key = batch_key(lhs_params, obs_path, stages, months, gammas, n_boot, binning, joint, variants)
+    file_path = batch_file_path(folder_path, key)
+
+    if output_exists(file_path):
+        print(f"Outputs already exist: {file_path}")
+        return None
+
+    ## Shared by all the variants
+    with metrics.phase('forcing'):
+        # Forcing shared by memory_runner.py, if any
+        forcing = shared_forcing(FORCING_ARGS)
+        is_shared = forcing is not None
+        if not is_shared:
+            forcing = coltrane_forcing(*FORCING_ARGS)
+
+    with metrics.phase('observation_load'):
+        obs_all = load_observations(obs_path)
+
+    obs_cells = {}
+
+    record = {'lhs_params': lhs_params, 'run_key': key, 'variants': []}
+
+    for species, preySatVersion in variants:
+
+        variant_metrics = RunMetrics()
+
+        params = variant_params(lhs_params, species, preySatVersion)
+        sim_key = simulation_key(params, species)
+
+        # Each variant gets its own forcing in case the model modifies it: a new
+        # copy-on-write mapping of the shared forcing, else a copy
+        variant_forcing = shared_forcing(FORCING_ARGS) if is_shared else copy.deepcopy(forcing)
+        outputs = simulate_outputs(params, species, variant_forcing, variant_metrics, key=sim_key)
+
+        with variant_metrics.phase('individuals'):
+            individuals = model_individuals(outputs, list(STAGES), ALL_MONTHS)
+
+        if species not in obs_cells:
+            with metrics.phase('observation_cells'):
+                obs_cells[species] = observation_cells(obs_all, species, stages, months)
+
+        outputs_rmse, outputs_mmd = score_individuals(individuals, params, species, obs_all, stages, months, gammas,
+                                                      n_boot, variant_metrics, binning=binning, joint=joint,
+                                                      obs_cells=obs_cells[species])
+
+        record['variants'].append({'species': species,
+                                   'scenario': SCENARIOS[preySatVersion],
+                                   'params': params,
+                                   'simulation_key': sim_key,
+                                   'RMSE': outputs_rmse,
+                                   'MMD': outputs_mmd,
+                                   'individuals': individuals,
+                                   'metrics': variant_metrics.to_dict()
+                                   })
+
+    # The serialization itself is only in the printed metrics
+    record['metrics'] = metrics.to_dict()
+
+    with metrics.phase('serialization'):
+        record['created'] = time.time()
+        save_output(record, file_path, shard)
+
+    print("Metrics:", json.dumps(metrics.to_dict()))
+
+    return record
+
+def merge_batch_records(input_files_path, output_file_path, suffix):
+    """
+    Merge the costs of the batch records of a folder into one merged file per
+    cost, with the same content as merge_pickle_files on the costs folders of
+    compute_all_costs: merged_RMSE_costs_files_{suffix}.pkl and
+    merged_MMD_costs_gam{gamma}_files_{suffix}.pkl. A variant run twice is
+    merged only once, from the newest record if their keys differ (see
+    merge_pickle_files.newest_records).
+
+    Returns
+    -------
+    None.
+    """
+
+    combined = {}
+
+    # A variant is identified by the key of its record (paramosome, observations, code and cost settings)
+    entries = ((dedup_key(variant['RMSE']), record['run_key'], record_time(file_path, record), file_path, variant)
+               for file_path, record in load_pickles(list_outputs(input_files_path), read=read_output)
+               for variant in record['variants'])
+
+    variants, n_duplicates, conflicts = newest_records(entries)
+    report_conflicts(conflicts)
+
+    for variant in variants:
+        combined['RMSE'] = append_outputs(combined.get('RMSE'), variant['RMSE'])
+        for gamma, outputs in variant['MMD'].items():
+            combined[gamma] = append_outputs(combined.get(gamma), outputs)
+
+    for cost, combined_data in combined.items():
+        if cost == 'RMSE':
+            name = f'merged_RMSE_costs_files_{suffix}.pkl'
+        else:
+            name = f'merged_MMD_costs_gam{cost:g}_files_{suffix}.pkl'
+
+        atomic_pickle_dump(combined_data, os.path.join(output_file_path, name))
+
+    print(f"Batch records have been successfully merged! ({n_duplicates} duplicates skipped, {len(conflicts)} conflicts)")
+
+if __name__ == '__main__':
+
+    if sys.argv[1] == 'merge':
+        merge_batch_records(sys.argv[2], sys.argv[3], sys.argv[4])
+        sys.exit()
+
+    lhs_params = dict(zip(LHS_PARAMS, [float(v) for v in sys.argv[1:6]] + [int(float(v)) for v in sys.argv[6:8]]))
+    folder_path = sys.argv[8]
+    folder_path_calibration = sys.argv[9]
+    file_obs_data = sys.argv[10]
+    stages = sys.argv[11].split(',')
+    months = [int(m) for m in sys.argv[12].split(',')]
+    gammas = [float(g) for g in sys.argv[13].split(',')]
+    n_boot = int(sys.argv[14]) if len(sys.argv) > 14 else 0
+    binning = parse_binning(sys.argv[15]) if len(sys.argv) > 15 and sys.argv[15] != '-' else None
+    joint = bool(int(sys.argv[16])) if len(sys.argv) > 16 else False
+    shard = bool(int(sys.argv[17])) if len(sys.argv) > 17 else False
+
+    run_id = ','.join(sys.argv[1:8])
+    with run_record('coltrane_batch_costs', run_id) as record, profile_run('coltrane_batch_costs', run_id, record):
+        batch = run_batch(lhs_params, folder_path, f"{folder_path_calibration}{file_obs_data}", stages, months, gammas,
+                          n_boot, binning, joint, shard)
+        record['cached'] = batch is None
+        if batch is not None:
+            record['metrics'] = batch['metrics']
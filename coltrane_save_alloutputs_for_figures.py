@@ -16,13 +16,19 @@ sys.path.append('./model')
 from coltrane_params import coltrane_params
 from coltrane_forcing import coltrane_forcing
 from coltrane_population import coltrane_population
-
+from run_metrics import RunMetrics
+from run_manifest import run_record
+from run_profiler import profile_run
+from run_cache import FORCING_ARGS, simulation_key, atomic_pickle_dump, atomic_write
+from popts_store import save_popts, POPTS_SUFFIX
+from shared_arrays import shared_forcing
+
+import os
+import json
 import numpy as np
-import pickle
-from datetime import datetime
 
 
-def run_coltrane_save_outputs(u0, I0, Ks, KsIA, maxReserveFrac, rm, preySatVersion, unique_id, species, scenario, folder_path):
+def run_coltrane_save_outputs(u0, I0, Ks, KsIA, maxReserveFrac, rm, preySatVersion, unique_id, species, scenario, folder_path, popts_codec='pickle', float32=False):
     """
     Cost function for the Coltrane model. 
 
@@ -34,6 +40,11 @@ def run_coltrane_save_outputs(u0, I0, Ks, KsIA, maxReserveFrac, rm, preySatVersi
         Set of forcing, composed of prey and temperature (surface & deep) cycle over several years.
     obs: Dataframe
         Observations of one or the two traits (one or two columns).
+    popts_codec: str
+        'pickle' to pickle popts, or codec of the chunked popts file
+        ('zlib', 'lzma' or 'lz4', see popts_store.py).
+    float32: bool
+        Store the chunked popts in float32.
 
     Returns
     -------
@@ -41,8 +52,7 @@ def run_coltrane_save_outputs(u0, I0, Ks, KsIA, maxReserveFrac, rm, preySatVersi
         Output containing the RMSE for the specified paramosome and other information.
     """
     
-    ## Forcing
-    forcing = coltrane_forcing("NOW", 7)
+    metrics = RunMetrics()
     
     ## Construct the paramosome with the values to test
     params = {
@@ -60,6 +70,24 @@ def run_coltrane_save_outputs(u0, I0, Ks, KsIA, maxReserveFrac, rm, preySatVersi
         'dt_spawn': 30,
     }
     
+    ## Skip the runs already saved with the same params, forcing and code
+    ## (the metrics file is written last and contains the key of the run)
+    key = simulation_key(params, species, scenario)
+    metrics_file_path = f'{folder_path}/coltrane_outputs_{species}_{scenario}_{unique_id}_metrics.json'
+    
+    if os.path.exists(metrics_file_path):
+        with open(metrics_file_path) as file:
+            if json.load(file).get('run_key') == key:
+                print(f"Outputs already exist: {metrics_file_path}")
+                return None
+    
+    ## Forcing
+    with metrics.phase('forcing'):
+        # Copy-on-write forcing shared by memory_runner.py, if any
+        forcing = shared_forcing(FORCING_ARGS)
+        if forcing is None:
+            forcing = coltrane_forcing(*FORCING_ARGS)
+    
     p = coltrane_params(**params)
     
     ## Run Coltrane to create a population and keep the time serie
@@ -67,7 +95,8 @@ def run_coltrane_save_outputs(u0, I0, Ks, KsIA, maxReserveFrac, rm, preySatVersi
     print("Params:", params)
 
     try:
-        pop, popts = coltrane_population(forcing, p, 2)
+        with metrics.phase('simulation'):
+            pop, popts = coltrane_population(forcing, p, 2)
     except Exception as e:
         print("ERROR during coltrane_population:", e)
         sys.exit(1)
@@ -79,16 +108,30 @@ def run_coltrane_save_outputs(u0, I0, Ks, KsIA, maxReserveFrac, rm, preySatVersi
     pop_file_path = f'{folder_path}/coltrane_outputs_{species}_{scenario}_{unique_id}_pop.pkl'
     popts_file_path = f'{folder_path}/coltrane_outputs_{species}_{scenario}_{unique_id}_popts.pkl'
 
-    with open(pop_file_path, 'wb') as file:
-        pickle.dump(pop, file)
-        
-    with open(popts_file_path, 'wb') as file:
-        pickle.dump(popts, file)
+    with metrics.phase('serialization'):
+        atomic_pickle_dump(pop, pop_file_path)
+        if popts_codec == 'pickle':
+            atomic_pickle_dump(popts, popts_file_path)
+        else:
+            save_popts(popts, f'{folder_path}/coltrane_outputs_{species}_{scenario}_{unique_id}{POPTS_SUFFIX}', codec=popts_codec, float32=float32)
+    
+    # The metrics are stored next to the outputs
+    metrics_json = json.dumps({'params': params, 'species': species, 'scenario': scenario, 'id': unique_id,
+                               'run_key': key, 'metrics': metrics.to_dict()})
+    atomic_write(metrics_file_path, lambda file: file.write(metrics_json.encode()))
+    
+    return metrics.to_dict()
 
 if __name__ == '__main__':
     
     print("[DEBUG] Script started with args:", sys.argv)
     
-    run_coltrane_save_outputs(float(sys.argv[1]), float(sys.argv[2]), float(sys.argv[3]), float(sys.argv[4]), float(sys.argv[5]), float(sys.argv[6]), sys.argv[7], sys.argv[8], sys.argv[9], sys.argv[10], sys.argv[11])
+    run_id = f'{sys.argv[9]}_{sys.argv[10]}_{sys.argv[8]}'
+    with run_record('coltrane_save_alloutputs_for_figures', run_id) as record, profile_run('coltrane_save_alloutputs_for_figures', run_id, record):
+        metrics = run_coltrane_save_outputs(float(sys.argv[1]), float(sys.argv[2]), float(sys.argv[3]), float(sys.argv[4]), float(sys.argv[5]), float(sys.argv[6]), sys.argv[7], sys.argv[8], sys.argv[9], sys.argv[10], sys.argv[11],
+                                            sys.argv[12] if len(sys.argv) > 12 else 'pickle', bool(int(sys.argv[13])) if len(sys.argv) > 13 else False)
+        record['cached'] = metrics is None
+        if metrics is not None:
+            record['metrics'] = metrics
 
     print("Coltrane outputs saved")
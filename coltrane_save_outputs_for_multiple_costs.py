@@ -17,59 +17,134 @@ from coltrane_params import coltrane_params
 from coltrane_forcing import coltrane_forcing
 from coltrane_population import coltrane_population
 from select_C4_C6_ind_repro import select_C4_C6_repro
-
+from run_metrics import RunMetrics
+from run_manifest import run_record
+from run_cache import FORCING_ARGS, simulation_key
+from shard_store import output_exists, save_output
+from shared_arrays import shared_forcing
+from run_profiler import profile_run
+
+import json
 import numpy as np
-import pickle
-from datetime import datetime
 
 
-def run_coltrane_save_outputs(I0, Ks, KsIA, maxReserveFrac, rm, tdia_exit, tdia_enter, u0, species, preySatVersion, folder_path):
+def extract_C4_C6_outputs(select_popts, pop, outputs):
     """
-    Cost function for the Coltrane model. 
+    Extract the reserves, weight, fitness, day and individual index of the C4, C5
+    and C6 individuals that have reproduced, as flat arrays stored in outputs
+    (keys 'C4_reserves_all', 'C4_weight_all', 'C4_fitness_all', 'C4_yday', 'C4_ind_idx', ...).
 
     Parameters
     ----------
-    params: dict
-        Parameters to test.
-    forcing: dict
-        Set of forcing, composed of prey and temperature (surface & deep) cycle over several years.
-    obs: Dataframe
-        Observations of one or the two traits (one or two columns).
+    select_popts: dict
+        Population time series with the 'mask' key from select_C4_C6_repro.
+    pop: dict
+        Population metrics from coltrane_population.
+    outputs: dict
+        Outputs to fill.
 
     Returns
     -------
-    out: dict
-        Output containing the RMSE for the specified paramosome and other information.
+    outputs: dict
+        Same outputs with the C4 to C6 keys.
     """
     
-    ## Forcing
-    forcing = coltrane_forcing("NOW", 7)
+    unique = np.unique(select_popts['mask'], return_counts=False)
     
-    ## Construct the paramosome with the values to test
-    params = {
-        'u0': u0,
-        'I0': I0,
-        'Ks': Ks,
-        'KsIA': KsIA,
-        'maxReserveFrac': maxReserveFrac,
-        'rm': rm,
-        'tdia_exit': tdia_exit,
-        'tdia_enter': tdia_enter,
-        'preySatVersion': preySatVersion
-    }
+    for i in unique:
+        
+        if i not in (4, 5, 6):
+            continue
+        
+        stage = f'C{int(i)}'
+        
+        mask = (select_popts['mask'] == i)
+        t_idx, i_idx, j_idx = np.where(mask)
+    
+        ### Compute the mean reserves, mean weight and mean fitness for those individuals for each strategy
+        
+        ## Reserves
+        reserves = select_popts['R'].copy()
+        reserves[~mask] = np.nan
+        
+        reserves_all = reserves[~np.isnan(reserves)]
+
+        ## Weight
+        weight = select_popts['W'].copy()
+        weight[~mask] = np.nan
+        
+        weight_all = weight[~np.isnan(weight)]
+        
+        ## Fitness
+        mask_popshape = np.any(mask, axis=0)
+        
+        fitness = pop['F2'].copy()
+        fitness[~mask_popshape] = np.nan 
+        
+        fitness_all = fitness[~np.isnan(fitness)]
+    
+        ## Day of the year
+        yday = select_popts['t'].copy()
+        yday[~mask] = np.nan
+        
+        yday_all = yday[~np.isnan(yday)]
+        
+        ## Individual index
+        unique_pairs, inverse_idx = np.unique(list(zip(i_idx, j_idx)), axis=0, return_inverse=True)
+        
+        ind_idx = inverse_idx
+    
+        ### Save the outputs
+        outputs[f'{stage}_reserves_all'] = reserves_all
+        outputs[f'{stage}_weight_all'] = weight_all
+        outputs[f'{stage}_fitness_all'] = fitness_all
+        outputs[f'{stage}_yday'] = yday_all
+        outputs[f'{stage}_ind_idx'] = ind_idx
+    
+    return outputs
+
+
+def simulate_outputs(params, species, forcing, metrics, months=None, key=None):
+    """
+    Run Coltrane for one paramosome with a given forcing and extract the C4 to
+    C6 individuals that have reproduced.
+
+    Parameters
+    ----------
+    params: dict
+        Paramosome (as built by run_coltrane_save_outputs).
+    species: str
+        Species of the paramosome.
+    forcing: dict
+        Forcing from coltrane_forcing.
+    metrics: RunMetrics
+        Metrics of the run, to which the simulation, selection and extraction
+        phases are added.
+    months: list
+        Only keep the individuals of these months (default: all the months).
+    key: str
+        Key of the run (simulation_key).
+
+    Returns
+    -------
+    outputs: dict
+        Model outputs as saved by run_coltrane_save_outputs (without metrics).
+    """
     
     p = coltrane_params(**params)
     
     ## Run Coltrane to create a population and keep the time serie
-    pop, popts = coltrane_population(forcing, p, 2)
+    with metrics.phase('simulation'):
+        pop, popts = coltrane_population(forcing, p, 2)
     
     ## Select the adults in August that have reproduced
-    select_popts = select_C4_C6_repro(popts, pop)
-    unique = np.unique(select_popts['mask'], return_counts=False)
+    with metrics.phase('selection'):
+        select_popts = select_C4_C6_repro(popts, pop, months)
     
     ## Initialize the outputs
     outputs = {'params': params, 
                'species': species,
+               'run_key': key,
                'C4_yday': [],
                'C5_yday': [],
                'C6_yday': [],
@@ -87,152 +162,91 @@ def run_coltrane_save_outputs(I0, Ks, KsIA, maxReserveFrac, rm, tdia_exit, tdia_
                'C6_ind_idx': [],
             }
     
-    for i in unique:
-        
-        if i == 4:
-            
-            mask = (select_popts['mask'] == i)
-            t_idx, i_idx, j_idx = np.where(mask)
-        
-            ### Compute the mean reserves, mean weight and mean fitness for those individuals for each strategy
-            
-            ## Reserves
-            reserves = select_popts['R'].copy()
-            reserves[~mask] = np.nan
-            
-            reserves_all = reserves[~np.isnan(reserves)]
-
-            ## Weight
-            weight = select_popts['W'].copy()
-            weight[~mask] = np.nan
-            
-            weight_all = weight[~np.isnan(weight)]
-            
-            ## Fitness
-            mask_popshape = np.any(mask, axis=0)
-            
-            fitness = pop['F2'].copy()
-            fitness[~mask_popshape] = np.nan 
-            
-            fitness_all = fitness[~np.isnan(fitness)]
-        
-            ## Day of the year
-            yday = select_popts['t'].copy()
-            yday[~mask] = np.nan
-            
-            yday_all = yday[~np.isnan(yday)]
-            
-            ## Individual index
-            unique_pairs, inverse_idx = np.unique(list(zip(i_idx, j_idx)), axis=0, return_inverse=True)
-            
-            ind_idx = inverse_idx
-        
-            ### Save the outputs
-            outputs['C4_reserves_all'] = reserves_all
-            outputs['C4_weight_all'] = weight_all
-            outputs['C4_fitness_all'] = fitness_all
-            outputs['C4_yday'] = yday_all
-            outputs['C4_ind_idx'] = ind_idx
-            
-        if i == 5:
-            
-            mask = (select_popts['mask'] == i)
-            t_idx, i_idx, j_idx = np.where(mask)
-        
-            ### Compute the mean reserves, mean weight and mean fitness for those individuals for each strategy
-            
-            ## Reserves
-            reserves = select_popts['R'].copy()
-            reserves[~mask] = np.nan
-            
-            reserves_all = reserves[~np.isnan(reserves)]
-
-            ## Weight
-            weight = select_popts['W'].copy()
-            weight[~mask] = np.nan
-            
-            weight_all = weight[~np.isnan(weight)]
-            
-            ## Fitness
-            mask_popshape = np.any(mask, axis=0)
-            
-            fitness = pop['F2'].copy()
-            fitness[~mask_popshape] = np.nan 
-            
-            fitness_all = fitness[~np.isnan(fitness)]
-        
-            ## Day of the year
-            yday = select_popts['t'].copy()
-            yday[~mask] = np.nan
-            
-            yday_all = yday[~np.isnan(yday)]
-            
-            ## Individual index
-            unique_pairs, inverse_idx = np.unique(list(zip(i_idx, j_idx)), axis=0, return_inverse=True)
-            
-            ind_idx = inverse_idx
-            
-            ### Save the outputs
-            outputs['C5_reserves_all'] = reserves_all
-            outputs['C5_weight_all'] = weight_all
-            outputs['C5_fitness_all'] = fitness_all
-            outputs['C5_yday'] = yday_all
-            outputs['C5_ind_idx'] = ind_idx
-            
-        if i == 6:
-            
-            mask = (select_popts['mask'] == i)
-            t_idx, i_idx, j_idx = np.where(mask)
-        
-            ### Compute the mean reserves, mean weight and mean fitness for those individuals for each strategy
-            
-            ## Reserves
-            reserves = select_popts['R'].copy()
-            reserves[~mask] = np.nan
-            
-            reserves_all = reserves[~np.isnan(reserves)]
-
-            ## Weight
-            weight = select_popts['W'].copy()
-            weight[~mask] = np.nan
-            
-            weight_all = weight[~np.isnan(weight)]
-            
-            ## Fitness
-            mask_popshape = np.any(mask, axis=0)
-            
-            fitness = pop['F2'].copy()
-            fitness[~mask_popshape] = np.nan 
-            
-            fitness_all = fitness[~np.isnan(fitness)]
-        
-            ## Day of the year
-            yday = select_popts['t'].copy()
-            yday[~mask] = np.nan
-            
-            yday_all = yday[~np.isnan(yday)]
-            
-            ## Individual index
-            unique_pairs, inverse_idx = np.unique(list(zip(i_idx, j_idx)), axis=0, return_inverse=True)
-            
-            ind_idx = inverse_idx
-            
-            ### Save the outputs
-            outputs['C6_reserves_all'] = reserves_all
-            outputs['C6_weight_all'] = weight_all
-            outputs['C6_fitness_all'] = fitness_all
-            outputs['C6_yday'] = yday_all
-            outputs['C6_ind_idx'] = ind_idx
-    
-    ### Save outputs into a file
-    
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f') # The name of the folder will contain the time
-    file_path = f'{folder_path}/coltrane_outputs_for_params_explo_{timestamp}.pkl'
-
-    with open(file_path, 'wb') as file:
-        pickle.dump(outputs, file)
+    with metrics.phase('extraction'):
+        extract_C4_C6_outputs(select_popts, pop, outputs)
+    
+    return outputs
+
+
+def run_coltrane_save_outputs(I0, Ks, KsIA, maxReserveFrac, rm, tdia_exit, tdia_enter, u0, species, preySatVersion, folder_path, shard=False, months=None):
+    """
+    Cost function for the Coltrane model. 
+
+    Parameters
+    ----------
+    params: dict
+        Parameters to test.
+    forcing: dict
+        Set of forcing, composed of prey and temperature (surface & deep) cycle over several years.
+    obs: Dataframe
+        Observations of one or the two traits (one or two columns).
+    shard: bool
+        Append the outputs to the shard of the worker in folder_path instead
+        of their own file (see shard_store.py).
+    months: list
+        Only keep the individuals of these months (default: all the months),
+        the stages being only computed for their time steps.
+
+    Returns
+    -------
+    out: dict
+        Output containing the RMSE for the specified paramosome and other information
+        (None if the outputs of this paramosome already exist).
+    """
+    
+    metrics = RunMetrics()
+    
+    ## Construct the paramosome with the values to test
+    params = {
+        'u0': u0,
+        'I0': I0,
+        'Ks': Ks,
+        'KsIA': KsIA,
+        'maxReserveFrac': maxReserveFrac,
+        'rm': rm,
+        'tdia_exit': tdia_exit,
+        'tdia_enter': tdia_enter,
+        'preySatVersion': preySatVersion
+    }
+    
+    ## Skip the paramosomes already run with the same forcing and code
+    key = simulation_key(params, species, months=months)
+    file_path = f'{folder_path}/coltrane_outputs_for_params_explo_{key}.pkl'
+    
+    if output_exists(file_path):
+        print(f"Outputs already exist: {file_path}")
+        return None
+    
+    ## Forcing
+    with metrics.phase('forcing'):
+        # Copy-on-write forcing shared by memory_runner.py, if any
+        forcing = shared_forcing(FORCING_ARGS)
+        if forcing is None:
+            forcing = coltrane_forcing(*FORCING_ARGS)
+    
+    ## Run Coltrane and extract the C4 to C6 individuals
+    outputs = simulate_outputs(params, species, forcing, metrics, months, key)
+    
+    # The serialization itself is only in the printed metrics
+    outputs['metrics'] = metrics.to_dict()
+    
+    ### Save outputs into a file (or the shard of the worker), named with the key of the paramosome
+
+    with metrics.phase('serialization'):
+        save_output(outputs, file_path, shard)
+    
+    print("Metrics:", json.dumps(metrics.to_dict()))
+    
+    return outputs
 
 if __name__ == '__main__':
     print('Save Coltrane outputs')
 
-    run_coltrane_save_outputs(float(sys.argv[1]), float(sys.argv[2]), float(sys.argv[3]), float(sys.argv[4]), float(sys.argv[5]), int(float(sys.argv[6])), int(float(sys.argv[7])), float(sys.argv[8]), sys.argv[9], sys.argv[10], sys.argv[11])
+    run_id = ','.join(sys.argv[1:11])
+    with run_record('coltrane_save_outputs_for_multiple_costs', run_id) as record, profile_run('coltrane_save_outputs_for_multiple_costs', run_id, record):
+        outputs = run_coltrane_save_outputs(float(sys.argv[1]), float(sys.argv[2]), float(sys.argv[3]), float(sys.argv[4]), float(sys.argv[5]), int(float(sys.argv[6])), int(float(sys.argv[7])), float(sys.argv[8]), sys.argv[9], sys.argv[10], sys.argv[11],
+                                            bool(int(sys.argv[12])) if len(sys.argv) > 12 else False,
+                                            [int(m) for m in sys.argv[13].split(',')] if len(sys.argv) > 13 else None)
+        record['cached'] = outputs is None
+        if outputs is not None:
+            record['metrics'] = outputs['metrics']
@@ -11,13 +11,79 @@ import sys
 
 sys.path.append('./model')
 
-import uuid
+from bootstrap_costs import bootstrap_indices, bootstrap_counts, bootstrap_summary
+from ingest_observations import load_observations, species_code, STAGES
+from run_metrics import RunMetrics
+from run_manifest import run_record
+from run_profiler import profile_run
+from run_cache import cost_key, cost_file_path, file_digest, atomic_pickle_dump
+from shard_store import output_exists, load_output
+
+import json
 import pandas as pd
 import numpy as np
 import time
-import pickle
-from datetime import datetime, timedelta
-from sklearn.metrics.pairwise import rbf_kernel
+from sklearn.metrics.pairwise import euclidean_distances
+
+def _weighted_mmd(X, Y, weights_Y, gamma, counts_X=None):
+    """
+    Biased weighted MMD for one or several gammas, sharing the squared distances
+    between the gammas. If counts_X (n_boot x n) is given, the MMD of each
+    bootstrap resample of X is also computed from the same kernels.
+    """
+    # Squared distances, shared between all the gammas
+    D_XX = euclidean_distances(X, X, squared=True)
+    D_YY = euclidean_distances(Y, Y, squared=True)
+    D_XY = euclidean_distances(X, Y, squared=True)
+
+    if gamma is None:
+        # Heuristic: median distance between all pairs in concatenated data
+        pairwise_dists = np.sqrt(np.concatenate([D_XX[np.triu_indices_from(D_XX, k=1)],
+                                                 D_YY[np.triu_indices_from(D_YY, k=1)],
+                                                 D_XY.ravel()]))
+        gamma = 1.0 / np.median(pairwise_dists)
+
+    gammas = np.atleast_1d(np.asarray(gamma, dtype=float))
+
+    # Normalize weights
+    weights_Y = weights_Y / np.sum(weights_Y)
+
+    # Buffers for the kernels, reused for each gamma
+    K_XX = np.empty_like(D_XX)
+    K_YY = np.empty_like(D_YY)
+    K_XY = np.empty_like(D_XY)
+
+    n = len(X)
+    mmd = np.empty(len(gammas))
+    mmd_boot = None if counts_X is None else np.empty((len(gammas), len(counts_X)))
+
+    for g, gam in enumerate(gammas):
+
+        # Compute kernels
+        np.multiply(D_XX, -gam, out=K_XX)
+        np.exp(K_XX, out=K_XX)
+        np.multiply(D_YY, -gam, out=K_YY)
+        np.exp(K_YY, out=K_YY)
+        np.multiply(D_XY, -gam, out=K_XY)
+        np.exp(K_XY, out=K_XY)
+
+        # MMD² biased (weighted)
+        K_XY_w = K_XY @ weights_Y
+        mmd_xx = np.sum(K_XX) / (n * n)
+        mmd_yy = weights_Y @ K_YY @ weights_Y
+        mmd_xy = np.sum(K_XY_w) / n
+
+        mmd2 = mmd_xx + mmd_yy - 2 * mmd_xy
+        mmd[g] = np.sqrt(mmd2)
+
+        if counts_X is not None:
+            # Same kernel sums, each observation weighted by its bootstrap count
+            mmd_xx_boot = np.sum((counts_X @ K_XX) * counts_X, axis=1) / (n * n)
+            mmd_xy_boot = (counts_X @ K_XY_w) / n
+
+            mmd_boot[g] = np.sqrt(mmd_xx_boot + mmd_yy - 2 * mmd_xy_boot)
+
+    return mmd, mmd_boot
 
 def compute_weighted_mmd(X, Y, weights_Y, gamma=None):
     """
@@ -25,43 +91,48 @@ def compute_weighted_mmd(X, Y, weights_Y, gamma=None):
     - X: n x d array (observations)
     - Y: m x d array (model predictions)
     - weights_Y: m array (weights, e.g. fitness)
-    - gamma: kernel width (if None, will use 1 / median pairwise distance)
+    - gamma: kernel width, or array of kernel widths (if None, will use 1 / median pairwise distance)
+
+    The squared distances are computed once and shared between all the gammas,
+    only the exponential of the kernels is computed for each gamma.
 
     Returns:
-        MMD² value
+        MMD² value, or array of MMD² values (one per gamma) if gamma is an array
     """
-    if gamma is None:
-        # Heuristic: median distance between all pairs in concatenated data
-        all_data = np.vstack([X, Y])
-        pairwise_dists = np.linalg.norm(all_data[:, None, :] - all_data[None, :, :], axis=2)
-        gamma = 1.0 / np.median(pairwise_dists[np.triu_indices_from(pairwise_dists, k=1)])
+    mmd, _ = _weighted_mmd(X, Y, weights_Y, gamma)
 
-    # Compute kernels
-    K_XX = rbf_kernel(X, X, gamma=gamma)
-    K_YY = rbf_kernel(Y, Y, gamma=gamma)
-    K_XY = rbf_kernel(X, Y, gamma=gamma)
+    if np.ndim(gamma) == 0:
+        return mmd[0]
 
-    # Normalize weights
-    weights_Y = weights_Y / np.sum(weights_Y)
+    return mmd
 
-    # MMD² biased (weighted)
-    n = len(X)
-    mmd_xx = np.sum(K_XX) / (n * n)
-    mmd_yy = np.sum(weights_Y[:, None] * weights_Y[None, :] * K_YY)
-    mmd_xy = np.sum(K_XY @ weights_Y) / n
+def compute_weighted_mmd_bootstrap(X, Y, weights_Y, boot_idx, gamma=None):
+    """
+    Compute the weighted MMD as compute_weighted_mmd and the MMD of each bootstrap
+    resample of the observations X. The kernels are computed once, each resample
+    only reweights the kernel sums by the number of times each observation is drawn.
+    - boot_idx: n_boot x n array of observation indices (from bootstrap_indices)
+
+    Returns:
+        MMD² value (or array, one per gamma) and the n_boot bootstrap MMD² values
+        (or n_gammas x n_boot array)
+    """
+    counts_X = bootstrap_counts(boot_idx, len(X))
+
+    mmd, mmd_boot = _weighted_mmd(X, Y, weights_Y, gamma, counts_X=counts_X)
+
+    if np.ndim(gamma) == 0:
+        return mmd[0], mmd_boot[0]
 
-    mmd2 = mmd_xx + mmd_yy - 2 * mmd_xy
-    return np.sqrt(mmd2)
+    return mmd, mmd_boot
 
 def day_to_month(yday_array):
     """from yearday (1–365*n) to month (1–12)"""
-    base_date = datetime(2000, 1, 1)  # random year
-    return np.array([
-        (base_date + timedelta(days=int(d))).month
-        for d in yday_array
-    ])
+    # Same dates as datetime(2000, 1, 1) + timedelta(days=int(d)), computed at once
+    dates = np.datetime64('2000-01-01', 'D') + np.asarray(yday_array).astype(np.int64).astype('timedelta64[D]')
+    return dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
 
-def run_cost_function(stages, months, folder_path_calibration, file_model_outputs, file_obs_data, folder_name_store_outputs, gamma):
+def run_cost_function(stages, months, folder_path_calibration, file_model_outputs, file_obs_data, folder_name_store_outputs, gamma, n_boot=0):
     """
     Run the "calibration" that mostly consist of computing a cost between the 
     observed and the modeled traits distributions for a given model outputs.
@@ -70,43 +141,56 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
 
     Parameters
     ----------
-
+    n_boot: int
+        Number of bootstrap resamples of the observations (0 for no bootstrap).
+        The mean, standard deviation and 95% confidence interval of the bootstrap
+        costs are stored in outputs['cost_boot'].
 
     Returns
     -------
-
+    outputs: dict
+        Costs of the model outputs (None if they already exist).
 
     """
     
     print("Enter inside cost function")
+    
+    ## Skip the model outputs already scored with the same observations and code
+    key = cost_key('MMD', file_model_outputs, stages, months, file_digest(f"{folder_path_calibration}{file_obs_data}"), n_boot, gamma)
+    file_path = cost_file_path(f'{folder_path_calibration}/{folder_name_store_outputs}', key)
+    
+    if output_exists(file_path):
+        print(f"Costs already exist: {file_path}")
+        return None
+    
+    metrics = RunMetrics()
 
     ## Initialize outputs
     outputs = {'cost': {}, 
+            'cost_boot': {},
             'params': [], 
             'mod': {}, 
             'obs': {},
             'running_time': None,
-            'species': None
+            'species': None,
+            'run_key': key
             } 
     
     ## Load the model outputs
-    with open(f"{file_model_outputs}", 'rb') as file:
-        model = pickle.load(file)
+    with metrics.phase('model_load'):
+        model = load_output(file_model_outputs)
     
     outputs['params'] = model['params']
     
     ## Load the observations to compare with Coltrane
-    obs_all = pd.read_csv(f"{folder_path_calibration}{file_obs_data}")
-    obs_species = obs_all[obs_all['object_annotation_category'].str.contains(model['species'], case=False, na=False)]
+    with metrics.phase('observation_load'):
+        obs_all = load_observations(f"{folder_path_calibration}{file_obs_data}")
+        obs_species = obs_all[obs_all['species'] == species_code(model['species'])]
     
     outputs['species'] = model['species']
 
     ## Compute the costs    
-    stage_codes = {'C4': 'civstage',
-                   'C5': 'cvstage',
-                   'C6': 'female'
-                   }
-    
+
     start_time = time.time()
      
     for m in months:
@@ -119,13 +203,11 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
         
         for stage in stages:
             
-            if stage not in stage_codes:
+            if stage not in STAGES:
                 # print(f"Not considering stage {stage}.")
                 continue
             
-            code = stage_codes[stage]
-            
-            obs_stage = obs_month[obs_month['object_annotation_category'].str.contains(code, case=False, na=False)]
+            obs_stage = obs_month[obs_month['stage'] == STAGES[stage]]
             if obs_stage.empty:
                 # print(f"No observations for stage {stage} during month {m}.")
                 continue
@@ -144,7 +226,8 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
 
             if len(mod_reserves) > 0:
                 
-                mod_months = day_to_month(mod_yday)
+                with metrics.phase('individuals'):
+                    mod_months = day_to_month(mod_yday)
             
                 m_mask = mod_months == m
                 
@@ -163,7 +246,8 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
                 })
                 
                 # Mean per ind
-                grouped = df.groupby('ind_idx').mean()
+                with metrics.phase('individuals'):
+                    grouped = df.groupby('ind_idx').mean()
             
                 # Identify the fitness associated to each ind
                 grouped['fitness'] = mod_fitness[grouped.index]
@@ -183,7 +267,15 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
                 mod_scaled = (mod_data - min_vals) / (max_vals - min_vals)
 
                 # Compute weighted MMD
-                cost = compute_weighted_mmd(obs_scaled, mod_scaled, mod_weights, gamma=gamma)
+                with metrics.phase('mmd_kernel'):
+                    if n_boot > 0:
+                        # Same resamples for all the model outputs, and as compute_all_costs.py
+                        rng = np.random.default_rng([0, STAGES[stage], m])
+                        boot_idx = bootstrap_indices(len(obs_scaled), n_boot, rng)
+                        cost, cost_boot = compute_weighted_mmd_bootstrap(obs_scaled, mod_scaled, mod_weights, boot_idx, gamma=gamma)
+                        outputs['cost_boot'][f'M{m}_{stage}_cost'] = bootstrap_summary(cost_boot)
+                    else:
+                        cost = compute_weighted_mmd(obs_scaled, mod_scaled, mod_weights, gamma=gamma)
                 
                 # Save outputs
                 outputs['cost'][f'M{m}_{stage}_cost'] = cost
@@ -199,12 +291,14 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
     
     outputs['running_time'] = running_time
     
-    unique_id = uuid.uuid4().hex[:8]
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f') 
-    file_path = f'{folder_path_calibration}/{folder_name_store_outputs}/coltrane_multisp_lipids_fullness_calibration_{timestamp}_{unique_id}.pkl'
-
-    with open(file_path, 'wb') as file:
-        pickle.dump(outputs, file)
+    # The serialization itself is only in the printed metrics
+    outputs['metrics'] = metrics.to_dict()
+    
+    with metrics.phase('serialization'):
+        outputs['created'] = time.time()
+        atomic_pickle_dump(outputs, file_path)
+    
+    print("Metrics:", json.dumps(metrics.to_dict()))
    
     return outputs     
 
@@ -217,16 +311,22 @@ if __name__ == '__main__':
     file_obs_data = sys.argv[5]
     folder_name_store_outputs = sys.argv[6]
     gamma = int(sys.argv[7])
+    n_boot = int(sys.argv[8]) if len(sys.argv) > 8 else 0
     
-    run_cost_function(
-        stages=stages,
-        months=months,
-        folder_path_calibration=folder_path_calibration,
-        file_model_outputs=file_model_outputs,
-        file_obs_data=file_obs_data,
-        folder_name_store_outputs=folder_name_store_outputs,
-        gamma=gamma
-    )
+    with run_record('compute_MMD_cost', file_model_outputs) as record, profile_run('compute_MMD_cost', file_model_outputs, record):
+        outputs = run_cost_function(
+            stages=stages,
+            months=months,
+            folder_path_calibration=folder_path_calibration,
+            file_model_outputs=file_model_outputs,
+            file_obs_data=file_obs_data,
+            folder_name_store_outputs=folder_name_store_outputs,
+            gamma=gamma,
+            n_boot=n_boot
+        )
+        record['cached'] = outputs is None
+        if outputs is not None:
+            record['metrics'] = outputs['metrics']
     
     
 # plt.scatter(obs_stage['total_lipids_ugC'], obs_stage['fullness_ratio_carbon_volume'], color='red')
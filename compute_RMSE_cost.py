@@ -11,24 +11,27 @@ import sys
 
 sys.path.append('./model')
 
-from RMSE_cost_function import cost_function
-
-import uuid
+from RMSE_cost_function import cost_function, cost_function_bootstrap
+from bootstrap_costs import bootstrap_indices, bootstrap_summary
+from ingest_observations import load_observations, species_code, STAGES
+from run_metrics import RunMetrics
+from run_manifest import run_record
+from run_profiler import profile_run
+from run_cache import cost_key, cost_file_path, file_digest, atomic_pickle_dump
+from shard_store import output_exists, load_output
+
+import json
 import pandas as pd
 import numpy as np
 import time
-import pickle
-from datetime import datetime, timedelta
 
 def day_to_month(yday_array):
     """from yearday (1–365*n) to month (1–12)"""
-    base_date = datetime(2000, 1, 1)  # random year
-    return np.array([
-        (base_date + timedelta(days=int(d))).month
-        for d in yday_array
-    ])
+    # Same dates as datetime(2000, 1, 1) + timedelta(days=int(d)), computed at once
+    dates = np.datetime64('2000-01-01', 'D') + np.asarray(yday_array).astype(np.int64).astype('timedelta64[D]')
+    return dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
 
-def run_cost_function(stages, months, folder_path_calibration, file_model_outputs, file_obs_data, folder_name_store_outputs):
+def run_cost_function(stages, months, folder_path_calibration, file_model_outputs, file_obs_data, folder_name_store_outputs, n_boot=0):
     """
     Run the "calibration" that mostly consist of computing a cost between the 
     observed and the modeled traits distributions for a given model outputs.
@@ -37,45 +40,59 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
 
     Parameters
     ----------
+    n_boot: int
+        Number of bootstrap resamples of the observations (0 for no bootstrap).
+        The mean, standard deviation and 95% confidence interval of the bootstrap
+        costs are stored in outputs['cost_boot'].
 
 
     Returns
     -------
-
+    outputs: dict
+        Costs of the model outputs (None if they already exist).
 
     """
     
     print("Enter inside cost function")
+    
+    ## Skip the model outputs already scored with the same observations and code
+    key = cost_key('RMSE', file_model_outputs, stages, months, file_digest(f"{folder_path_calibration}{file_obs_data}"), n_boot)
+    file_path = cost_file_path(f'{folder_path_calibration}/{folder_name_store_outputs}', key)
+    
+    if output_exists(file_path):
+        print(f"Costs already exist: {file_path}")
+        return None
+    
+    metrics = RunMetrics()
 
     ## Initialize outputs
     outputs = {'cost': {}, 
+            'cost_boot': {},
             'params': [], 
             'mod_interp': {}, 
             'obs_interp': {},
             'bins': {},
             'running_time': None,
             'mask': [],
-            'species': None
+            'species': None,
+            'run_key': key
             }
     
     ## Load the model outputs
-    with open(f"{file_model_outputs}", 'rb') as file:
-        model = pickle.load(file)
+    with metrics.phase('model_load'):
+        model = load_output(file_model_outputs)
     
     outputs['params'] = model['params']
     
     ## Load the observations to compare with Coltrane
-    obs_all = pd.read_csv(f"{folder_path_calibration}{file_obs_data}")
-    obs_species = obs_all[obs_all['object_annotation_category'].str.contains(model['species'], case=False, na=False)]
+    with metrics.phase('observation_load'):
+        obs_all = load_observations(f"{folder_path_calibration}{file_obs_data}")
+        obs_species = obs_all[obs_all['species'] == species_code(model['species'])]
     
     outputs['species'] = model['species']
 
     ## Compute the costs    
-    stage_codes = {'C4': 'civstage',
-                   'C5': 'cvstage',
-                   'C6': 'female'
-                   }
-    
+
     start_time = time.time()
      
     for m in months:
@@ -88,13 +105,11 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
         
         for stage in stages:
             
-            if stage not in stage_codes:
+            if stage not in STAGES:
                 # print(f"Not considering stage {stage}.")
                 continue
             
-            code = stage_codes[stage]
-            
-            obs_stage = obs_month[obs_month['object_annotation_category'].str.contains(code, case=False, na=False)]
+            obs_stage = obs_month[obs_month['stage'] == STAGES[stage]]
             if obs_stage.empty:
                 # print(f"No observations for stage {stage} during month {m}.")
                 continue
@@ -113,7 +128,8 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
 
             if len(mod_reserves) > 0:
                 
-                mod_months = day_to_month(mod_yday)
+                with metrics.phase('individuals'):
+                    mod_months = day_to_month(mod_yday)
             
                 m_mask = mod_months == m
                 
@@ -132,7 +148,8 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
                 })
                 
                 # Mean per ind
-                grouped = df.groupby('ind_idx').mean()
+                with metrics.phase('individuals'):
+                    grouped = df.groupby('ind_idx').mean()
             
                 # Identify the fitness associated to each ind
                 fitness_vals = mod_fitness[grouped.index]
@@ -144,15 +161,29 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
                     
                 if len(mod_lip_fitness) > 0:
                 
-                    # Lipid cost
-                    cost_lip_wgt, obs_interp_lip, mod_interp_lip_wgt, bins_lip_wgt = cost_function(obs["total_lipids_ugC"], mod_lip_fitness)
-                    
-                    # Fullness cost
-                    cost_full_wgt, obs_interp_full, mod_interp_full_wgt, bins_full_wgt = cost_function(obs["fullness_ratio_carbon_volume"], mod_full_fitness)
+                    with metrics.phase('histogram'):
+                        # Lipid cost
+                        cost_lip_wgt, obs_interp_lip, mod_interp_lip_wgt, bins_lip_wgt = cost_function(obs["total_lipids_ugC"], mod_lip_fitness)
+                        
+                        # Fullness cost
+                        cost_full_wgt, obs_interp_full, mod_interp_full_wgt, bins_full_wgt = cost_function(obs["fullness_ratio_carbon_volume"], mod_full_fitness)
                     
                     # Total cost
                     stage_tot_cost = cost_lip_wgt + cost_full_wgt
                     
+                    # Bootstrap costs, the same resamples are used for both traits
+                    if n_boot > 0:
+                        with metrics.phase('bootstrap'):
+                            # Same resamples for all the model outputs, and as compute_all_costs.py
+                            rng = np.random.default_rng([0, STAGES[stage], m])
+                            boot_idx = bootstrap_indices(len(obs), n_boot, rng)
+                            _, cost_lip_boot = cost_function_bootstrap(obs["total_lipids_ugC"], mod_lip_fitness, boot_idx)
+                            _, cost_full_boot = cost_function_bootstrap(obs["fullness_ratio_carbon_volume"], mod_full_fitness, boot_idx)
+                        
+                        outputs['cost_boot'][f'M{m}_{stage}_lip_wgt_cost'] = bootstrap_summary(cost_lip_boot)
+                        outputs['cost_boot'][f'M{m}_{stage}_full_wgt_cost'] = bootstrap_summary(cost_full_boot)
+                        outputs['cost_boot'][f'M{m}_{stage}_tot_cost'] = bootstrap_summary(cost_lip_boot + cost_full_boot)
+                    
                     # Save outputs
                     outputs['cost'][f'M{m}_{stage}_lip_wgt_cost'] = cost_lip_wgt
                     outputs['cost'][f'M{m}_{stage}_full_wgt_cost'] = cost_full_wgt
@@ -175,12 +206,14 @@ def run_cost_function(stages, months, folder_path_calibration, file_model_output
     
     outputs['running_time'] = running_time
     
-    unique_id = uuid.uuid4().hex[:8]
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f') # The name of the folder will contain the time
-    file_path = f'{folder_path_calibration}/{folder_name_store_outputs}/coltrane_multisp_lipids_fullness_calibration_{timestamp}_{unique_id}.pkl'
-
-    with open(file_path, 'wb') as file:
-        pickle.dump(outputs, file)
+    # The serialization itself is only in the printed metrics
+    outputs['metrics'] = metrics.to_dict()
+    
+    with metrics.phase('serialization'):
+        outputs['created'] = time.time()
+        atomic_pickle_dump(outputs, file_path)
+    
+    print("Metrics:", json.dumps(metrics.to_dict()))
    
     return outputs     
 
@@ -192,12 +225,18 @@ if __name__ == '__main__':
     file_model_outputs = sys.argv[4]
     file_obs_data = sys.argv[5]
     folder_name_store_outputs = sys.argv[6]
+    n_boot = int(sys.argv[7]) if len(sys.argv) > 7 else 0
     
-    run_cost_function(
-        stages=stages,
-        months=months,
-        folder_path_calibration=folder_path_calibration,
-        file_model_outputs=file_model_outputs,
-        file_obs_data=file_obs_data,
-        folder_name_store_outputs=folder_name_store_outputs
-    )
+    with run_record('compute_RMSE_cost', file_model_outputs) as record, profile_run('compute_RMSE_cost', file_model_outputs, record):
+        outputs = run_cost_function(
+            stages=stages,
+            months=months,
+            folder_path_calibration=folder_path_calibration,
+            file_model_outputs=file_model_outputs,
+            file_obs_data=file_obs_data,
+            folder_name_store_outputs=folder_name_store_outputs,
+            n_boot=n_boot
+        )
+        record['cached'] = outputs is None
+        if outputs is not None:
+            record['metrics'] = outputs['metrics']
@@ -0,0 +1,829 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compute RMSE and MMD costs for each stage and month in a single pass.
+
+Each model output is loaded once and scored with the RMSE cost and with the
+MMD cost for every requested gamma. The model output files are distributed
+over a pool of worker processes. The observations of each species, stage and
+month and their bins are prepared once by the parent process and shared with
+the workers as read-only arrays (see shared_arrays.py).
+The individuals of each stage and month (the sufficient statistics of the
+costs) are saved with the costs, so that rescore_costs.py can score the model
+outputs again without reading them.
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import sys
+
+sys.path.append('./model')
+
+from RMSE_cost_function import cost_function, cost_function_bootstrap, joint_cost_function
+from histogram_bins import TraitBins, DEFAULT_BINNING
+from compute_MMD_cost import compute_weighted_mmd, compute_weighted_mmd_bootstrap
+from bootstrap_costs import bootstrap_indices, bootstrap_summary
+from ingest_observations import load_observations, species_code, STAGES, SPECIES_CODES
+from run_metrics import RunMetrics
+from prefetch_loader import prefetch_files, READ_AHEAD
+from run_manifest import run_record
+from run_cache import cost_key, cost_file_path, file_digest, array_digest, code_version, COST_SOURCES
+from shard_store import output_exists, read_output, load_output, save_output
+from shared_arrays import SharedArrays, attach_arrays
+from run_profiler import profile_run
+
+import os
+import pandas as pd
+import numpy as np
+import time
+import pickle
+from multiprocessing import Pool
+
+## Traits compared by the costs
+TRAITS = ['total_lipids_ugC', 'fullness_ratio_carbon_volume']
+
+## Binning of the RMSE cost of each trait (see histogram_bins.bin_edges)
+BINNING = {trait: DEFAULT_BINNING for trait in TRAITS}
+
+## Fields of the cost outputs with one entry per stage and month
+CELL_FIELDS = ('cost', 'cost_boot', 'mod_interp', 'obs_interp', 'bins', 'mod', 'obs', 'obs_fingerprint')
+
+## Maximum number of model output files scored by a worker task
+CHUNK_SIZE = 16
+
+## The individuals of all the months are kept in the run statistics, for
+## observations of other months added later
+ALL_MONTHS = list(range(1, 13))
+
+def day_to_month(yday_array):
+    """from yearday (1–365*n) to month (1–12)"""
+    # Same dates as datetime(2000, 1, 1) + timedelta(days=int(d)), computed at once
+    dates = np.datetime64('2000-01-01', 'D') + np.asarray(yday_array).astype(np.int64).astype('timedelta64[D]')
+    return dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+
+def stage_individuals(model, stage, months):
+    """
+    Mean reserves, weight and fitness per simulated individual of one stage,
+    for each of the requested months.
+
+    Parameters
+    ----------
+    model: dict
+        Model outputs from run_coltrane_save_outputs.
+    stage: str
+        Development stage ('C4', 'C5' or 'C6').
+    months: list
+        Months to consider.
+
+    Returns
+    -------
+    individuals: dict
+        For each month with simulated individuals, a DataFrame indexed by
+        individual with the columns 'reserves', 'weight', 'fitness' and 'fullness'.
+        The months without individuals are left out silently (the cells with
+        observations but no individuals are reported by score_individuals).
+    """
+
+    individuals = {}
+
+    mod_reserves = model[f'{stage}_reserves_all']
+
+    if len(mod_reserves) == 0:
+        # print(f"No simulated individuals for stage {stage}.")
+        return individuals
+
+    mod_weight = model[f'{stage}_weight_all']
+    mod_fitness = model[f'{stage}_fitness_all']
+    mod_ind_idx = model[f'{stage}_ind_idx']
+
+    # The months are computed once for all the requested months, and only
+    # the months with individuals are evaluated
+    mod_months = day_to_month(model[f'{stage}_yday'])
+    present = set(np.unique(mod_months).tolist())
+
+    for m in months:
+
+        if m not in present:
+            continue
+
+        m_mask = mod_months == m
+
+        df = pd.DataFrame({
+            'ind_idx': mod_ind_idx[m_mask],
+            'reserves': mod_reserves[m_mask],
+            'weight': mod_weight[m_mask]
+        })
+
+        # Mean per ind
+        grouped = df.groupby('ind_idx').mean()
+
+        # Identify the fitness associated to each ind
+        grouped['fitness'] = mod_fitness[grouped.index]
+        grouped['fullness'] = grouped['reserves'] / grouped['weight']
+
+        individuals[m] = grouped
+
+    return individuals
+
+def parse_binning(binning_str):
+    """
+    Binning of each trait from a string 'method:value' (same binning for both
+    traits) or 'method:value,method:value' (lipids then fullness),
+    e.g. 'width:100,count:10'.
+    """
+
+    binnings = []
+    for b in binning_str.split(','):
+        method, value = b.split(':')
+        binnings.append((method, float(value) if method == 'width' else int(value)))
+
+    if len(binnings) == 1:
+        binnings = binnings * len(TRAITS)
+
+    return dict(zip(TRAITS, binnings))
+
+## Bins of the observations, computed once per worker for all the model outputs
+_trait_bins = {}
+
+def observation_bins(obs_stage, fingerprint, binning):
+    """Bins of each trait of the observations of one stage and month (cached by fingerprint)."""
+
+    trait_bins = {}
+
+    for trait in TRAITS:
+        key = (fingerprint, trait, binning[trait])
+        if key not in _trait_bins:
+            _trait_bins[key] = TraitBins(obs_stage[trait], *binning[trait])
+        trait_bins[trait] = _trait_bins[key]
+
+    return trait_bins
+
+def rmse_stage_costs(outputs, m, stage, obs_stage, grouped, boot_idx=None, trait_bins=None, joint=False):
+    """
+    Compute the RMSE costs (lipids, fullness and total) of one stage and month
+    and store them in outputs, using the same keys as compute_RMSE_cost.
+    If boot_idx is given, the bootstrap summaries are stored in outputs['cost_boot'].
+    The bins of each trait (trait_bins, from observation_bins) are computed
+    from obs_stage if not given.
+    If joint, the lipids and fullness costs are the marginals of a joint 2-D
+    histogram, whose cost is stored with the keys 'M{m}_{stage}_joint_wgt...'.
+    """
+
+    if trait_bins is None:
+        trait_bins = {trait: TraitBins(obs_stage[trait]) for trait in TRAITS}
+
+    mod_lip_fitness = grouped[['reserves', 'fitness']].values
+    mod_full_fitness = grouped[['fullness', 'fitness']].values
+
+    if len(mod_lip_fitness) == 0:
+        return
+
+    if joint:
+        # Joint, lipid and fullness costs from a single 2-D histogram
+        costs, obs_hists, mod_hists, bins = joint_cost_function(obs_stage[TRAITS].values,
+                                                                grouped[['reserves', 'fullness', 'fitness']].values,
+                                                                trait_bins["total_lipids_ugC"],
+                                                                trait_bins["fullness_ratio_carbon_volume"])
+
+        cost_joint_wgt, cost_lip_wgt, cost_full_wgt = costs
+        obs_interp_joint, obs_interp_lip, obs_interp_full = obs_hists
+        mod_interp_joint_wgt, mod_interp_lip_wgt, mod_interp_full_wgt = mod_hists
+        bins_lip_wgt, bins_full_wgt = bins
+
+        outputs['cost'][f'M{m}_{stage}_joint_wgt_cost'] = cost_joint_wgt
+        outputs['mod_interp'][f'M{m}_{stage}_joint_wgt'] = mod_interp_joint_wgt
+        outputs['obs_interp'][f'M{m}_{stage}_joint'] = obs_interp_joint
+        outputs['bins'][f'M{m}_{stage}_joint_wgt'] = bins
+
+    else:
+        # Lipid cost
+        cost_lip_wgt, obs_interp_lip, mod_interp_lip_wgt, bins_lip_wgt = cost_function(obs_stage["total_lipids_ugC"], mod_lip_fitness, trait_bins["total_lipids_ugC"])
+
+        # Fullness cost
+        cost_full_wgt, obs_interp_full, mod_interp_full_wgt, bins_full_wgt = cost_function(obs_stage["fullness_ratio_carbon_volume"], mod_full_fitness, trait_bins["fullness_ratio_carbon_volume"])
+
+    # Bootstrap costs, the same resamples are used for both traits
+    if boot_idx is not None:
+        _, cost_lip_boot = cost_function_bootstrap(obs_stage["total_lipids_ugC"], mod_lip_fitness, boot_idx, trait_bins["total_lipids_ugC"])
+        _, cost_full_boot = cost_function_bootstrap(obs_stage["fullness_ratio_carbon_volume"], mod_full_fitness, boot_idx, trait_bins["fullness_ratio_carbon_volume"])
+
+        outputs['cost_boot'][f'M{m}_{stage}_lip_wgt_cost'] = bootstrap_summary(cost_lip_boot)
+        outputs['cost_boot'][f'M{m}_{stage}_full_wgt_cost'] = bootstrap_summary(cost_full_boot)
+        outputs['cost_boot'][f'M{m}_{stage}_tot_cost'] = bootstrap_summary(cost_lip_boot + cost_full_boot)
+
+    # Save outputs
+    outputs['cost'][f'M{m}_{stage}_lip_wgt_cost'] = cost_lip_wgt
+    outputs['cost'][f'M{m}_{stage}_full_wgt_cost'] = cost_full_wgt
+    outputs['cost'][f'M{m}_{stage}_tot_cost'] = cost_lip_wgt + cost_full_wgt
+
+    outputs['mod_interp'][f'M{m}_{stage}_lip_wgt'] = mod_interp_lip_wgt
+    outputs['mod_interp'][f'M{m}_{stage}_full_wgt'] = mod_interp_full_wgt
+
+    outputs['obs_interp'][f'M{m}_{stage}_lip'] = obs_interp_lip
+    outputs['obs_interp'][f'M{m}_{stage}_full'] = obs_interp_full
+
+    outputs['bins'][f'M{m}_{stage}_lip_wgt'] = bins_lip_wgt
+    outputs['bins'][f'M{m}_{stage}_full_wgt'] = bins_full_wgt
+
+def mmd_stage_costs(outputs_gammas, m, stage, obs_stage, grouped, boot_idx=None):
+    """
+    Compute the MMD cost of one stage and month for each gamma and store it
+    in the corresponding outputs, using the same keys as compute_MMD_cost.
+    If boot_idx is given, the bootstrap summaries are stored in outputs['cost_boot'].
+    """
+
+    obs_data = obs_stage[['total_lipids_ugC', 'fullness_ratio_carbon_volume']].values
+
+    # Prepare mod for MMD compute
+    mod_data = grouped[['reserves', 'fullness']].values
+    mod_weights = grouped['fitness'].values
+
+    # Combined both to have the same scaling between obs and mod
+    combined = np.vstack([obs_data, mod_data])
+
+    # Min-max scaling
+    min_vals = combined.min(axis=0)
+    max_vals = combined.max(axis=0)
+    obs_scaled = (obs_data - min_vals) / (max_vals - min_vals)
+    mod_scaled = (mod_data - min_vals) / (max_vals - min_vals)
+
+    # Compute weighted MMD for all the gammas at once
+    if boot_idx is not None:
+        costs, costs_boot = compute_weighted_mmd_bootstrap(obs_scaled, mod_scaled, mod_weights, boot_idx, gamma=list(outputs_gammas))
+    else:
+        costs = compute_weighted_mmd(obs_scaled, mod_scaled, mod_weights, gamma=list(outputs_gammas))
+
+    for g, (cost, outputs) in enumerate(zip(costs, outputs_gammas.values())):
+
+        outputs['cost'][f'M{m}_{stage}_cost'] = cost
+
+        if boot_idx is not None:
+            outputs['cost_boot'][f'M{m}_{stage}_cost'] = bootstrap_summary(costs_boot[g])
+
+        # Save outputs
+        outputs['mod'][f'M{m}_{stage}_lip'] = grouped['reserves']
+        outputs['mod'][f'M{m}_{stage}_full'] = grouped['fullness']
+        outputs['obs'][f'M{m}_{stage}_lip'] = obs_stage['total_lipids_ugC']
+        outputs['obs'][f'M{m}_{stage}_full'] = obs_stage['fullness_ratio_carbon_volume']
+
+def model_individuals(model, stages, months):
+    """
+    Mean reserves, weight, fitness and fullness per simulated individual of
+    each stage and month (see stage_individuals), keyed 'M{m}_{stage}'. They
+    are the sufficient statistics of all the costs.
+    """
+
+    individuals = {}
+
+    for stage in stages:
+
+        if stage not in STAGES:
+            # print(f"Not considering stage {stage}.")
+            continue
+
+        for m, grouped in stage_individuals(model, stage, months).items():
+            individuals[f'M{m}_{stage}'] = grouped
+
+    return individuals
+
+def score_model_outputs(model, obs_all, stages, months, gammas, n_boot=0, metrics=None):
+    """
+    Compute the RMSE cost and the MMD costs (one per gamma) for a given model
+    outputs. Each stage and month is extracted from the model outputs only once
+    and shared between all the costs.
+
+    Parameters
+    ----------
+    model: dict
+        Model outputs from run_coltrane_save_outputs.
+    obs_all: DataFrame
+        Observations of all species (from load_observations).
+    stages: list
+        Stages to consider (C4, C5 and/or C6).
+    months: list
+        Months to consider.
+    gammas: list
+        Kernel widths of the MMD costs.
+    n_boot: int
+        Number of bootstrap resamples of the observations (0 for no bootstrap).
+        The resamples are shared between the RMSE and the MMD costs.
+    metrics: RunMetrics
+        Metrics of the run, to which the phases of the costs are added
+        (a new one is created if None). They are stored in outputs['metrics'].
+
+    Returns
+    -------
+    outputs_rmse: dict
+        Outputs as in compute_RMSE_cost.
+    outputs_mmd: dict
+        Outputs as in compute_MMD_cost for each gamma.
+    """
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    with metrics.phase('individuals'):
+        individuals = model_individuals(model, stages, months)
+
+    return score_individuals(individuals, model['params'], model['species'], obs_all, stages, months, gammas, n_boot, metrics)
+
+def copy_cell(previous, outputs, cell):
+    """Copy the results of one stage and month ('M{m}_{stage}') from previous cost outputs."""
+
+    for field in CELL_FIELDS:
+        for key, value in previous.get(field, {}).items():
+            if key == cell or key.startswith(f'{cell}_'):
+                outputs[field][key] = value
+
+def reusable(previous, cell, fingerprint, settings):
+    """True if previous cost outputs have the results of a cell for the same observations and cost settings."""
+
+    return (previous is not None
+            and previous.get('cost_settings') == settings
+            and previous.get('obs_fingerprint', {}).get(cell) == fingerprint)
+
+def observation_cells(obs_all, species, stages, months):
+    """
+    Observations of each stage and month of a species ('M{m}_{stage}') with
+    their fingerprint, the cells without observations being left out. They
+    can be computed once and shared by all the model outputs of the species.
+    """
+
+    cells = {}
+
+    obs_species = obs_all[obs_all['species'] == species_code(species)]
+
+    for stage in stages:
+
+        if stage not in STAGES:
+            # print(f"Not considering stage {stage}.")
+            continue
+
+        obs_code = obs_species[obs_species['stage'] == STAGES[stage]]
+
+        for m in months:
+
+            obs_stage = obs_code[obs_code['month'] == m]
+
+            if not obs_stage.empty:
+                cells[f'M{m}_{stage}'] = (obs_stage, array_digest(obs_stage[TRAITS].values))
+
+    return cells
+
+def score_individuals(individuals, params, species, obs_all, stages, months, gammas, n_boot=0, metrics=None, previous=None, binning=None, joint=False, obs_cells=None):
+    """
+    Compute the RMSE and MMD costs from the individuals of model_individuals.
+    Each stage and month is scored against its observations, identified by a
+    fingerprint stored in outputs['obs_fingerprint']. If the previous cost
+    outputs are given, the stages and months with the same observations and
+    cost settings are copied instead of being scored again.
+
+    Parameters
+    ----------
+    individuals: dict
+        Individuals of each stage and month (from model_individuals).
+    params: dict
+        Params of the model outputs.
+    species: str
+        Species of the model outputs.
+    previous: tuple
+        Previous RMSE outputs and dict of the previous MMD outputs per gamma
+        (either can be None or miss a gamma).
+    binning: dict
+        Binning of each trait for the RMSE cost (default BINNING).
+    joint: bool
+        Add the joint (lipids x fullness) RMSE cost (see rmse_stage_costs).
+    obs_cells: dict
+        Observations of the species from observation_cells (computed from
+        obs_all if None).
+
+    Other parameters and returns as in score_model_outputs.
+    """
+
+    if binning is None:
+        binning = BINNING
+
+    settings = {'code': code_version(COST_SOURCES), 'n_boot': int(n_boot), 'binning': dict(binning), 'joint': joint}
+
+    ## Initialize outputs
+    outputs_rmse = {'cost': {},
+                    'cost_boot': {},
+                    'params': params,
+                    'mod_interp': {},
+                    'obs_interp': {},
+                    'bins': {},
+                    'running_time': None,
+                    'mask': [],
+                    'species': species,
+                    'obs_fingerprint': {},
+                    'cost_settings': settings
+                    }
+
+    outputs_mmd = {gamma: {'cost': {},
+                           'cost_boot': {},
+                           'params': params,
+                           'mod': {},
+                           'obs': {},
+                           'running_time': None,
+                           'species': species,
+                           'obs_fingerprint': {},
+                           'cost_settings': settings
+                           } for gamma in gammas}
+
+    previous_rmse, previous_mmd = previous if previous is not None else (None, {})
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    if obs_cells is None:
+        obs_cells = observation_cells(obs_all, species, stages, months)
+
+    start_time = time.time()
+
+    for stage in stages:
+
+        if stage not in STAGES:
+            # print(f"Not considering stage {stage}.")
+            continue
+
+        for m in months:
+
+            cell = f'M{m}_{stage}'
+
+            if cell not in obs_cells:
+                continue
+
+            if cell not in individuals:
+                print(f"No simulated individuals for stage {stage} during month {m}.")
+                continue
+
+            grouped = individuals[cell]
+            obs_stage, fingerprint = obs_cells[cell]
+
+            outputs_rmse['obs_fingerprint'][cell] = fingerprint
+            for outputs in outputs_mmd.values():
+                outputs['obs_fingerprint'][cell] = fingerprint
+
+            # Same resamples for all the model outputs, and for a stage and month
+            # whatever the other stages and months scored
+            rng = np.random.default_rng([0, STAGES[stage], m])
+            boot_idx = bootstrap_indices(len(obs_stage), n_boot, rng) if n_boot > 0 else None
+
+            if reusable(previous_rmse, cell, fingerprint, settings):
+                copy_cell(previous_rmse, outputs_rmse, cell)
+            else:
+                with metrics.phase('histogram'):
+                    rmse_stage_costs(outputs_rmse, m, stage, obs_stage, grouped, boot_idx,
+                                     observation_bins(obs_stage, fingerprint, binning), joint)
+
+            to_score = {}
+            for gamma, outputs in outputs_mmd.items():
+                if reusable(previous_mmd.get(gamma), cell, fingerprint, settings):
+                    copy_cell(previous_mmd[gamma], outputs, cell)
+                else:
+                    to_score[gamma] = outputs
+
+            if to_score:
+                with metrics.phase('mmd_kernel'):
+                    mmd_stage_costs(to_score, m, stage, obs_stage, grouped, boot_idx)
+
+    running_time = time.time() - start_time
+
+    outputs_rmse['running_time'] = running_time
+    outputs_rmse['metrics'] = metrics.to_dict()
+    for outputs in outputs_mmd.values():
+        outputs['running_time'] = running_time
+        outputs['metrics'] = outputs_rmse['metrics']
+
+    return outputs_rmse, outputs_mmd
+
+def cost_folders(folder_path_calibration, suffix, gammas):
+    """Folders of the RMSE costs (key 'RMSE') and of the MMD costs of each gamma."""
+
+    folders = {'RMSE': f'{folder_path_calibration}/costs_{suffix}'}
+    for gamma in gammas:
+        folders[gamma] = f'{folder_path_calibration}/MMD_gam{gamma:g}_costs_{suffix}'
+
+    return folders
+
+def cost_keys(file_model_outputs, stages, months, obs_digest, n_boot, gammas, binning=None, joint=False):
+    """Keys of the RMSE cost (key 'RMSE') and of the MMD cost of each gamma of a model output."""
+
+    if binning == BINNING:
+        binning = None
+
+    keys = {'RMSE': cost_key('RMSE', file_model_outputs, stages, months, obs_digest, n_boot, binning=binning, joint=joint)}
+    for gamma in gammas:
+        keys[gamma] = cost_key('MMD', file_model_outputs, stages, months, obs_digest, n_boot, gamma)
+
+    return keys
+
+def save_cost_outputs(outputs, folder_path, key, shard=False):
+    """Save one cost outputs in a pickle file named with its key (or in the shard of the worker)."""
+
+    outputs['run_key'] = key
+    outputs['created'] = time.time()
+    save_output(outputs, cost_file_path(folder_path, key), shard)
+
+def run_statistics_path(folder_stats, file_model_outputs):
+    """Path of the run statistics of a model output."""
+
+    return f'{folder_stats}/{os.path.splitext(os.path.basename(file_model_outputs))[0]}_stats.pkl'
+
+def save_run_statistics(individuals, model, file_model_outputs, folder_stats, shard=False):
+    """
+    Save the individuals of all the stages and months of a model output (from
+    model_individuals), to score it again without reading the model output
+    (see rescore_costs.py).
+    """
+
+    statistics = {'params': model['params'],
+                  'species': model['species'],
+                  'run_key': model.get('run_key'),
+                  'model_file': os.path.basename(file_model_outputs),
+                  'individuals': individuals
+                  }
+
+    save_output(statistics, run_statistics_path(folder_stats, file_model_outputs), shard)
+
+def shared_observations(obs_all, stages, months, binning):
+    """
+    Arrays of the observation cells of all the species (traits, index and
+    fingerprint of each cell, see observation_cells) and of their bins, to
+    be shared with the workers by SharedArrays.
+    """
+
+    arrays = {}
+
+    for species in SPECIES_CODES:
+        code = species_code(species)
+
+        for cell, (obs_stage, fingerprint) in observation_cells(obs_all, species, stages, months).items():
+            prefix = f'{code}/{cell}'
+            arrays[f'{prefix}/index'] = obs_stage.index.to_numpy()
+            arrays[f'{prefix}/fingerprint'] = fingerprint
+
+            for trait, bins in observation_bins(obs_stage, fingerprint, binning).items():
+                arrays[f'{prefix}/{trait}'] = obs_stage[trait].to_numpy()
+                arrays[f'{prefix}/{trait}/bins'] = (bins.min, bins.max)
+                arrays[f'{prefix}/{trait}/edges'] = bins.edges
+                arrays[f'{prefix}/{trait}/obs_index'] = bins.obs_index
+                arrays[f'{prefix}/{trait}/obs_hist'] = bins.obs_hist
+
+    return arrays
+
+def attach_observations(descriptor, binning):
+    """
+    Observation cells of each species code from the arrays of
+    shared_observations, as read-only views. Their bins are put in the cache
+    of observation_bins.
+    """
+
+    arrays = attach_arrays(descriptor)
+    obs_cells = {}
+
+    for key in arrays:
+        if not key.endswith('/fingerprint'):
+            continue
+
+        prefix = key[:-len('/fingerprint')]
+        code, cell = prefix.split('/')
+        fingerprint = arrays[key]
+
+        obs_stage = pd.DataFrame({trait: arrays[f'{prefix}/{trait}'] for trait in TRAITS},
+                                 index=arrays[f'{prefix}/index'], copy=False)
+        obs_cells.setdefault(int(code), {})[cell] = (obs_stage, fingerprint)
+
+        for trait in TRAITS:
+            _trait_bins[(fingerprint, trait, binning[trait])] = TraitBins.from_arrays(*arrays[f'{prefix}/{trait}/bins'],
+                                                                                      arrays[f'{prefix}/{trait}/edges'],
+                                                                                      arrays[f'{prefix}/{trait}/obs_index'],
+                                                                                      arrays[f'{prefix}/{trait}/obs_hist'])
+
+    return obs_cells
+
+## Worker state, set once per process by init_worker
+_worker = {}
+
+def init_worker(stages, months, shared_descriptor, obs_digest, gammas, n_boot, folders, folder_stats, binning=None, joint=False, read_ahead=READ_AHEAD, shard=False):
+    """Attach the observations shared by the parent process, once per worker process."""
+
+    binning = binning if binning is not None else BINNING
+
+    metrics = RunMetrics()
+    with metrics.phase('observation_load'):
+        _worker['obs_cells'] = attach_observations(shared_descriptor, binning)
+        _worker['obs_digest'] = obs_digest
+
+    # Reported in the metrics of the first file scored by the worker
+    _worker['observation_load'] = metrics.phases['observation_load']
+    _worker['stages'] = stages
+    _worker['months'] = months
+    _worker['gammas'] = gammas
+    _worker['n_boot'] = n_boot
+    _worker['binning'] = binning
+    _worker['joint'] = joint
+    _worker['read_ahead'] = read_ahead
+    _worker['shard'] = shard
+    _worker['folders'] = folders
+    _worker['folder_stats'] = folder_stats
+
+def cached_costs(file_model_outputs):
+    """Keys of the costs of a model output and True if they all exist, with its run statistics."""
+
+    keys = cost_keys(file_model_outputs, _worker['stages'], _worker['months'], _worker['obs_digest'], _worker['n_boot'], _worker['gammas'], _worker['binning'], _worker['joint'])
+    folders = _worker['folders']
+    cached = (all(output_exists(cost_file_path(folders[cost], key)) for cost, key in keys.items())
+              and output_exists(run_statistics_path(_worker['folder_stats'], file_model_outputs)))
+
+    return keys, cached
+
+def score_file(file_model_outputs, future=None):
+    """
+    Load one model output file, compute all its costs and save them with the
+    run statistics of the model output. If future is given, the content of the
+    file is its result (see prefetch_loader).
+    """
+
+    with run_record('compute_all_costs', file_model_outputs) as record, profile_run('compute_all_costs', file_model_outputs, record):
+
+        # Skip the model outputs whose costs all exist with the same observations and code
+        keys, record['cached'] = cached_costs(file_model_outputs)
+        folders = _worker['folders']
+
+        if record['cached']:
+            return file_model_outputs, 0.
+
+        metrics = RunMetrics()
+        if 'observation_load' in _worker:
+            metrics.add('observation_load', _worker.pop('observation_load'))
+
+        # Only the wait for the file if it was read ahead
+        with metrics.phase('model_load'):
+            if future is not None:
+                model = pickle.loads(future.result())
+            else:
+                model = load_output(file_model_outputs)
+
+        # Individuals of all the stages and months, kept in the run statistics
+        with metrics.phase('individuals'):
+            individuals = model_individuals(model, list(STAGES), ALL_MONTHS)
+
+        outputs_rmse, outputs_mmd = score_individuals(individuals,
+                                                      model['params'],
+                                                      model['species'],
+                                                      None,
+                                                      _worker['stages'],
+                                                      _worker['months'],
+                                                      _worker['gammas'],
+                                                      _worker['n_boot'],
+                                                      metrics,
+                                                      binning=_worker['binning'],
+                                                      joint=_worker['joint'],
+                                                      obs_cells=_worker['obs_cells'].get(species_code(model['species']), {}))
+
+        # The serialization itself is not in the stored metrics
+        with metrics.phase('serialization'):
+            for cost, outputs in [('RMSE', outputs_rmse), *outputs_mmd.items()]:
+                outputs['model_file'] = os.path.basename(file_model_outputs)
+                save_cost_outputs(outputs, folders[cost], keys[cost], _worker['shard'])
+
+            save_run_statistics(individuals, model, file_model_outputs, _worker['folder_stats'], _worker['shard'])
+
+        record['metrics'] = metrics.to_dict()
+
+    return file_model_outputs, outputs_rmse['running_time']
+
+def score_files(files):
+    """
+    Score a chunk of model output files, the next files being read while the
+    current one is scored. The files whose costs already exist are not read.
+    """
+
+    results = []
+    to_score = []
+
+    for file_model_outputs in files:
+        if cached_costs(file_model_outputs)[1]:
+            results.append(score_file(file_model_outputs))
+        else:
+            to_score.append(file_model_outputs)
+
+    for file_model_outputs, future in prefetch_files(to_score, read=read_output, read_ahead=_worker['read_ahead']):
+        results.append(score_file(file_model_outputs, future))
+
+    return results
+
+def run_all_costs(stages, months, folder_path_calibration, file_list_model_outputs, file_obs_data, suffix, gammas, n_workers, n_boot=0, binning=None, joint=False, read_ahead=READ_AHEAD, shard=False):
+    """
+    Compute the RMSE and MMD costs of all the model outputs listed in a file.
+    The RMSE costs are stored in the folder costs_{suffix} and the MMD costs in
+    the folders MMD_gam{gamma}_costs_{suffix}, one pickle file per model output
+    as with compute_RMSE_cost and compute_MMD_cost. The run statistics of each
+    model output are stored in the folder stats_{suffix}.
+
+    Parameters
+    ----------
+    stages: list
+        Stages to consider (C4, C5 and/or C6).
+    months: list
+        Months to consider.
+    folder_path_calibration: str
+        Path of the calibration folder (observations and cost outputs).
+    file_list_model_outputs: str
+        Text file listing the model output files, one per line (e.g. from
+        python shard_store.py list, the files can be in shards).
+    file_obs_data: str
+        Name of the observations file in folder_path_calibration.
+    suffix: str
+        Suffix of the folders storing the costs (e.g. 'sim2').
+    gammas: list
+        Kernel widths of the MMD costs.
+    n_workers: int
+        Number of worker processes.
+    n_boot: int
+        Number of bootstrap resamples of the observations (0 for no bootstrap).
+    binning: dict
+        Binning of each trait for the RMSE cost (default BINNING, see parse_binning).
+    joint: bool
+        Add the joint (lipids x fullness) RMSE cost, the lipids and fullness
+        costs being then computed from the same 2-D histogram.
+    read_ahead: int
+        Number of model output files read ahead by each worker while it
+        scores the current one.
+    shard: bool
+        Append the costs and run statistics to one shard per worker in their
+        folders instead of one file per model output (see shard_store.py).
+
+    Returns
+    -------
+    None.
+    """
+
+    with open(file_list_model_outputs) as file:
+        files = [line.strip() for line in file if line.strip()]
+
+    folders = cost_folders(folder_path_calibration, suffix, gammas)
+    folder_stats = f'{folder_path_calibration}/stats_{suffix}'
+
+    for folder in [*folders.values(), folder_stats]:
+        os.makedirs(folder, exist_ok=True)
+
+    print(f"Compute the costs of {len(files)} model outputs with {n_workers} workers")
+
+    start_time = time.time()
+
+    # Observations of each species, stage and month and their bins, prepared once
+    obs_path = f"{folder_path_calibration}{file_obs_data}"
+    obs_all = load_observations(obs_path)
+    shared = SharedArrays(shared_observations(obs_all, stages, months, binning if binning is not None else BINNING))
+    del obs_all
+
+    initargs = (stages, months, shared.descriptor, file_digest(obs_path), gammas, n_boot, folders, folder_stats, binning, joint, read_ahead, shard)
+
+    # Chunks of files scored by the same worker, so that it reads the next
+    # files of its chunk while scoring the current one
+    chunk_size = max(1, min(CHUNK_SIZE, len(files) // n_workers))
+    chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+
+    n = 0
+    with shared, Pool(n_workers, initializer=init_worker, initargs=initargs) as pool:
+        for results in pool.imap_unordered(score_files, chunks):
+            for file_model_outputs, running_time in results:
+                n += 1
+                print(f"[{n}/{len(files)}] {file_model_outputs} ({round(running_time, 2)} sec)")
+
+    print("\nTotal running time (sec):", round(time.time() - start_time, 2))
+
+if __name__ == '__main__':
+
+    stages = sys.argv[1].split(',')
+    months = [int(m) for m in sys.argv[2].split(',')]
+    folder_path_calibration = sys.argv[3]
+    file_list_model_outputs = sys.argv[4]
+    file_obs_data = sys.argv[5]
+    suffix = sys.argv[6]
+    gammas = [float(g) for g in sys.argv[7].split(',')]
+    n_workers = int(sys.argv[8])
+    n_boot = int(sys.argv[9]) if len(sys.argv) > 9 else 0
+    binning = parse_binning(sys.argv[10]) if len(sys.argv) > 10 and sys.argv[10] != '-' else None
+    joint = bool(int(sys.argv[11])) if len(sys.argv) > 11 else False
+    read_ahead = int(sys.argv[12]) if len(sys.argv) > 12 else READ_AHEAD
+    shard = bool(int(sys.argv[13])) if len(sys.argv) > 13 else False
+
+    run_all_costs(
+        stages=stages,
+        months=months,
+        folder_path_calibration=folder_path_calibration,
+        file_list_model_outputs=file_list_model_outputs,
+        file_obs_data=file_obs_data,
+        suffix=suffix,
+        gammas=gammas,
+        n_workers=n_workers,
+        n_boot=n_boot,
+        binning=binning,
+        joint=joint,
+        read_ahead=read_ahead,
+        shard=shard
+    )
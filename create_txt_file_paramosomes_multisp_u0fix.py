@@ -9,6 +9,22 @@ Create a .txt file of paramosomes
 
 from latin_hypercube_sampling import latin_hypercube_sampling
 
+## Species to calibrate and their development rate (u0)
+SPECIES_DEV_RATES = {'Calanus glacialis': 0.007,
+                     'Calanus hyperboreus': 0.006
+                     }
+
+## Bounds of the parameters sampled by the Latin hypercube
+PARAM_BOUNDS = {
+    'I0': (0.3, 0.5),
+    'Ks': (0.5, 1.5),
+    'KsIA': (0.1, 0.8),
+    'maxReserveFrac': (0.6, 1),
+    'rm': (0.05, 0.25),
+    'tdia_exit': (30, 165),
+    'tdia_enter': (180, 365)
+}
+
 def params_file(number, storage_path, output_name, preySatVersion):
     """
     Create a parameters.txt file composed of number lines and X columns depending 
@@ -28,27 +44,14 @@ def params_file(number, storage_path, output_name, preySatVersion):
     """
     
     # Create the paramosomes
-    param_bounds = {
-        'I0': (0.3, 0.5),
-        'Ks': (0.5, 1.5),
-        'KsIA': (0.1, 0.8),
-        'maxReserveFrac': (0.6, 1),
-        'rm': (0.05, 0.25),
-        'tdia_exit': (30, 165),
-        'tdia_enter': (180, 365)
-    }
-    
-    param_sets = latin_hypercube_sampling(number, param_bounds)
-    param_values_list = [{param: param_sets[param][i] for param in param_bounds} for i in range(number)]
+    param_sets = latin_hypercube_sampling(number, PARAM_BOUNDS)
+    param_values_list = [{param: param_sets[param][i] for param in PARAM_BOUNDS} for i in range(number)]
     
     # Replicate the parameters list as many times as there are species to calibrate
     
-    species = ['Calanus glacialis', 'Calanus hyperboreus']
-    dev_rates = [0.007, 0.006]
-    
     with open(f"{storage_path}/{output_name}", "w") as fichier:
         
-        for species_item, dev_rate_item in zip(species, dev_rates):
+        for species_item, dev_rate_item in SPECIES_DEV_RATES.items():
 
             for paramosome in param_values_list:
                 
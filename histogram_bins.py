@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Histogram bins of the RMSE cost
+
+The bins of a trait are computed once from the observations (fixed number of
+bins, fixed bin width or quantiles of the observations) together with the
+observed histogram, and reused for the modeled histograms of all the model
+outputs. A modeled histogram is a single np.searchsorted and np.bincount.
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import numpy as np
+
+## Binning of cost_function: 10 bins between the min and max observations
+DEFAULT_BINNING = ('count', 10)
+
+def bin_edges(obs, method='count', value=10):
+    """
+    Bin edges from the observations.
+
+    Parameters
+    ----------
+    obs: array
+        Observed values.
+    method: str
+        'count' for value bins of the same width between the min and max
+        observations (as np.histogram), 'width' for bins of width value from
+        the min observation, 'quantile' for value bins with the same number of
+        observations (duplicate edges are merged).
+    value: int or float
+        Number of bins ('count' and 'quantile') or bin width ('width').
+
+    Returns
+    -------
+    edges: array
+        Bin edges.
+    """
+
+    obs = np.asarray(obs, dtype=float)
+    min_obs = np.nanmin(obs)
+    max_obs = np.nanmax(obs)
+
+    # Same range as np.histogram if all the observations are equal
+    if min_obs == max_obs:
+        min_obs, max_obs = min_obs - 0.5, max_obs + 0.5
+
+    if method == 'count':
+        return np.linspace(min_obs, max_obs, int(value) + 1)
+
+    if method == 'width':
+        n_bins = max(int(np.ceil((max_obs - min_obs) / value)), 1)
+        return min_obs + value * np.arange(n_bins + 1)
+
+    if method == 'quantile':
+        edges = np.unique(np.nanquantile(obs, np.linspace(0, 1, int(value) + 1)))
+        return edges if len(edges) > 1 else np.array([min_obs, max_obs])
+
+    raise ValueError(f"Unknown binning method: {method}")
+
+class TraitBins:
+    """
+    Bins of one trait and observed histogram, computed once from the
+    observations.
+
+    Attributes
+    ----------
+    min, max: float
+        Min and max observations (the modeled values are clipped to them).
+    edges: array
+        Bin edges.
+    n_bins: int
+        Number of bins.
+    obs_index: array
+        Bin of each observation (n_bins for missing observations).
+    obs_hist: array
+        Observed histogram (density).
+    """
+
+    def __init__(self, obs, method=DEFAULT_BINNING[0], value=DEFAULT_BINNING[1]):
+        obs = np.asarray(obs, dtype=float)
+
+        self.min = np.nanmin(obs)
+        self.max = np.nanmax(obs)
+        self.edges = bin_edges(obs, method, value)
+        self.n_bins = len(self.edges) - 1
+        self.obs_index = self.index(obs)
+        self.obs_hist = self.histogram_from_index(self.obs_index)
+
+    @classmethod
+    def from_arrays(cls, min, max, edges, obs_index, obs_hist):
+        """Bins already computed (e.g. read-only arrays shared by another process)."""
+        bins = cls.__new__(cls)
+        bins.min = min
+        bins.max = max
+        bins.edges = edges
+        bins.n_bins = len(edges) - 1
+        bins.obs_index = obs_index
+        bins.obs_hist = obs_hist
+
+        return bins
+
+    def index(self, values):
+        """
+        Bin of each value, the values being clipped to the observed range and
+        the last bin including its right edge as in np.histogram. Missing
+        values go to an extra bin n_bins.
+        """
+        values = np.asarray(values, dtype=float)
+
+        index = np.searchsorted(self.edges, np.clip(values, self.min, self.max), side='right') - 1
+        index = np.clip(index, 0, self.n_bins - 1)
+        index[np.isnan(values)] = self.n_bins
+
+        return index
+
+    def histogram_from_index(self, index, weights=None):
+        """Histogram (density) from the bins of the values."""
+        counts = np.bincount(index, weights=weights, minlength=self.n_bins + 1)[:self.n_bins]
+
+        return counts / (counts.sum() * np.diff(self.edges))
+
+    def histogram(self, values, weights=None):
+        """Histogram (density) of the values, optionally weighted."""
+        return self.histogram_from_index(self.index(values), weights)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ingest the LOKI observations
+
+Parse the EcoTaxa taxonomy string (e.g. 'female+lateral<Calanus hyperboreus')
+once into integer species and stage codes and store the observations as a
+typed binary file, so that the cost scripts filter with integer comparisons.
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+
+## Species codes
+SPECIES_CODES = {'calanus glacialis': 1,
+                 'calanus hyperboreus': 2
+                 }
+
+## Stage codes, same values as the mask of select_C4_C6_repro
+STAGE_CODES = {'civstage': 4,
+               'cvstage': 5,
+               'female': 6
+               }
+
+## Stage names used in the cost scripts
+STAGES = {'C4': 4,
+          'C5': 5,
+          'C6': 6
+          }
+
+UNMATCHED = -1
+
+OBS_DTYPE = np.dtype([('species', 'i1'),
+                      ('stage', 'i1'),
+                      ('month', 'i1'),
+                      ('month_true', 'i1'),
+                      ('total_lipids_ugC', 'f8'),
+                      ('fullness_ratio_carbon_volume', 'f8')
+                      ])
+
+def species_code(species):
+    """Integer code of a species name (e.g. 'Calanus glacialis'), -1 if unknown."""
+    return SPECIES_CODES.get(species.strip().lower(), UNMATCHED)
+
+def parse_category(category):
+    """
+    Parse one taxonomy string '<stage>+<view><<Genus species>' into the
+    species and stage codes (-1 if not recognized).
+    """
+    if not isinstance(category, str) or '<' not in category:
+        return UNMATCHED, UNMATCHED
+
+    stage_view, species = category.split('<', 1)
+    stage = stage_view.split('+')[0].strip().lower()
+
+    return species_code(species), STAGE_CODES.get(stage, UNMATCHED)
+
+def ingest_observations(obs):
+    """
+    Convert the observations table into a typed structured array.
+
+    Each distinct category is parsed only once. The observations whose species
+    or stage is not recognized are kept with the code -1 and reported.
+
+    Parameters
+    ----------
+    obs : DataFrame
+        Observations as in merged_LOKI2013_ecotaxa_masks_features_for_calibration.csv.
+
+    Returns
+    -------
+    obs_array : array
+        Structured array with the dtype OBS_DTYPE.
+    unmatched : dict
+        Number of observations of each category that was not recognized.
+
+    """
+    required = ['object_annotation_category', 'month', 'total_lipids_ugC', 'fullness_ratio_carbon_volume']
+    missing = [c for c in required if c not in obs.columns]
+    if missing:
+        raise ValueError(f"Missing columns in the observations: {missing}")
+
+    # Parse each category once
+    category_idx, categories = pd.factorize(obs['object_annotation_category'], use_na_sentinel=False)
+    codes = np.array([parse_category(c) for c in categories], dtype='i1').reshape(-1, 2)
+
+    months = obs['month'].to_numpy()
+    if np.any((months < 1) | (months > 12)):
+        raise ValueError("Months of the observations must be between 1 and 12.")
+
+    obs_array = np.empty(len(obs), dtype=OBS_DTYPE)
+    obs_array['species'] = codes[category_idx, 0]
+    obs_array['stage'] = codes[category_idx, 1]
+    obs_array['month'] = months
+    obs_array['month_true'] = obs['month_true'].to_numpy() if 'month_true' in obs.columns else months
+    obs_array['total_lipids_ugC'] = obs['total_lipids_ugC'].to_numpy()
+    obs_array['fullness_ratio_carbon_volume'] = obs['fullness_ratio_carbon_volume'].to_numpy()
+
+    unmatched_categories = np.any(codes == UNMATCHED, axis=1)
+    counts = np.bincount(category_idx, minlength=len(categories))
+    unmatched = {str(categories[i]): int(counts[i]) for i in np.flatnonzero(unmatched_categories)}
+
+    return obs_array, unmatched
+
+def load_observations(file_obs_data):
+    """
+    Load the observations with integer species and stage codes, either from
+    the binary file written by this script (.npy) or directly from the csv file.
+
+    Parameters
+    ----------
+    file_obs_data : str
+        Path of the observations (.npy or .csv).
+
+    Returns
+    -------
+    obs : DataFrame
+        Observations with the columns of OBS_DTYPE.
+
+    """
+    if str(file_obs_data).endswith('.npy'):
+        obs_array = np.load(file_obs_data)
+    else:
+        obs_array, unmatched = ingest_observations(pd.read_csv(file_obs_data))
+        if unmatched:
+            print(f"Unmatched observation categories: {unmatched}")
+
+    return pd.DataFrame(obs_array)
+
+if __name__ == '__main__':
+
+    obs_array, unmatched = ingest_observations(pd.read_csv(sys.argv[1]))
+
+    np.save(sys.argv[2], obs_array)
+
+    print(f"{len(obs_array)} observations saved in {sys.argv[2]}")
+    for species, code in SPECIES_CODES.items():
+        for stage, stage_code in STAGE_CODES.items():
+            n = np.sum((obs_array['species'] == code) & (obs_array['stage'] == stage_code))
+            print(f"  {species}, {stage}: {n}")
+
+    if unmatched:
+        print("Unmatched categories (kept with the code -1):")
+        for category, n in unmatched.items():
+            print(f"  {category}: {n}")
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Longest-job-first ordering and SLURM packing of the paramosomes of a sweep
+
+The runtime of coltrane_population varies a lot with the paramosome (e.g. the
+diapause window tdia_exit - tdia_enter) and GNU parallel runs the lines of the
+parameter file in file order, so that a few slow runs at the end of the file
+keep one core busy while the others are idle. The runtime of each line is
+predicted from the runs recorded in the run manifest (see run_manifest.py): a
+line already run takes its recorded runtime, the others a least squares
+regression of the log runtime on the parameters. The lines are then:
+
+    - ordered longest first (GNU parallel starts each line on the next free
+      core, which is the longest processing time rule):
+
+        python job_scheduler.py order ./multisp_parameters_u0fix_IA_8000.txt "./manifest_*" ./multisp_parameters_u0fix_IA_8000_ordered.txt
+
+    - or packed into balanced chunks, one per SLURM array task, whose
+      predicted duration on the cores of a task fits in its --time:
+
+        python job_scheduler.py pack ./multisp_parameters_u0fix_IA_8000.txt "./manifest_*" 32 06:00:00 ./chunks_sim2
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import sys
+import glob
+import heapq
+import numpy as np
+
+from run_manifest import ManifestReader
+
+## Driver of the recorded runs, its run ids are the lines of the parameter file
+DRIVER = 'coltrane_save_outputs_for_multiple_costs'
+
+## Fraction of the --time of a SLURM task filled by the predicted runtimes
+FILL = 0.8
+
+def read_param_lines(path):
+    """Non-empty lines of a parameter file."""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def recorded_runtimes(manifest_dirs, driver=DRIVER):
+    """
+    Runtime (s) of the runs of a driver recorded in the manifests, by run id.
+    Only the successful runs that were not cached nor profiled (see
+    run_profiler.py) are used, and the median is taken if a run id was run
+    several times.
+
+    Parameters
+    ----------
+    manifest_dirs : list
+        Folders of the manifests (COLTRANE_MANIFEST_DIR of each job).
+    driver : str
+        Name of the driver in the manifest.
+
+    Returns
+    -------
+    runtimes : dict
+        run_id -> runtime (s).
+    """
+    durations = {}
+
+    for manifest_dir in manifest_dirs:
+        for record in ManifestReader(manifest_dir).read():
+            if (record['event'] == 'end' and record['driver'] == driver
+                    and record['status'] == 'ok' and not record.get('cached') and not record.get('profiled')):
+                durations.setdefault(record['run_id'], []).append(record['time'] - record['start'])
+
+    return {run_id: float(np.median(values)) for run_id, values in durations.items()}
+
+def design_matrix(lines, fitted=None):
+    """
+    Features of the lines of a parameter file: an intercept, each numerical
+    column and its square (standardized), and one indicator per value of each
+    text column (species, preySatVersion) but the first.
+
+    The columns are standardized and selected on the fitted lines (boolean
+    mask, default: all), so that a column or a value constant in the fitted
+    lines (e.g. only C. glacialis recorded yet) does not enter the regression.
+    """
+    fitted = np.ones(len(lines), dtype=bool) if fitted is None else fitted
+    columns = list(zip(*[line.split(',') for line in lines]))
+    features = [np.ones(len(lines))]
+
+    for column in columns:
+        try:
+            values = np.array(column, dtype=float)
+        except ValueError:
+            seen = sorted(set(np.array(column)[fitted]))
+            for value in seen[1:]:
+                features.append(np.array([v == value for v in column], dtype=float))
+            continue
+
+        if np.ptp(values[fitted]) == 0:
+            continue
+
+        scaled = (values - values[fitted].mean()) / values[fitted].std()
+        features += [scaled, scaled**2]
+
+    return np.column_stack(features)
+
+def predict_runtimes(lines, recorded):
+    """
+    Predicted runtime (s) of each line of a parameter file.
+
+    The lines recorded keep their recorded runtime. The others are predicted
+    by a least squares fit of the log runtime on the features of
+    design_matrix, if there are more recorded lines than features, else by
+    the median recorded runtime. Without any recorded run, all the lines get
+    the same runtime (1 s) and the order of the file is kept.
+
+    Returns
+    -------
+    runtimes : array
+        Predicted runtime of each line.
+    n_recorded : int
+        Number of lines with a recorded runtime.
+    """
+    known = np.array([line in recorded for line in lines])
+    runtimes = np.ones(len(lines))
+
+    if not known.any():
+        return runtimes, 0
+
+    runtimes[known] = [recorded[line] for line in np.array(lines)[known]]
+
+    X = design_matrix(lines, known)
+    if known.sum() > X.shape[1]:
+        coefs, *_ = np.linalg.lstsq(X[known], np.log(runtimes[known]), rcond=None)
+        runtimes[~known] = np.exp(X[~known] @ coefs)
+    else:
+        runtimes[~known] = np.median(runtimes[known])
+
+    return runtimes, int(known.sum())
+
+def longest_first(runtimes):
+    """Indices of the runtimes, longest first (file order for equal runtimes)."""
+    return np.argsort(-np.asarray(runtimes), kind='stable')
+
+def pack_chunks(runtimes, n_cores, time_budget, fill=FILL):
+    """
+    Split the runs into the smallest number of chunks whose predicted
+    duration on n_cores cores fits in fill * time_budget.
+
+    The runs are taken longest first and each one goes to the least loaded
+    core over all the chunks, which is what GNU parallel does within each
+    chunk when its lines are ordered longest first. The number of chunks
+    starts from the total runtime and is increased until all the chunks fit.
+
+    Parameters
+    ----------
+    runtimes : array
+        Predicted runtime (s) of each run.
+    n_cores : int
+        Number of parallel jobs per chunk (--cpus-per-task).
+    time_budget : float
+        --time of a SLURM task (s).
+    fill : float
+        Fraction of time_budget that the predicted duration may fill.
+
+    Returns
+    -------
+    chunks : list
+        Indices of the runs of each chunk, longest first.
+    durations : array
+        Predicted duration (s) of each chunk.
+    """
+    runtimes = np.asarray(runtimes, dtype=float)
+    order = longest_first(runtimes)
+    limit = fill * time_budget
+
+    if len(runtimes) and runtimes.max() > limit:
+        print(f"Warning: runs longer than {limit:.0f} s, the chunks cannot fit in the time budget")
+        limit = runtimes.max()
+
+    n_chunks = max(1, int(np.ceil(runtimes.sum() / (n_cores * limit))))
+
+    while True:
+        loads = [(0., chunk, core) for chunk in range(n_chunks) for core in range(n_cores)]
+        chunks = [[] for _ in range(n_chunks)]
+        durations = np.zeros(n_chunks)
+
+        for i in order:
+            load, chunk, core = heapq.heappop(loads)
+            chunks[chunk].append(int(i))
+            durations[chunk] = max(durations[chunk], load + runtimes[i])
+            heapq.heappush(loads, (load + runtimes[i], chunk, core))
+
+        if durations.max(initial=0.) <= limit:
+            break
+
+        n_chunks += 1
+
+    # Chunks without any run (less runs than cores)
+    keep = [n for n, chunk in enumerate(chunks) if chunk]
+
+    return [chunks[n] for n in keep], durations[keep]
+
+def parse_slurm_time(time_str):
+    """Seconds of a SLURM --time ('MM', 'MM:SS', 'HH:MM:SS', 'D-HH', 'D-HH:MM' or 'D-HH:MM:SS')."""
+    days, _, time_str = time_str.rpartition('-')
+    parts = [int(p) for p in time_str.split(':')]
+
+    if days:
+        hours, minutes, seconds = (parts + [0, 0])[:3]
+        hours += 24 * int(days)
+    elif len(parts) == 3:
+        hours, minutes, seconds = parts
+    else:
+        hours = 0
+        minutes, seconds = (parts + [0])[:2]
+
+    return hours * 3600 + minutes * 60 + seconds
+
+def write_lines(lines, path):
+    with open(path, 'w') as f:
+        f.writelines(line + '\n' for line in lines)
+
+if __name__ == '__main__':
+
+    command = sys.argv[1]
+    lines = read_param_lines(sys.argv[2])
+    manifest_dirs = sorted(glob.glob(sys.argv[3]))
+
+    # Driver of the recorded runs (e.g. coltrane_batch_costs for the LHS paramosomes)
+    n_driver = {'order': 5, 'pack': 7}.get(command, len(sys.argv))
+    driver = sys.argv[n_driver] if len(sys.argv) > n_driver else DRIVER
+
+    runtimes, n_recorded = predict_runtimes(lines, recorded_runtimes(manifest_dirs, driver))
+    print(f"{len(lines)} paramosomes, {n_recorded} with a recorded runtime, "
+          f"total predicted runtime {runtimes.sum() / 3600:.1f} h")
+
+    if command == 'order':
+        write_lines([lines[i] for i in longest_first(runtimes)], sys.argv[4])
+
+    elif command == 'pack':
+        n_cores = int(sys.argv[4])
+        time_budget = parse_slurm_time(sys.argv[5])
+        folder_path = sys.argv[6]
+        os.makedirs(folder_path, exist_ok=True)
+
+        chunks, durations = pack_chunks(runtimes, n_cores, time_budget)
+
+        for n, chunk in enumerate(chunks):
+            write_lines([lines[i] for i in chunk], os.path.join(folder_path, f'chunk_{n}.txt'))
+
+        print(f"{len(chunks)} chunks, predicted duration {durations.min() / 3600:.2f} to {durations.max() / 3600:.2f} h "
+              f"for a budget of {time_budget / 3600:.2f} h")
+        print(f"sbatch --array=0-{len(chunks) - 1} run_coltrane_save_outputs_array_cluster.sh")
+
+    else:
+        raise ValueError(f"Unknown command: {command} (order or pack)")
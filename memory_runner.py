@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory-aware runner of the simulation workers
+
+Replaces GNU parallel for the sweeps whose memory per run varies a lot: a few
+paramosomes need much more memory than the others, so that reserving their
+memory for every worker (--mem-per-cpu) wastes most of the node. The runner
+starts one worker per line of a parameter file (the command is given as with
+GNU parallel, {1} to {n} being the columns of the line) and:
+
+    - tracks the RSS of each worker (/proc/{pid}/status) and its peak RSS
+      (rusage of the worker when it ends, exact since the workers never reset
+      their high-water mark, see run_metrics.py);
+    - starts a new worker only if the memory of the running workers (their
+      RSS, or their projected peak if it is larger) plus the projected peak of
+      the new one fits in the memory budget of the node. The projected peak is
+      the 95th percentile of the peaks of the runs done (and of the runs
+      recorded in the run manifests);
+    - kills the largest worker if the node goes over its budget, before the
+      kernel OOM killer does;
+    - starts again the workers killed (by the runner or by the OOM killer),
+      with their own peak as projected peak and one worker less, up to
+      MAX_RETRIES times. The number of workers then increases again by one
+      after as many runs done without a kill.
+
+    python memory_runner.py ./multisp_parameters_u0fix_IA_8000_ordered.txt 64 - "./manifest_*" 1 \\
+        python -u coltrane_save_outputs_for_multiple_costs.py {1} {2} {3} {4} {5} {6} {7} {8} {9} {10} ./coltrane_outputs_sim2 1
+
+The memory budget ('-') is the memory of the SLURM job (or the memory
+available on the node), times MEMORY_FRACTION. With the option 1 after the
+manifests, the forcing is computed once and shared with the workers as
+copy-on-write arrays (see shared_arrays.py).
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+import signal
+import subprocess
+import numpy as np
+
+sys.path.append('./model')
+
+from job_scheduler import read_param_lines, DRIVER
+from run_manifest import ManifestReader
+from run_metrics import process_rss_mb, RESET_PEAK_ENV
+from run_cache import FORCING_ARGS
+from shared_arrays import forcing_environment
+
+## Fraction of the memory of the job used by the workers
+MEMORY_FRACTION = 0.9
+
+## Projected peak RSS of a worker (MB) before any run is done or recorded
+DEFAULT_TASK_MB = 2000
+
+## Number of times a killed worker is started again
+MAX_RETRIES = 3
+
+## Time between two checks of the workers (s)
+POLL_INTERVAL = 0.5
+
+## Projected peak of a killed worker, relative to its peak when it was killed
+OOM_GROWTH = 1.5
+
+def memory_budget_mb(fraction=MEMORY_FRACTION):
+    """
+    Memory available for the workers (MB): memory of the SLURM job
+    (--mem or --mem-per-cpu), else memory available on the node, times fraction.
+    """
+    if os.environ.get('SLURM_MEM_PER_NODE'):
+        memory = float(os.environ['SLURM_MEM_PER_NODE'])
+    elif os.environ.get('SLURM_MEM_PER_CPU'):
+        cpus = os.environ.get('SLURM_CPUS_PER_TASK') or os.environ.get('SLURM_CPUS_ON_NODE') or '1'
+        memory = float(os.environ['SLURM_MEM_PER_CPU']) * int(cpus)
+    else:
+        with open('/proc/meminfo') as f:
+            meminfo = {line.split(':')[0]: line.split()[1] for line in f}
+        memory = int(meminfo['MemAvailable']) / 1024
+
+    return fraction * memory
+
+def recorded_peaks(manifest_dirs, driver=DRIVER):
+    """Peak RSS (MB) of the successful runs of a driver recorded in the manifests."""
+    peaks = []
+
+    for manifest_dir in manifest_dirs:
+        for record in ManifestReader(manifest_dir).read():
+            if (record['event'] == 'end' and record['driver'] == driver
+                    and record['status'] == 'ok' and record.get('metrics')):
+                peaks.append(record['metrics']['peak_rss_mb'])
+
+    return peaks
+
+class Task:
+    """One line of the parameter file and the state of its worker."""
+
+    def __init__(self, n, line):
+        self.n = n
+        self.line = line
+        self.projected_mb = 0.
+        self.attempts = 0
+        self.process = None
+        self.slot = None
+        self.rss_mb = 0.
+        self.peak_mb = 0.
+
+class MemoryRunner:
+    """
+    Run a command for each line of a parameter file with at most max_workers
+    workers whose projected memory fits in budget_mb.
+
+    Usage:
+        runner = MemoryRunner(['python', '-u', 'coltrane_save_outputs_for_multiple_costs.py', '{1}', ...], 64, 200000)
+        failed = runner.run(read_param_lines('./multisp_parameters_u0fix_IA_8000.txt'))
+    """
+
+    def __init__(self, command, max_workers, budget_mb, peaks=(), task_mb=DEFAULT_TASK_MB, max_retries=MAX_RETRIES, env=None):
+        self.command = command
+        self.env = env or {}
+        self.max_workers = max_workers
+        self.budget_mb = budget_mb
+        self.peaks = list(peaks)
+        self.task_mb = task_mb
+        self.max_retries = max_retries
+
+        self.limit = max_workers
+        self.n_since_kill = 0
+        self.running = {}
+        self.n_ok = 0
+        self.n_killed = 0
+
+    def projected_mb(self, task):
+        """Projected peak RSS of a task: its own (if it was killed) or the 95th percentile of the peaks."""
+        estimate = np.percentile(self.peaks, 95) if self.peaks else self.task_mb
+        return max(task.projected_mb, estimate)
+
+    def committed_mb(self):
+        """Memory of the running workers, at least their projected peak."""
+        return sum(max(task.rss_mb, self.projected_mb(task)) for task in self.running.values())
+
+    def can_start(self, task):
+        # A task always runs alone, even if it does not fit in the budget
+        if not self.running:
+            return True
+
+        return (len(self.running) < self.limit
+                and self.committed_mb() + self.projected_mb(task) <= self.budget_mb)
+
+    def start(self, task):
+        used = {t.slot for t in self.running.values()}
+        task.slot = min(set(range(1, len(used) + 2)) - used)
+        task.attempts += 1
+        task.rss_mb = task.peak_mb = 0.
+
+        fields = task.line.split(',')
+        args = [re.sub(r'\{(\d+)\}', lambda match: fields[int(match.group(1)) - 1], arg) for arg in self.command]
+
+        # Same environment as GNU parallel, the shards are named after the slot. A reset
+        # of the high-water mark in the worker would hide its peak from ru_maxrss
+        env = {**os.environ, **self.env, RESET_PEAK_ENV: '0',
+               'PARALLEL_JOBSLOT': str(task.slot), 'PARALLEL_SEQ': str(task.n + 1)}
+        task.process = subprocess.Popen(args, env=env)
+        self.running[task.process.pid] = task
+
+    def update_rss(self):
+        for pid, task in self.running.items():
+            rss = process_rss_mb(pid)
+            if rss is not None:
+                task.rss_mb = rss
+                task.peak_mb = max(task.peak_mb, rss)
+
+    def relieve_pressure(self):
+        """Kill the largest worker if the workers use more than the budget."""
+        if len(self.running) < 2 or sum(task.rss_mb for task in self.running.values()) <= self.budget_mb:
+            return
+
+        pid, task = max(self.running.items(), key=lambda item: item[1].rss_mb)
+        print(f"Memory budget exceeded ({self.budget_mb:.0f} MB), kill task {task.n + 1} ({task.rss_mb:.0f} MB)", flush=True)
+        os.kill(pid, signal.SIGKILL)
+
+    def reap(self):
+        """
+        Tasks whose worker ended: (task, exit code, killed), the exit code
+        being negative for a signal. The peak RSS of the worker is taken
+        from its rusage.
+        """
+        ended = []
+
+        for pid, task in list(self.running.items()):
+            done, status, rusage = os.wait4(pid, os.WNOHANG)
+            if done == 0:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            task.process.returncode = code
+            del self.running[pid]
+
+            # ru_maxrss is in kB on Linux
+            task.peak_mb = max(task.peak_mb, rusage.ru_maxrss / 1024)
+            ended.append((task, code, code == -signal.SIGKILL))
+
+        return ended
+
+    def stop_workers(self):
+        """Kill the running workers and wait for them."""
+        for pid in self.running:
+            os.kill(pid, signal.SIGKILL)
+
+        for pid, task in self.running.items():
+            _, status, _ = os.wait4(pid, 0)
+            task.process.returncode = os.waitstatus_to_exitcode(status)
+
+        self.running.clear()
+
+    def run(self, lines, stop=None):
+        """
+        Run the command for all the lines, in their order.
+
+        Parameters
+        ----------
+        lines : list
+            Lines of the parameter file.
+        stop : callable
+            Checked at each poll, if it returns True the running workers are
+            killed and the lines not run yet are given up (e.g. the claim of
+            the batch was lost, see work_queue.py).
+
+        Returns
+        -------
+        failed : list
+            Lines whose worker failed (or was killed more than max_retries times).
+        """
+        queue = [Task(n, line) for n, line in enumerate(lines)]
+        queue.reverse()
+        failed = []
+
+        while queue or self.running:
+
+            if stop is not None and stop():
+                print(f"Stopped, {len(self.running)} workers killed and {len(queue)} tasks not started", flush=True)
+                self.stop_workers()
+                return failed
+
+            for task, code, killed in self.reap():
+
+                if killed and task.attempts <= self.max_retries:
+                    # Start it again later, with its own peak and one worker less
+                    self.n_killed += 1
+                    self.n_since_kill = 0
+                    self.limit = max(1, len(self.running))
+                    task.projected_mb = max(task.projected_mb, OOM_GROWTH * task.peak_mb)
+                    print(f"Task {task.n + 1} killed at {task.peak_mb:.0f} MB, retry with at most "
+                          f"{self.limit} workers ({task.projected_mb:.0f} MB projected)", flush=True)
+                    queue.append(task)
+
+                elif code != 0:
+                    print(f"Task {task.n + 1} failed (exit code {code}): {task.line}", file=sys.stderr, flush=True)
+                    failed.append(task.line)
+
+                else:
+                    self.n_ok += 1
+                    self.peaks.append(task.peak_mb)
+                    self.n_since_kill += 1
+                    if self.limit < self.max_workers and self.n_since_kill >= self.limit:
+                        self.limit += 1
+                        self.n_since_kill = 0
+
+            self.update_rss()
+            self.relieve_pressure()
+
+            while queue and self.can_start(queue[-1]):
+                self.start(queue.pop())
+
+            if self.running:
+                time.sleep(POLL_INTERVAL)
+
+        print(f"{self.n_ok} tasks done, {len(failed)} failed, {self.n_killed} killed and started again, "
+              f"projected peak {self.projected_mb(Task(-1, '')):.0f} MB for a budget of {self.budget_mb:.0f} MB")
+
+        return failed
+
+if __name__ == '__main__':
+
+    lines = read_param_lines(sys.argv[1])
+    max_workers = int(sys.argv[2])
+    budget_mb = memory_budget_mb() if sys.argv[3] == '-' else float(sys.argv[3])
+    peaks = recorded_peaks(sorted(glob.glob(sys.argv[4]))) if sys.argv[4] != '-' else []
+    share_forcing = bool(int(sys.argv[5]))
+    command = sys.argv[6:]
+
+    env = {}
+    if share_forcing:
+        from coltrane_forcing import coltrane_forcing
+        shared, env = forcing_environment(coltrane_forcing(*FORCING_ARGS), FORCING_ARGS)
+
+    try:
+        failed = MemoryRunner(command, max_workers, budget_mb, peaks, env=env).run(lines)
+    finally:
+        if share_forcing:
+            shared.close()
+
+    # Exit code as GNU parallel: number of failed tasks
+    sys.exit(min(len(failed), 101))
@@ -7,13 +7,93 @@ Merge pickle files
 @date: 2024/05/22
 """
 
-import pickle
 import os
 import sys
 
+from run_cache import dedup_key, atomic_pickle_dump
+from prefetch_loader import load_pickles
+from shard_store import list_outputs, read_output
+
+def append_outputs(combined_data, file_data):
+    """
+    Append the values of one output dict to the lists of combined_data
+    (initialized with the keys of file_data if None).
+    """
+    if combined_data is None:
+        # Initialize combined_data with the keys of the first file
+        return {key: [value] for key, value in file_data.items()}
+
+    for key in file_data:
+        if key in combined_data:
+            combined_data[key].append(file_data[key])
+        else:
+            # New key not seen before, we add it
+            combined_data[key] = [file_data[key]]
+
+    return combined_data
+
+def record_time(file_path, file_data):
+    """
+    Time an output was written: its 'created' stamp, else the modification
+    time of its own file (0 for an older record in a shard).
+    """
+    if 'created' in file_data:
+        return file_data['created']
+
+    return os.path.getmtime(file_path) if os.path.exists(file_path) else 0.
+
+def newest_records(entries):
+    """
+    Select one output per run (params and species, see dedup_key).
+
+    Copies of the same output (same run_key, e.g. a run restarted after a
+    failure) are skipped. Outputs of the same run with another run_key (e.g.
+    stale costs of an older cost configuration left in the folder before a
+    new scoring) are conflicts: the newest one is kept.
+
+    Parameters
+    ----------
+    entries : iterable
+        (dedup key, run_key, time, name, data) of each output.
+
+    Returns
+    -------
+    kept : list
+        Data of the outputs kept, in the order of their run.
+    n_duplicates : int
+        Number of copies skipped.
+    conflicts : list
+        (name kept, name dropped) of each conflict.
+
+    """
+    kept = {}
+    n_duplicates = 0
+    conflicts = []
+
+    for key, run_key, time, name, data in entries:
+
+        if key not in kept:
+            kept[key] = (run_key, time, name, data)
+        elif kept[key][0] == run_key:
+            n_duplicates += 1
+        elif time > kept[key][1]:
+            conflicts.append((name, kept[key][2]))
+            kept[key] = (run_key, time, name, data)
+        else:
+            conflicts.append((kept[key][2], name))
+
+    return [entry[3] for entry in kept.values()], n_duplicates, conflicts
+
+def report_conflicts(conflicts):
+    """Print the outputs dropped for a newer output of the same run."""
+    for name_kept, name_dropped in conflicts:
+        print(f"Conflict: {os.path.basename(name_dropped)} dropped for the newer {os.path.basename(name_kept)}")
+
 def merge_pickle_files(input_files_path, output_file_path, output_file_name):
     """
-    Merge multiple pickle files into one.
+    Merge multiple pickle files into one. Files with the same params and
+    species are merged only once (the newest one if their run_key differ, see
+    newest_records).
 
     Parameters
     ----------
@@ -32,34 +112,25 @@ def merge_pickle_files(input_files_path, output_file_path, output_file_name):
     # List to store combined data
     combined_data = None
 
-    # Iterate over files in the folder
-    for file_name in os.listdir(input_files_path):
-        if file_name.endswith(".pkl"):
-            file_path = os.path.join(input_files_path, file_name)
-            # Read the pickle file and add its content to the combined data dict
-            with open(file_path, "rb") as f:
-                file_data = pickle.load(f)
-                
-                if combined_data is None:
-                    # Initialize combined_data with the keys of the first file
-                    combined_data = {key: [value] for key, value in file_data.items()}
-                else:
-                    for key in file_data:
-                        if key in combined_data:
-                            combined_data[key].append(file_data[key])
-                        else:
-                            # New key not seen before, we add it
-                            combined_data[key] = [file_data[key]]
-                
+    # Iterate over files in the folder (in their own files or in shards), the
+    # next files are read in the background
+    entries = ((dedup_key(file_data), file_data.get('run_key'), record_time(file_path, file_data), file_path, file_data)
+               for file_path, file_data in load_pickles(list_outputs(input_files_path), read=read_output))
+
+    # Skip the outputs of a run already merged (e.g. rerun after a failure)
+    records, n_duplicates, conflicts = newest_records(entries)
+    report_conflicts(conflicts)
+
+    for file_data in records:
+        combined_data = append_outputs(combined_data, file_data)
 
     # Path to the output pickle file
     output_file_path = os.path.join(output_file_path, output_file_name)
 
     # Write the combined data to the output pickle file
-    with open(output_file_path, "wb") as f:
-        pickle.dump(combined_data, f)
+    atomic_pickle_dump(combined_data, output_file_path)
 
-    print("Pickle files have been successfully merged!")
+    print(f"Pickle files have been successfully merged! ({n_duplicates} duplicates skipped, {len(conflicts)} conflicts)")
     
 if __name__ == '__main__':
     print('Start merging')
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Nearest-neighbour index of the evaluated paramosomes
+
+All the paramosomes evaluated by the sweeps (merged cost files, and parameter
+files for the points run without costs yet) are put in one KD-tree per species
+and scenario, the parameters being scaled to [0, 1] by PARAM_BOUNDS (see
+create_txt_file_paramosomes_multisp_u0fix.py) so that the distances do not
+depend on their units. The index answers k-nearest-neighbour and radius
+queries with the costs of the neighbours, e.g. to skip or seed new proposals
+close to points already evaluated, or to inspect the costs around a point
+without loading all the results again.
+
+    python paramosome_index.py build paramosome_index.pkl merged_RMSE_costs_files_2013data_u0fix_8000sets.pkl multisp_parameters_u0fix_IA_8000.txt
+    python paramosome_index.py knn paramosome_index.pkl new_parameters.txt 5
+    python paramosome_index.py filter paramosome_index.pkl new_parameters.txt 0.02 new_parameters_to_run.txt
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import sys
+import pickle
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+from create_txt_file_paramosomes_multisp_u0fix import PARAM_BOUNDS
+from rank_costs import load_costs_table, add_total_costs, SCENARIOS
+from run_cache import atomic_pickle_dump
+
+## Columns of the parameter files
+PARAM_FILE_COLUMNS = [*PARAM_BOUNDS, 'u0', 'species', 'preySatVersion']
+
+## Groups of the index: the points of different groups are never neighbours
+GROUPS = ['species', 'scenario']
+
+## Paramosomes closer than this normalized distance are the same (the parameter
+## files and the pickled params differ in the last digits)
+DUPLICATE_RADIUS = 1e-6
+
+def normalize(params):
+    """Parameters (table or array with the columns of PARAM_BOUNDS) scaled to [0, 1]."""
+    values = params[list(PARAM_BOUNDS)].to_numpy(dtype=float) if isinstance(params, pd.DataFrame) else np.asarray(params, dtype=float)
+    lower = np.array([bounds[0] for bounds in PARAM_BOUNDS.values()])
+    upper = np.array([bounds[1] for bounds in PARAM_BOUNDS.values()])
+
+    return (values - lower) / (upper - lower)
+
+def denormalize(values):
+    """Parameters in their units from normalized values (n x d array), as a table with the columns of PARAM_BOUNDS."""
+    lower = np.array([bounds[0] for bounds in PARAM_BOUNDS.values()])
+    upper = np.array([bounds[1] for bounds in PARAM_BOUNDS.values()])
+
+    return pd.DataFrame(lower + np.asarray(values, dtype=float) * (upper - lower), columns=list(PARAM_BOUNDS))
+
+def read_params_file(path):
+    """Paramosomes of a parameter file, with the species and scenario columns of load_costs_table."""
+    table = pd.read_csv(path, header=None, names=PARAM_FILE_COLUMNS)
+
+    # The diapause days are truncated by the simulation drivers (int(float(...)))
+    table[['tdia_exit', 'tdia_enter']] = table[['tdia_exit', 'tdia_enter']].astype(float).astype(int)
+    table['species'] = [species.split()[-1] for species in table['species']]
+    table['scenario'] = table['preySatVersion'].map(SCENARIOS)
+
+    return table
+
+def evaluated_table(merged_files=(), params_files=()):
+    """
+    Table of the evaluated paramosomes: the runs of the merged cost files
+    (with the total costs of add_total_costs) and the paramosomes of the
+    parameter files without costs. A paramosome in several files is kept
+    once, with its costs if it has some (see drop_duplicates).
+    """
+    tables = []
+    if merged_files:
+        tables.append(add_total_costs(load_costs_table(list(merged_files))))
+    tables += [read_params_file(path) for path in params_files]
+
+    return drop_duplicates(pd.concat(tables, ignore_index=True))
+
+def drop_duplicates(table, radius=DUPLICATE_RADIUS):
+    """
+    Keep one row of the paramosomes within the normalized distance radius of
+    each other, in the same species and scenario: the first one with a cost
+    if any, else the first one.
+    """
+    has_cost = table['cost'].notna().to_numpy() if 'cost' in table else np.zeros(len(table), dtype=bool)
+    table = table.iloc[np.argsort(~has_cost, kind='stable')].reset_index(drop=True)
+    keep = np.ones(len(table), dtype=bool)
+
+    for _, rows in table.groupby(GROUPS, sort=False).indices.items():
+        points = normalize(table.iloc[rows])
+        neighbours = KDTree(points).query_radius(points, r=radius)
+
+        # The rows are in the order of priority
+        for i, near in enumerate(neighbours):
+            if keep[rows[i]]:
+                keep[rows[near[near > i]]] = False
+
+    return table[keep].reset_index(drop=True)
+
+class ParamosomeIndex:
+    """
+    KD-trees of the evaluated paramosomes, one per species and scenario.
+
+    Usage:
+        index = ParamosomeIndex(evaluated_table(['merged_RMSE_costs_files_sim2.pkl']))
+        neighbours = index.knn(proposals, k=5)
+        new = proposals[~index.evaluated(proposals, radius=0.02)]
+
+    Attributes
+    ----------
+    table : DataFrame
+        Evaluated paramosomes with their costs.
+    trees : dict
+        (species, scenario) -> (KDTree, rows of table in the tree).
+    """
+
+    def __init__(self, table, leaf_size=40):
+        self.table = table.reset_index(drop=True)
+        self.trees = {}
+
+        for group, rows in self.table.groupby(GROUPS, sort=False).indices.items():
+            self.trees[group] = (KDTree(normalize(self.table.iloc[rows]), leaf_size=leaf_size), rows)
+
+    def __len__(self):
+        return len(self.table)
+
+    def save(self, path):
+        atomic_pickle_dump(self, path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _groups(self, points):
+        """Rows of points of each (species, scenario) present in the index."""
+        for group, rows in points.groupby(GROUPS, sort=False).indices.items():
+            if group in self.trees:
+                yield group, rows
+
+    def knn(self, points, k=5):
+        """
+        k nearest evaluated paramosomes of each point (table with the columns
+        of PARAM_BOUNDS, 'species' and 'scenario'), in their species and
+        scenario.
+
+        Returns
+        -------
+        neighbours : DataFrame
+            Rows of table, with the row of the point in points ('point'), the
+            rank of the neighbour ('rank', from 0) and the normalized distance
+            ('distance').
+        """
+        points = points.reset_index(drop=True)
+        results = []
+
+        for group, rows in self._groups(points):
+            tree, tree_rows = self.trees[group]
+            distances, indices = tree.query(normalize(points.iloc[rows]), k=min(k, len(tree_rows)))
+
+            neighbours = self.table.iloc[tree_rows[indices.ravel()]].reset_index(drop=True)
+            neighbours.insert(0, 'point', np.repeat(rows, indices.shape[1]))
+            neighbours.insert(1, 'rank', np.tile(np.arange(indices.shape[1]), len(rows)))
+            neighbours.insert(2, 'distance', distances.ravel())
+            results.append(neighbours)
+
+        if not results:
+            return pd.DataFrame(columns=['point', 'rank', 'distance', *self.table.columns])
+
+        return pd.concat(results, ignore_index=True).sort_values(['point', 'rank'], ignore_index=True)
+
+    def radius(self, points, radius):
+        """
+        Evaluated paramosomes within the normalized distance radius of each
+        point, same columns as knn (rank by increasing distance).
+        """
+        points = points.reset_index(drop=True)
+        results = []
+
+        for group, rows in self._groups(points):
+            tree, tree_rows = self.trees[group]
+            indices, distances = tree.query_radius(normalize(points.iloc[rows]), r=radius, return_distance=True, sort_results=True)
+
+            counts = [len(i) for i in indices]
+            if not sum(counts):
+                continue
+
+            neighbours = self.table.iloc[tree_rows[np.concatenate(indices)]].reset_index(drop=True)
+            neighbours.insert(0, 'point', np.repeat(rows, counts))
+            neighbours.insert(1, 'rank', np.concatenate([np.arange(n) for n in counts]))
+            neighbours.insert(2, 'distance', np.concatenate(distances))
+            results.append(neighbours)
+
+        if not results:
+            return pd.DataFrame(columns=['point', 'rank', 'distance', *self.table.columns])
+
+        return pd.concat(results, ignore_index=True).sort_values(['point', 'rank'], ignore_index=True)
+
+    def evaluated(self, points, radius):
+        """Mask of the points with an evaluated paramosome within the normalized distance radius."""
+        points = points.reset_index(drop=True)
+        mask = np.zeros(len(points), dtype=bool)
+
+        for group, rows in self._groups(points):
+            tree, _ = self.trees[group]
+            mask[rows] = tree.query_radius(normalize(points.iloc[rows]), r=radius, count_only=True) > 0
+
+        return mask
+
+if __name__ == '__main__':
+
+    command = sys.argv[1]
+    index_path = sys.argv[2]
+
+    if command == 'build':
+        files = sys.argv[3:]
+        merged_files = [f for f in files if f.endswith('.pkl')]
+        params_files = [f for f in files if not f.endswith('.pkl')]
+
+        index = ParamosomeIndex(evaluated_table(merged_files, params_files))
+        index.save(index_path)
+        print(f"{len(index)} evaluated paramosomes indexed in {index_path}")
+
+    elif command in ('knn', 'filter'):
+        index = ParamosomeIndex.load(index_path)
+
+        with open(sys.argv[3]) as f:
+            lines = [line.strip() for line in f if line.strip()]
+        points = read_params_file(sys.argv[3])
+
+        if command == 'knn':
+            k = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+            columns = ['point', 'rank', 'distance', *GROUPS, *PARAM_BOUNDS] + [c for c in ('cost', 'lip_cost', 'full_cost') if c in index.table]
+            with pd.option_context('display.width', 200, 'display.max_columns', 20):
+                print(index.knn(points, k)[columns].round(4).to_string())
+        else:
+            # Proposals with no evaluated paramosome within the radius
+            mask = index.evaluated(points, float(sys.argv[4]))
+            with open(sys.argv[5], 'w') as f:
+                f.writelines(line + '\n' for line, skip in zip(lines, mask) if not skip)
+            print(f"{mask.sum()} of {len(points)} proposals already evaluated, {len(points) - mask.sum()} written in {sys.argv[5]}")
+
+    else:
+        raise ValueError(f"Unknown command: {command} (build, knn or filter)")
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compressed and chunked storage of the popts time series
+
+The popts of coltrane_population are float64 arrays (time, copepod, strategy)
+that are smooth in time and NaN before spawning and after death. They are
+stored in chunks along the strategy axis, each chunk being byte-shuffled (the
+bytes of the same rank of all the values are stored together, which makes the
+NaN and the slowly varying exponents compress well) and compressed with zlib,
+lzma or lz4 (if the lz4 package is installed). The arrays can be downcast to
+float32. A reader only decompresses the arrays and the strategies requested.
+
+File layout: MAGIC, length of the header (uint64), JSON header (codec, shuffle,
+dtype, shape, offset and length of each chunk), then the compressed chunks.
+
+    save_popts(popts, 'coltrane_outputs_hyperboreus_IA_0_popts.chunks', codec='zlib', float32=True)
+    popts = load_popts('coltrane_outputs_hyperboreus_IA_0_popts.chunks', keys=['t', 'D', 'R', 'W'])
+
+    python popts_store.py convert ./coltrane_outputs_figures zlib 1
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import io
+import os
+import sys
+import json
+import lzma
+import time
+import zlib
+import pickle
+import struct
+import numpy as np
+
+from run_cache import atomic_write
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+MAGIC = b'CPOPTS01'
+POPTS_SUFFIX = '_popts.chunks'
+
+## Number of strategies per chunk
+CHUNK_STRATEGIES = 1
+
+## Codecs: (compress, decompress)
+CODECS = {'none': (lambda data, level: data, lambda data: data),
+          'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+          'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress)}
+
+if lz4_frame is not None:
+    CODECS['lz4'] = (lambda data, level: lz4_frame.compress(data, compression_level=level), lz4_frame.decompress)
+
+DEFAULT_LEVELS = {'none': 0, 'zlib': 1, 'lzma': 1, 'lz4': 0}
+
+def shuffle_bytes(data, itemsize):
+    """Group the bytes of the same rank of all the values."""
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, itemsize).T.tobytes()
+
+def unshuffle_bytes(data, itemsize):
+    """Inverse of shuffle_bytes."""
+    return np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+
+def encode_popts(popts, codec='zlib', level=None, shuffle=True, float32=False, chunk=CHUNK_STRATEGIES):
+    """
+    Encode popts in the chunked format.
+
+    Parameters
+    ----------
+    popts : dict
+        Population time series from coltrane_population.
+    codec : str
+        'zlib', 'lzma', 'lz4' (if installed) or 'none'.
+    level : int
+        Compression level (default DEFAULT_LEVELS, the fastest).
+    shuffle : bool
+        Byte-shuffle the chunks before compression.
+    float32 : bool
+        Downcast the float64 arrays to float32.
+    chunk : int
+        Number of strategies (last axis) per chunk. The arrays with less than
+        2 dimensions are stored in a single chunk.
+
+    Returns
+    -------
+    data : bytes
+        Encoded popts.
+
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown or unavailable codec: {codec} (available: {', '.join(CODECS)})")
+
+    compress = CODECS[codec][0]
+    level = DEFAULT_LEVELS[codec] if level is None else level
+
+    header = {'codec': codec, 'shuffle': shuffle, 'chunk': chunk, 'arrays': {}, 'objects': None}
+    chunks = []
+    offset = 0
+    objects = {}
+
+    for key, value in popts.items():
+        if not isinstance(value, np.ndarray) or value.dtype == object:
+            objects[key] = value
+            continue
+
+        if float32 and value.dtype == np.float64:
+            value = value.astype(np.float32)
+
+        if value.ndim >= 2:
+            parts = [value[..., j:j + chunk] for j in range(0, value.shape[-1], chunk)]
+        else:
+            parts = [value]
+
+        entries = []
+        for part in parts:
+            raw = np.ascontiguousarray(part).tobytes()
+            if shuffle and value.itemsize > 1:
+                raw = shuffle_bytes(raw, value.itemsize)
+            compressed = compress(raw, level)
+            entries.append([offset, len(compressed)])
+            chunks.append(compressed)
+            offset += len(compressed)
+
+        header['arrays'][key] = {'dtype': value.dtype.str, 'shape': list(value.shape), 'chunks': entries}
+
+    # Values that are not arrays (if any) are pickled
+    if objects:
+        raw = pickle.dumps(objects)
+        header['objects'] = [offset, len(raw)]
+        chunks.append(raw)
+
+    header_bytes = json.dumps(header).encode()
+
+    return MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes + b''.join(chunks)
+
+def save_popts(popts, path, codec='zlib', level=None, shuffle=True, float32=False, chunk=CHUNK_STRATEGIES):
+    """Save popts in the chunked format (atomically), see encode_popts."""
+    data = encode_popts(popts, codec, level, shuffle, float32, chunk)
+    atomic_write(path, lambda file: file.write(data))
+
+class PoptsReader:
+    """
+    Reader of popts in the chunked format, from a path or from the bytes of a
+    file. Only the chunks of the requested arrays and strategies are read and
+    decompressed.
+    """
+
+    def __init__(self, source):
+        self.file = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else open(source, 'rb')
+
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.file.close()
+            raise ValueError("Not a chunked popts file")
+
+        header_length, = struct.unpack('<Q', self.file.read(8))
+        self.header = json.loads(self.file.read(header_length))
+        self.data_start = len(MAGIC) + 8 + header_length
+        self.decompress = CODECS[self.header['codec']][1] if self.header['codec'] in CODECS else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def keys(self):
+        keys = list(self.header['arrays'])
+        if self.header['objects'] is not None:
+            keys += list(self._objects())
+        return keys
+
+    def shape(self, key):
+        return tuple(self.header['arrays'][key]['shape'])
+
+    def _read(self, offset, length):
+        self.file.seek(self.data_start + offset)
+        return self.file.read(length)
+
+    def _objects(self):
+        if self.header['objects'] is None:
+            return {}
+        return pickle.loads(self._read(*self.header['objects']))
+
+    def _chunk(self, array, n):
+        if self.decompress is None:
+            raise ValueError(f"Codec {self.header['codec']} not available (install the lz4 package)")
+
+        dtype = np.dtype(array['dtype'])
+        raw = self.decompress(self._read(*array['chunks'][n]))
+        if self.header['shuffle'] and dtype.itemsize > 1:
+            raw = unshuffle_bytes(raw, dtype.itemsize)
+
+        shape = array['shape']
+        if len(shape) >= 2:
+            width = min(self.header['chunk'], shape[-1] - n * self.header['chunk'])
+            shape = shape[:-1] + [width]
+
+        return np.frombuffer(raw, dtype=dtype).reshape(shape).copy()
+
+    def read(self, key, strategies=None):
+        """
+        Array key, for all the strategies or only for the strategies
+        requested (index, slice or list of indices along the last axis).
+        """
+        if key not in self.header['arrays']:
+            return self._objects()[key]
+
+        array = self.header['arrays'][key]
+        shape = array['shape']
+
+        if len(shape) < 2:
+            return self._chunk(array, 0)
+
+        if strategies is None:
+            return np.concatenate([self._chunk(array, n) for n in range(len(array['chunks']))], axis=-1)
+
+        chunk = self.header['chunk']
+        index = np.arange(shape[-1])[strategies]
+        needed = np.unique(np.atleast_1d(index) // chunk)
+
+        if len(needed) == 0:
+            return np.empty(shape[:-1] + [0], dtype=array['dtype'])
+
+        values = np.concatenate([self._chunk(array, n) for n in needed], axis=-1)
+
+        # Position of the strategies in the decompressed chunks (only the
+        # last chunk can be narrower, and it is always the last one)
+        local = np.searchsorted(needed, index // chunk) * chunk + index % chunk
+
+        return values[..., local]
+
+    def read_all(self, keys=None, strategies=None):
+        """Dict of the arrays keys (default: all), as popts."""
+        keys = self.keys() if keys is None else keys
+        return {key: self.read(key, strategies) for key in keys}
+
+def popts_file(base_path):
+    """Path of the popts of a run (base path without suffix): chunked if it exists, else pickle."""
+    path = base_path + POPTS_SUFFIX
+    return path if os.path.exists(path) else base_path + '_popts.pkl'
+
+def load_popts(source, keys=None, strategies=None):
+    """
+    Popts from a chunked or pickle file (path or bytes of the file). Only the
+    arrays keys (default: all) and the strategies requested are returned.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = source
+    else:
+        with open(source, 'rb') as f:
+            data = f.read(len(MAGIC))
+
+    if bytes(data[:len(MAGIC)]) == MAGIC:
+        with PoptsReader(source) as reader:
+            return reader.read_all(keys, strategies)
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        popts = pickle.loads(source)
+    else:
+        with open(source, 'rb') as f:
+            popts = pickle.load(f)
+
+    popts = {key: popts[key] for key in (popts if keys is None else keys)}
+    if strategies is not None:
+        popts = {key: value[..., strategies] if np.ndim(value) >= 2 else value for key, value in popts.items()}
+
+    return popts
+
+def convert_popts(folder_path, codec='zlib', float32=False, remove=False):
+    """
+    Convert the pickle popts of a folder to the chunked format and print the
+    size and read time of both.
+
+    Returns
+    -------
+    sizes : tuple
+        Total size (bytes) of the pickle and chunked files.
+    """
+    files = sorted(f for f in os.listdir(folder_path) if f.endswith('_popts.pkl'))
+    size_pickle = size_chunked = 0
+    time_pickle = time_chunked = 0.
+
+    for file_name in files:
+        path = os.path.join(folder_path, file_name)
+        new_path = path[:-len('_popts.pkl')] + POPTS_SUFFIX
+
+        start = time.perf_counter()
+        popts = load_popts(path)
+        time_pickle += time.perf_counter() - start
+
+        save_popts(popts, new_path, codec=codec, float32=float32)
+
+        start = time.perf_counter()
+        load_popts(new_path)
+        time_chunked += time.perf_counter() - start
+
+        size_pickle += os.path.getsize(path)
+        size_chunked += os.path.getsize(new_path)
+
+        if remove:
+            os.remove(path)
+
+    if files:
+        print(f"{len(files)} popts converted ({codec}{', float32' if float32 else ''}): "
+              f"{size_pickle / 1e6:.1f} MB -> {size_chunked / 1e6:.1f} MB, "
+              f"read {time_pickle / len(files):.3f} s -> {time_chunked / len(files):.3f} s per file")
+
+    return size_pickle, size_chunked
+
+if __name__ == '__main__':
+
+    command = sys.argv[1]
+
+    if command == 'convert':
+        folder_path = sys.argv[2]
+        codec = sys.argv[3] if len(sys.argv) > 3 else 'zlib'
+        float32 = bool(int(sys.argv[4])) if len(sys.argv) > 4 else False
+        remove = bool(int(sys.argv[5])) if len(sys.argv) > 5 else False
+
+        convert_popts(folder_path, codec, float32, remove)
+    else:
+        raise ValueError(f"Unknown command: {command} (convert)")
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prefetching reader of the model output and cost files
+
+The files are read by a pool of threads a few files ahead of the one being
+processed, so that the slow opens and reads of the parallel filesystem overlap
+with the computation. Only the raw bytes are read in the threads (reads release
+the GIL); the unpickling is done by the caller.
+
+    for path, future in prefetch_files(files, read_ahead=4):
+        model = pickle.loads(future.result())
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+## Number of files read ahead by default
+READ_AHEAD = 4
+
+def read_bytes(path):
+    """Content of a file."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def prefetch_files(items, read=read_bytes, read_ahead=READ_AHEAD):
+    """
+    Read the items in background threads, at most read_ahead items ahead of
+    the one being processed.
+
+    Parameters
+    ----------
+    items : list
+        Items to read (e.g. paths).
+    read : function
+        Function reading one item (default: content of the file).
+    read_ahead : int
+        Number of items read ahead (0 to read each item when it is processed).
+
+    Yields
+    ------
+    item : object
+        Item, in the order of items.
+    future : Future
+        Future of read(item): future.result() waits for the read and raises
+        its error if it failed.
+
+    """
+    items = list(items)
+
+    if read_ahead <= 0:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for item in items:
+                yield item, executor.submit(read, item)
+        return
+
+    with ThreadPoolExecutor(max_workers=read_ahead) as executor:
+        pending = deque()
+        next_item = 0
+
+        try:
+            while pending or next_item < len(items):
+                # Keep read_ahead items being read, plus the one being processed
+                while next_item < len(items) and len(pending) <= read_ahead:
+                    pending.append((items[next_item], executor.submit(read, items[next_item])))
+                    next_item += 1
+
+                yield pending.popleft()
+        finally:
+            # Stop the reads not started if the caller stops early
+            for _, future in pending:
+                future.cancel()
+
+def load_pickles(paths, read_ahead=READ_AHEAD, read=read_bytes):
+    """Yield the path and the unpickled content of each file, read ahead."""
+    for path, future in prefetch_files(paths, read=read, read_ahead=read_ahead):
+        yield path, pickle.loads(future.result())
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rank the paramosomes from the merged cost files
+
+Flatten the merged cost pickles (dict of lists of per-run dicts) into one table,
+select the k best paramosomes per species and scenario and extract the Pareto
+fronts, then write the parameter files used to run Coltrane for the figures.
+
+A run without simulated individuals in a stage and month observed for its
+species has no cost for it. By default ('penalty') this cost is the worst
+cost of the stage and month over the runs of the species, so that every run
+has a total cost and is ranked behind the runs that match the observations
+there ('mean' uses the mean cost, 'skip' leaves the total NaN and the run out
+of the rankings). No parameter file is written if a species and scenario has
+no ranked run.
+
+    python rank_costs.py merged_RMSE_costs_files_2013data_u0fix_8000sets.pkl 10 params_to_run_for_figures_cost.txt params_to_run_for_figures.txt pareto.csv penalty
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import sys
+import pickle
+import numpy as np
+import pandas as pd
+
+SCENARIOS = {'now_icealg': 'IA',
+             'default': 'noIA'
+             }
+
+## Cost of a stage and month without simulated individuals (see aggregate_costs)
+MISSING_COSTS = ('penalty', 'mean', 'skip')
+MISSING_COST = 'penalty'
+
+def load_costs_table(merged_files):
+    """
+    Load one or several merged cost files into a flat table.
+
+    Parameters
+    ----------
+    merged_files : list
+        Merged cost pickle files (from merge_pickle_files).
+
+    Returns
+    -------
+    table : DataFrame
+        One row per run with the parameters, the species ('glacialis' or
+        'hyperboreus'), the scenario ('IA' or 'noIA'), the file and the index
+        of the run in it, and one column per cost (NaN if not computed).
+
+    """
+    tables = []
+
+    for merged_file in merged_files:
+
+        with open(merged_file, 'rb') as f:
+            merged = pickle.load(f)
+
+        params = pd.DataFrame.from_records(merged['params'])
+        costs = pd.DataFrame.from_records(merged['cost'], index=params.index).astype(float)
+
+        table = pd.concat([params, costs], axis=1)
+        table['species'] = [species.split()[-1] for species in merged['species']]
+        table['scenario'] = table['preySatVersion'].map(SCENARIOS)
+        table['file'] = merged_file
+        table['run'] = np.arange(len(table))
+
+        tables.append(table)
+
+    return pd.concat(tables, ignore_index=True)
+
+def cost_columns(table, suffix):
+    """Cost columns of the table ending with suffix (e.g. '_tot_cost')."""
+    return [c for c in table.columns if isinstance(c, str) and c.startswith('M') and c.endswith(suffix)]
+
+def fill_missing_costs(table, columns, missing=MISSING_COST):
+    """
+    Copy of the cost columns in which a run missing a cost computed for its
+    species (no simulated individuals in a stage and month observed for its
+    species) gets the maximum ('penalty') or the mean ('mean') of this cost
+    over the runs of the species. With 'skip' the costs are left NaN. The
+    columns of the stages and months observed for the other species only
+    stay NaN.
+    """
+    if missing not in MISSING_COSTS:
+        raise ValueError(f"Unknown missing cost: {missing} ({', '.join(MISSING_COSTS)})")
+
+    costs = table[columns].copy()
+    if missing == 'skip':
+        return costs
+
+    for _, group in costs.groupby(table['species'], sort=False):
+        fill = group.max() if missing == 'penalty' else group.mean()
+        costs.loc[group.index] = group.fillna(fill)
+
+    return costs
+
+def aggregate_costs(table, columns, aggregate='sum', missing=MISSING_COST):
+    """
+    Aggregate the cost columns of each run over the columns computed for its
+    species (the stages and months observed for the other species only are
+    ignored), the missing costs being filled by fill_missing_costs. With
+    'skip', a run missing one of the costs has a NaN total.
+    """
+    costs = fill_missing_costs(table, columns, missing)
+    total = pd.Series(np.nan, index=table.index)
+
+    for _, group in costs.groupby(table['species'], sort=False):
+        species_columns = [c for c in columns if table.loc[group.index, c].notna().any()]
+        if species_columns:
+            total[group.index] = getattr(group[species_columns], aggregate)(axis=1, skipna=False)
+
+    return total
+
+def add_total_costs(table, aggregate='sum', missing=MISSING_COST):
+    """
+    Add the aggregated costs over all the months and stages to the table:
+    'cost' (RMSE total cost or MMD cost), and for the RMSE costs 'lip_cost',
+    'full_cost' and 'joint_cost' (if computed), and the number of stages and
+    months without simulated individuals of each run ('missing_costs'). The
+    missing costs are filled as given by missing (see aggregate_costs); with
+    'skip' a warning is printed for the species and scenarios without any
+    complete run.
+
+    Parameters
+    ----------
+    table : DataFrame
+        Table from load_costs_table.
+    aggregate : str
+        'sum' or 'mean' over the months and stages.
+    missing : str
+        'penalty', 'mean' or 'skip' (see MISSING_COSTS).
+
+    Returns
+    -------
+    table : DataFrame
+        Same table with the new columns.
+
+    """
+    rmse_columns = cost_columns(table, '_tot_cost')
+    cell_columns = rmse_columns or [c for c in cost_columns(table, '_cost') if c.count('_') == 2]
+
+    table['cost'] = aggregate_costs(table, cell_columns, aggregate, missing)
+
+    if rmse_columns:
+        table['lip_cost'] = aggregate_costs(table, cost_columns(table, '_lip_wgt_cost'), aggregate, missing)
+        table['full_cost'] = aggregate_costs(table, cost_columns(table, '_full_wgt_cost'), aggregate, missing)
+
+        joint_columns = cost_columns(table, '_joint_wgt_cost')
+        if joint_columns:
+            table['joint_cost'] = aggregate_costs(table, joint_columns, aggregate, missing)
+
+    # Stages and months of its species without individuals, whatever the missing costs
+    table['missing_costs'] = 0
+    for _, group in table.groupby('species', sort=False):
+        species_columns = [c for c in cell_columns if group[c].notna().any()]
+        table.loc[group.index, 'missing_costs'] = group[species_columns].isna().sum(axis=1)
+
+    # These groups are silently left out of the rankings otherwise
+    for (species, scenario), group in table.groupby(['species', 'scenario'], sort=False):
+        if group['cost'].isna().all():
+            print(f"Warning: no run of {species} {scenario} has all the costs of its stages and months "
+                  f"({len(group)} runs without total cost)", file=sys.stderr)
+
+    return table
+
+def top_k(table, k, cost='cost', by=('species', 'scenario')):
+    """
+    Select the k best runs of each group with np.argpartition, i.e. in linear
+    time per group, only the k selected runs being sorted.
+
+    Parameters
+    ----------
+    table : DataFrame
+        Table with a cost column.
+    k : int
+        Number of runs to keep per group.
+    cost : str
+        Cost column to rank.
+    by : tuple
+        Columns defining the groups.
+
+    Returns
+    -------
+    best : DataFrame
+        The k best runs of each group, sorted by increasing cost in each group.
+
+    """
+    selected = []
+
+    for _, group in table.groupby(list(by), sort=False):
+
+        values = group[cost].to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(values))
+
+        if len(valid) > k:
+            valid = valid[np.argpartition(values[valid], k - 1)[:k]]
+
+        selected.append(group.iloc[valid[np.argsort(values[valid], kind='stable')]])
+
+    return pd.concat(selected)
+
+def pareto_front(objectives):
+    """
+    Mask of the non-dominated points (all objectives are minimized).
+
+    With two objectives, the points are sorted by the first objective and a
+    point is on the front if its second objective is lower than the ones of all
+    the points before it, which is O(n log n). With more objectives, the points
+    are sorted by the sum of the objectives (a point can only be dominated by a
+    point before it) and the points dominated by each front point are removed
+    at once, which is O(n h) for h points on the front.
+
+    Parameters
+    ----------
+    objectives : array
+        n x d array of objectives. Rows with a NaN are never on the front.
+
+    Returns
+    -------
+    on_front : array
+        Boolean mask of the points on the Pareto front.
+
+    """
+    objectives = np.asarray(objectives, dtype=float)
+    n, d = objectives.shape
+
+    on_front = np.zeros(n, dtype=bool)
+    valid = np.flatnonzero(~np.any(np.isnan(objectives), axis=1))
+    points = objectives[valid]
+
+    if d == 2:
+        order = np.lexsort((points[:, 1], points[:, 0]))
+        second = points[order, 1]
+        best_before = np.concatenate([[np.inf], np.minimum.accumulate(second)[:-1]])
+        on_front[valid[order[second < best_before]]] = True
+
+        return on_front
+
+    order = np.argsort(points.sum(axis=1), kind='stable')
+    candidates = order
+
+    while len(candidates) > 0:
+        first = candidates[0]
+        on_front[valid[first]] = True
+        others = points[candidates[1:]]
+        dominated = np.all(points[first] <= others, axis=1)
+        candidates = candidates[1:][~dominated]
+
+    return on_front
+
+def pareto_fronts(table, columns, by=('species', 'scenario')):
+    """
+    Runs on the Pareto front of the given cost columns, for each group.
+
+    Parameters
+    ----------
+    table : DataFrame
+        Table with the cost columns.
+    columns : list
+        Cost columns to minimize (e.g. ['lip_cost', 'full_cost'] or the cost of
+        each stage).
+    by : tuple
+        Columns defining the groups.
+
+    Returns
+    -------
+    front : DataFrame
+        Runs on the front of their group.
+
+    """
+    fronts = []
+
+    for _, group in table.groupby(list(by), sort=False):
+        fronts.append(group[pareto_front(group[columns].to_numpy())])
+
+    return pd.concat(fronts)
+
+def stage_cost_columns(table):
+    """Cost column of each stage (summed over the months), added to the table."""
+    stage_columns = []
+
+    for column in cost_columns(table, '_tot_cost') or [c for c in cost_columns(table, '_cost') if c.count('_') == 2]:
+        stage = column.split('_')[1]
+        if f'{stage}_cost' not in table.columns:
+            table[f'{stage}_cost'] = 0.
+            stage_columns.append(f'{stage}_cost')
+        table[f'{stage}_cost'] += table[column]
+
+    return stage_columns
+
+def write_figure_params(best, path_params_cost, path_params_run=None):
+    """
+    Write the parameter files of the selected runs, with the columns of
+    params_to_run_for_figures_cost.txt (with a header) and of
+    params_to_run_for_figures.txt (without header, read by GNU parallel).
+    The ids are numbered in the order of the selected runs.
+
+    Parameters
+    ----------
+    best : DataFrame
+        Selected runs (e.g. from top_k).
+    path_params_cost : str
+        Path of the parameter file with the costs.
+    path_params_run : str
+        Path of the parameter file to run Coltrane for the figures (optional).
+
+    Returns
+    -------
+    None.
+
+    """
+    params = best[['u0', 'I0', 'Ks', 'KsIA', 'maxReserveFrac', 'rm', 'preySatVersion']].copy()
+    params['id'] = np.arange(len(best))
+    params['species'] = best['species'].values
+    params['scenario'] = best['scenario'].values
+
+    if path_params_run is not None:
+        params.to_csv(path_params_run, header=False, index=False)
+
+    params['cost'] = best['cost'].values
+    params.to_csv(path_params_cost, index=False)
+
+if __name__ == '__main__':
+
+    merged_files = sys.argv[1].split(',')
+    k = int(sys.argv[2])
+    path_params_cost = sys.argv[3]
+    path_params_run = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] != '-' else None
+    path_pareto = sys.argv[5] if len(sys.argv) > 5 and sys.argv[5] != '-' else None
+    missing = sys.argv[6] if len(sys.argv) > 6 else MISSING_COST
+
+    table = add_total_costs(load_costs_table(merged_files), missing=missing)
+
+    best = top_k(table, k)
+    best = best.sort_values(['species', 'scenario'], ascending=[False, True], kind='stable')
+
+    # A figure file without a whole species or scenario would silently change the figures
+    groups = table.groupby(['species', 'scenario']).groups.keys()
+    unranked = sorted(set(groups) - set(zip(best['species'], best['scenario'])))
+    if unranked:
+        sys.exit(f"Error: no ranked run for {', '.join(' '.join(group) for group in unranked)} "
+                 f"(missing costs '{missing}'), {path_params_cost} not written")
+
+    write_figure_params(best, path_params_cost, path_params_run)
+
+    print(f"{len(best)} paramosomes written in {path_params_cost}")
+
+    if path_pareto is not None:
+        stage_columns = stage_cost_columns(table)
+        front_columns = ['lip_cost', 'full_cost'] if 'lip_cost' in table.columns else stage_columns
+
+        front = pareto_fronts(table, front_columns)
+        front_stages = pareto_fronts(table, stage_columns)
+
+        front['front'] = '-'.join(front_columns)
+        front_stages['front'] = 'stages'
+
+        pd.concat([front, front_stages]).drop(columns=['file']).to_csv(path_pareto, index=False)
+
+        print(f"Pareto fronts ({len(front)} and {len(front_stages)} runs) written in {path_pareto}")
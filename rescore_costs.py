@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Score the model outputs again from their run statistics.
+
+When observations are added or the cost definition changes, the costs are
+computed from the run statistics saved by compute_all_costs (the individuals
+of each stage and month) instead of the model outputs. If the costs of a
+previous suffix are given, only the stages and months whose observations or
+cost settings changed are scored again, the others are copied.
+
+    python rescore_costs.py C4,C5,C6 8 ./ stats_sim2 observations_for_calibration.npy sim2_obs2024 5 0 sim2
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import sys
+import time
+
+from compute_all_costs import score_individuals, cost_folders, cost_keys, save_cost_outputs, parse_binning
+from ingest_observations import load_observations
+from run_cache import cost_file_path, file_digest
+from run_metrics import RunMetrics
+from prefetch_loader import load_pickles
+from shard_store import list_outputs, read_output, output_exists
+
+def load_previous_costs(folders):
+    """
+    Previous cost outputs of each cost (key 'RMSE' or gamma), indexed by model
+    output file name. The outputs without model file name are ignored.
+    """
+
+    previous = {}
+
+    for cost, folder in folders.items():
+        previous[cost] = {}
+
+        for _, outputs in load_pickles(list_outputs(folder), read=read_output):
+            if 'model_file' in outputs:
+                previous[cost][outputs['model_file']] = outputs
+
+    return previous
+
+def run_rescore(stages, months, folder_path_calibration, folder_stats, file_obs_data, suffix, gammas, n_boot=0, previous_suffix=None, binning=None, joint=False, shard=False):
+    """
+    Compute the RMSE and MMD costs of all the run statistics of a folder.
+    The costs are stored as with compute_all_costs, and have the same names
+    (keys) as the ones compute_all_costs would produce from the model outputs.
+
+    Parameters
+    ----------
+    stages: list
+        Stages to consider (C4, C5 and/or C6).
+    months: list
+        Months to consider.
+    folder_path_calibration: str
+        Path of the calibration folder (observations and cost outputs).
+    folder_stats: str
+        Folder of the run statistics (stats_{suffix} of compute_all_costs).
+    file_obs_data: str
+        Name of the observations file in folder_path_calibration.
+    suffix: str
+        Suffix of the folders storing the new costs.
+    gammas: list
+        Kernel widths of the MMD costs.
+    n_boot: int
+        Number of bootstrap resamples of the observations (0 for no bootstrap).
+    previous_suffix: str
+        Suffix of the folders of the previous costs, whose stages and months
+        with unchanged observations and cost settings are copied (optional).
+    binning: dict
+        Binning of each trait for the RMSE cost (default BINNING of compute_all_costs).
+    joint: bool
+        Add the joint (lipids x fullness) RMSE cost.
+    shard: bool
+        Append the costs to a shard in their folders instead of one file per
+        model output (see shard_store.py).
+
+    Returns
+    -------
+    None.
+    """
+
+    obs_path = f"{folder_path_calibration}{file_obs_data}"
+    obs_all = load_observations(obs_path)
+    obs_digest = file_digest(obs_path)
+
+    folders = cost_folders(folder_path_calibration, suffix, gammas)
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+
+    previous = {}
+    if previous_suffix is not None:
+        previous = load_previous_costs(cost_folders(folder_path_calibration, previous_suffix, gammas))
+
+    paths = list_outputs(folder_stats, '_stats.pkl')
+
+    print(f"Score again {len(paths)} run statistics")
+
+    start_time = time.time()
+    n_cached = 0
+
+    for n, (_, statistics) in enumerate(load_pickles(paths, read=read_output), start=1):
+
+        model_file = statistics['model_file']
+
+        keys = cost_keys(model_file, stages, months, obs_digest, n_boot, gammas, binning, joint)
+        if all(output_exists(cost_file_path(folders[cost], key)) for cost, key in keys.items()):
+            n_cached += 1
+            continue
+
+        metrics = RunMetrics()
+
+        previous_run = None
+        if previous:
+            previous_run = (previous['RMSE'].get(model_file),
+                            {gamma: previous[gamma][model_file] for gamma in gammas if model_file in previous[gamma]})
+
+        outputs_rmse, outputs_mmd = score_individuals(statistics['individuals'],
+                                                      statistics['params'],
+                                                      statistics['species'],
+                                                      obs_all,
+                                                      stages,
+                                                      months,
+                                                      gammas,
+                                                      n_boot,
+                                                      metrics,
+                                                      previous_run,
+                                                      binning,
+                                                      joint)
+
+        for cost, outputs in [('RMSE', outputs_rmse), *outputs_mmd.items()]:
+            outputs['model_file'] = model_file
+            save_cost_outputs(outputs, folders[cost], keys[cost], shard)
+
+        print(f"[{n}/{len(paths)}] {model_file} ({round(outputs_rmse['running_time'], 3)} sec)")
+
+    print(f"\n{n_cached} already scored")
+    print("Total running time (sec):", round(time.time() - start_time, 2))
+
+if __name__ == '__main__':
+
+    stages = sys.argv[1].split(',')
+    months = [int(m) for m in sys.argv[2].split(',')]
+    folder_path_calibration = sys.argv[3]
+    folder_stats = sys.argv[4]
+    file_obs_data = sys.argv[5]
+    suffix = sys.argv[6]
+    gammas = [float(g) for g in sys.argv[7].split(',')]
+    n_boot = int(sys.argv[8]) if len(sys.argv) > 8 else 0
+    previous_suffix = sys.argv[9] if len(sys.argv) > 9 and sys.argv[9] != '-' else None
+    binning = parse_binning(sys.argv[10]) if len(sys.argv) > 10 and sys.argv[10] != '-' else None
+    joint = bool(int(sys.argv[11])) if len(sys.argv) > 11 else False
+    shard = bool(int(sys.argv[12])) if len(sys.argv) > 12 else False
+
+    run_rescore(
+        stages=stages,
+        months=months,
+        folder_path_calibration=folder_path_calibration,
+        folder_stats=folder_stats,
+        file_obs_data=file_obs_data,
+        suffix=suffix,
+        gammas=gammas,
+        n_boot=n_boot,
+        previous_suffix=previous_suffix,
+        binning=binning,
+        joint=joint,
+        shard=shard
+    )
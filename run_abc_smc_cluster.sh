@@ -0,0 +1,49 @@
+#!/bin/bash
+
+# -----------------------------------
+# SLURM script - Coltrane Calibration
+# -----------------------------------
+
+#SBATCH --time=24:00:00
+#SBATCH --account=def-fmaps
+#SBATCH --job-name=coltrane_abc_smc
+#SBATCH --mail-type=ALL
+#SBATCH --mail-user=lucie.bourreau.1@ulaval.ca
+#SBATCH --ntasks-per-node=1
+#SBATCH --nodes=1
+#SBATCH --cpus-per-task=32
+#SBATCH --mem-per-cpu=20G
+#SBATCH -o slurm-mem-%j.out
+#SBATCH -e slurm-mem-%j.err
+
+module load StdEnv/2023
+module load python/3.10 scipy-stack
+virtualenv --no-download $SLURM_TMPDIR/env
+source $SLURM_TMPDIR/env/bin/activate
+pip install --no-index --upgrade pip
+pip install --no-index -r requirements.txt
+
+echo "Starting task"
+
+# Run records for the progress of the calibration (python sweep_progress.py ./manifest_$SLURM_JOB_ID)
+export COLTRANE_MANIFEST_DIR="./manifest_$SLURM_JOB_ID"
+# Fix the inputs
+species="Calanus glacialis"
+preySatVersion="now_icealg"
+folder_path_batch="./abc_batch_glacialis_IA"
+folder_path_calibration="./"
+file_obs_data="merged_LOKI2013_ecotaxa_masks_features_for_calibration.csv"
+prefix="abc_glacialis_IA"
+
+# Parse the observation categories once into integer codes
+python -u ingest_observations.py "$folder_path_calibration$file_obs_data" "${folder_path_calibration}observations_for_calibration.npy"
+file_obs_data="observations_for_calibration.npy"
+
+# ABC-SMC with the MMD cost (stages C4,C5,C6, August, gamma 5), 500 particles
+# per generation run by 32 workers, at most 4000 runs
+python -u abc_smc.py "$species" "$preySatVersion" "$folder_path_batch" "$folder_path_calibration" "$file_obs_data" C4,C5,C6 8 5 $SLURM_CPUS_PER_TASK 500 "$prefix" 4000
+
+# Merge the costs of the runs into the usual merged cost files
+python -u coltrane_batch_costs.py merge "$folder_path_batch" "$folder_path_calibration" "$prefix"
+
+echo "Task done"
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Deterministic run keys and cache of the simulation and cost outputs
+
+The outputs are named with a hash of everything that determines them (params,
+species, scenario, forcing, observations, cost settings and version of the
+code) instead of the time of the run. A run whose output already exists is
+skipped, so that a sweep restarted after a failure, or re-scored with a new
+cost function, only computes the missing outputs. The files are written
+atomically so that an interrupted run never leaves a truncated output.
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import glob
+import json
+import pickle
+import hashlib
+import numpy as np
+from functools import lru_cache
+
+## Arguments of coltrane_forcing used by the simulation drivers
+FORCING_ARGS = ("NOW", 7)
+
+## Source files that determine the outputs (relative to this folder): the
+## drivers are included since they extract the outputs and select the cells
+SIMULATION_SOURCES = ('model/*.py', 'select_C4_C6_ind_repro.py', 'coltrane_save_outputs_for_multiple_costs.py',
+                      'coltrane_save_alloutputs_for_figures.py')
+COST_SOURCES = ('RMSE_cost_function.py', 'histogram_bins.py', 'compute_MMD_cost.py', 'ingest_observations.py', 'bootstrap_costs.py',
+                'compute_all_costs.py', 'compute_RMSE_cost.py', 'rescore_costs.py', 'coltrane_batch_costs.py')
+
+KEY_LENGTH = 16
+
+def run_key(**fields):
+    """Hash of the fields of a run (order independent)."""
+    content = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()[:KEY_LENGTH]
+
+@lru_cache(maxsize=None)
+def code_version(patterns):
+    """Hash of the content of the source files matching the patterns."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            digest.update(os.path.relpath(path, root).encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+
+    return digest.hexdigest()[:KEY_LENGTH]
+
+@lru_cache(maxsize=None)
+def file_digest(path):
+    """Hash of the content of a file (e.g. the observations)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()[:KEY_LENGTH]
+
+def array_digest(values):
+    """Hash of the content of an array (e.g. the observations of a stage and month)."""
+    values = np.ascontiguousarray(values)
+    digest = hashlib.sha256(str((values.dtype, values.shape)).encode())
+    digest.update(values.tobytes())
+
+    return digest.hexdigest()[:KEY_LENGTH]
+
+def simulation_key(params, species, scenario=None, months=None):
+    """
+    Key of a Coltrane run. The months of the selection are only part of the
+    key if the outputs are restricted to some months.
+    """
+    fields = {} if months is None else {'months': sorted(months)}
+
+    return run_key(params=params, species=species, scenario=scenario,
+                   forcing=FORCING_ARGS, code=code_version(SIMULATION_SOURCES), **fields)
+
+def cost_key(cost, file_model_outputs, stages, months, obs_digest, n_boot=0, gamma=None, binning=None, joint=False):
+    """
+    Key of the cost of one model output. The model output is identified by its
+    file name, which contains the key of the simulation. The stages and months
+    are sorted and gamma is a float so that all the cost drivers share the
+    same keys. The binning and the joint histogram of the RMSE cost are only
+    part of the key if they are not the default ones.
+    """
+    fields = {} if binning is None else {'binning': binning}
+    if joint:
+        fields['joint'] = True
+
+    return run_key(cost=cost, model=os.path.basename(file_model_outputs),
+                   stages=sorted(stages), months=sorted(months), obs=obs_digest,
+                   n_boot=int(n_boot), gamma=None if gamma is None else float(gamma),
+                   code=code_version(COST_SOURCES), **fields)
+
+def cost_file_path(folder_path, key):
+    """Path of the cost outputs of a key."""
+    return f'{folder_path}/coltrane_multisp_lipids_fullness_calibration_{key}.pkl'
+
+def atomic_write(path, write):
+    """Write a file with write(file) in a temporary file renamed at the end."""
+    tmp_path = f'{path}.tmp{os.getpid()}'
+
+    try:
+        with open(tmp_path, 'wb') as file:
+            write(file)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def atomic_pickle_dump(obj, path):
+    """Pickle obj into path atomically."""
+    atomic_write(path, lambda file: pickle.dump(obj, file))
+
+def dedup_key(data):
+    """
+    Key of an output when merging: its params and species, so that the
+    outputs of a paramosome run twice (e.g. older outputs named with the time
+    of the run) are merged only once.
+    """
+    return run_key(params=data.get('params'), species=data.get('species'))
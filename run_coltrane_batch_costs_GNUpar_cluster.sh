@@ -0,0 +1,51 @@
+#!/bin/bash
+
+# -----------------------------------
+# SLURM script - Coltrane Calibration
+# -----------------------------------
+
+#SBATCH --time=06:00:00
+#SBATCH --account=def-fmaps
+#SBATCH --job-name=coltrane_batch_sim2
+#SBATCH --mail-type=ALL
+#SBATCH --mail-user=lucie.bourreau.1@ulaval.ca
+#SBATCH --ntasks-per-node=1
+#SBATCH --nodes=1
+#SBATCH --cpus-per-task=32
+#SBATCH --mem-per-cpu=20G
+#SBATCH -o slurm-mem-%j.out
+#SBATCH -e slurm-mem-%j.err
+
+module load StdEnv/2023
+module load python/3.10 scipy-stack
+virtualenv --no-download $SLURM_TMPDIR/env
+source $SLURM_TMPDIR/env/bin/activate
+pip install --no-index --upgrade pip
+pip install --no-index -r requirements.txt
+
+echo "Starting task"
+
+# Run records for the progress of the sweep (python sweep_progress.py ./manifest_$SLURM_JOB_ID)
+export COLTRANE_MANIFEST_DIR="./manifest_$SLURM_JOB_ID"
+# Fix the inputs
+folder_path_batch="./coltrane_batch_sim2"
+folder_path_calibration="./"
+file_obs_data="merged_LOKI2013_ecotaxa_masks_features_for_calibration.csv"
+suffix="sim2"
+
+mkdir -p "$folder_path_batch"
+
+# Parse the observation categories once into integer codes
+python -u ingest_observations.py "$folder_path_calibration$file_obs_data" "${folder_path_calibration}observations_for_calibration.npy"
+file_obs_data="observations_for_calibration.npy"
+
+# One task per LHS paramosome (first 7 columns, shared by the species and
+# scenarios), which runs all its variants and computes their costs
+# (stages C4,C5,C6, August, gamma 5, no bootstrap, default binning, no joint cost, records in shards)
+cut -d',' -f1-7 ./multisp_parameters_u0fix_IA_8000.txt | awk '!seen[$0]++' | \
+parallel -j $SLURM_CPUS_PER_TASK --colsep ',' python -u coltrane_batch_costs.py {1} {2} {3} {4} {5} {6} {7} "$folder_path_batch" "$folder_path_calibration" "$file_obs_data" C4,C5,C6 8 5 0 - 0 1
+
+# Merge the costs of all the records into one file per cost
+python -u coltrane_batch_costs.py merge "$folder_path_batch" "$folder_path_calibration" "$suffix"
+
+echo "Task done"
@@ -27,8 +27,9 @@ echo "Starting task"
 
 #parallel -j $SLURM_CPUS_PER_TASK --colsep ',' python -u coltrane_save_alloutputs_for_figures.py {1} {2} {3} {4} {5} {6} {7} {8} {9} {10} "./coltrane_outputs_figures" :::: ./params_to_run_for_figures.txt
 
+# popts are stored compressed (zlib) in float32 chunks (see popts_store.py)
 tail -n 38 ./params_to_run_for_figures.txt | \
-parallel -j $SLURM_CPUS_PER_TASK --colsep ',' python -u coltrane_save_alloutputs_for_figures.py {1} {2} {3} {4} {5} {6} {7} {8} {9} {10} "./coltrane_outputs_figures"
+parallel -j $SLURM_CPUS_PER_TASK --colsep ',' python -u coltrane_save_alloutputs_for_figures.py {1} {2} {3} {4} {5} {6} {7} {8} {9} {10} "./coltrane_outputs_figures" zlib 1
 
 
 echo "Task done"
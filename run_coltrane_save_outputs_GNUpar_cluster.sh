@@ -11,8 +11,8 @@
 #SBATCH --mail-user=lucie.bourreau.1@ulaval.ca
 #SBATCH --ntasks-per-node=1
 #SBATCH --nodes=1
-#SBATCH --cpus-per-task=32
-#SBATCH --mem-per-cpu=20G
+#SBATCH --cpus-per-task=64
+#SBATCH --mem-per-cpu=10G
 #SBATCH -o slurm-mem-%j.out
 #SBATCH -e slurm-mem-%j.err
 
@@ -25,7 +25,22 @@ pip install --no-index -r requirements.txt
 
 echo "Starting task"
 
-parallel -j $SLURM_CPUS_PER_TASK --colsep ',' python -u coltrane_save_outputs_for_multiple_costs.py {1} {2} {3} {4} {5} {6} {7} {8} {9} {10} "./coltrane_outputs_sim2" :::: ./multisp_parameters_u0fix_IA_8000.txt
+# Run records for the progress of the sweep (python sweep_progress.py ./manifest_$SLURM_JOB_ID)
+export COLTRANE_MANIFEST_DIR="./manifest_$SLURM_JOB_ID"
+
+# Run the paramosomes longest first, their runtimes being predicted from the
+# runs recorded in the previous manifests (file order if there is none)
+python -u job_scheduler.py order ./multisp_parameters_u0fix_IA_8000.txt "./manifest_*" ./multisp_parameters_u0fix_IA_8000_ordered.txt
+
+# The outputs are appended to one shard per job slot (1) instead of one file per run.
+# The workers are started while their projected peak memory fits in the memory
+# of the job (same total memory as 32 workers at 20G), the workers killed for
+# memory are started again with less workers. The forcing is computed once and
+# shared with the workers (1)
+python -u memory_runner.py ./multisp_parameters_u0fix_IA_8000_ordered.txt $SLURM_CPUS_PER_TASK - "./manifest_*" 1 \
+    python -u coltrane_save_outputs_for_multiple_costs.py {1} {2} {3} {4} {5} {6} {7} {8} {9} {10} "./coltrane_outputs_sim2" 1
+
+# parallel -j $SLURM_CPUS_PER_TASK --colsep ',' python -u coltrane_save_outputs_for_multiple_costs.py {1} {2} {3} {4} {5} {6} {7} {8} {9} {10} "./coltrane_outputs_sim2" 1 :::: ./multisp_parameters_u0fix_IA_8000_ordered.txt
 
 # tail -n 2200 ./multisp_parameters_u0fix_IA_8000.txt | \
 # parallel -j $SLURM_CPUS_PER_TASK --colsep ',' \
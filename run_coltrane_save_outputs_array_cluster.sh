@@ -0,0 +1,37 @@
+#!/bin/bash
+
+# -----------------------------------
+# SLURM script - Coltrane Calibration
+# -----------------------------------
+
+#SBATCH --time=06:00:00
+#SBATCH --account=def-fmaps
+#SBATCH --job-name=coltrane_outputs_sim2_array
+#SBATCH --mail-type=ALL
+#SBATCH --mail-user=lucie.bourreau.1@ulaval.ca
+#SBATCH --ntasks-per-node=1
+#SBATCH --nodes=1
+#SBATCH --cpus-per-task=32
+#SBATCH --mem-per-cpu=20G
+#SBATCH -o slurm-mem-%A_%a.out
+#SBATCH -e slurm-mem-%A_%a.err
+
+module load StdEnv/2023
+module load python/3.10 scipy-stack
+virtualenv --no-download $SLURM_TMPDIR/env
+source $SLURM_TMPDIR/env/bin/activate
+pip install --no-index --upgrade pip
+pip install --no-index -r requirements.txt
+
+echo "Starting task"
+
+# Run records for the progress of the sweep (python sweep_progress.py ./manifest_${SLURM_ARRAY_JOB_ID}_$SLURM_ARRAY_TASK_ID)
+export COLTRANE_MANIFEST_DIR="./manifest_${SLURM_ARRAY_JOB_ID}_$SLURM_ARRAY_TASK_ID"
+
+# One chunk of paramosomes per array task, packed by job_scheduler.py to fit
+# the --time of the task on its cores and ordered longest first:
+#   python job_scheduler.py pack ./multisp_parameters_u0fix_IA_8000.txt "./manifest_*" 32 06:00:00 ./chunks_sim2
+#   sbatch --array=0-<number of chunks - 1> run_coltrane_save_outputs_array_cluster.sh
+parallel -j $SLURM_CPUS_PER_TASK --colsep ',' python -u coltrane_save_outputs_for_multiple_costs.py {1} {2} {3} {4} {5} {6} {7} {8} {9} {10} "./coltrane_outputs_sim2" 1 :::: ./chunks_sim2/chunk_$SLURM_ARRAY_TASK_ID.txt
+
+echo "Task done"
@@ -0,0 +1,71 @@
+#!/bin/bash
+
+# -----------------------------------
+# SLURM script - Coltrane Calibration
+# -----------------------------------
+
+#SBATCH --time=00:40:00
+#SBATCH --account=def-fmaps
+#SBATCH --job-name=coltrane_costs
+#SBATCH --mail-type=ALL
+#SBATCH --mail-user=lucie.bourreau.1@ulaval.ca
+#SBATCH --ntasks-per-node=1
+#SBATCH --nodes=1
+#SBATCH --cpus-per-task=40
+#SBATCH --mem-per-cpu=1G
+#SBATCH -o slurm-mem-%j.out
+#SBATCH -e slurm-mem-%j.err
+
+echo "Load environment"
+
+module load StdEnv/2023
+module load python/3.10 scipy-stack
+
+echo "Virtual environment"
+
+virtualenv --no-download $SLURM_TMPDIR/env
+source $SLURM_TMPDIR/env/bin/activate
+
+echo "Install dependencies"
+
+pip install --no-index --upgrade pip
+pip install --no-index -r requirements.txt
+
+echo "Starting task"
+
+# Run records for the progress of the sweep (python sweep_progress.py ./manifest_$SLURM_JOB_ID)
+export COLTRANE_MANIFEST_DIR="./manifest_$SLURM_JOB_ID"
+
+# Fix the inputs
+stages=("C4" "C5" "C6")
+months=(8)
+gammas=(5)
+folder_path_model_outputs="/project/6001619/lucieb/Coltrane_calibration/coltrane_outputs_sim2"
+folder_path_calibration="./"
+file_obs_data="merged_LOKI2013_ecotaxa_masks_features_for_calibration.csv"
+suffix="sim2"
+
+# Separate array items with a comma
+stages_str=$(IFS=, ; echo "${stages[*]}")
+months_str=$(IFS=, ; echo "${months[*]}")
+gammas_str=$(IFS=, ; echo "${gammas[*]}")
+
+# Parse the observation categories once into integer codes
+python -u ingest_observations.py "$folder_path_calibration$file_obs_data" "${folder_path_calibration}observations_for_calibration.npy"
+file_obs_data="observations_for_calibration.npy"
+
+# List all model outputs, in their own pickle files or in shards
+python -u shard_store.py list "$folder_path_model_outputs" > model_output_files_$suffix.txt
+
+# Compute the RMSE and MMD costs, each model output is loaded only once
+# (no bootstrap, default binning, no joint cost, 4 files read ahead, costs in shards)
+python -u compute_all_costs.py "$stages_str" "$months_str" "$folder_path_calibration" model_output_files_$suffix.txt "$file_obs_data" "$suffix" "$gammas_str" $SLURM_CPUS_PER_TASK 0 - 0 4 1
+
+# Merge pickle files into one per cost
+python -u merge_pickle_files.py "${folder_path_calibration}costs_$suffix" "$folder_path_calibration" "merged_RMSE_costs_files_2013data_u0fix_IA_8000sets.pkl"
+
+for gamma in "${gammas[@]}"; do
+    python -u merge_pickle_files.py "${folder_path_calibration}MMD_gam${gamma}_costs_$suffix" "$folder_path_calibration" "merged_MMD_costs_gam${gamma}_files_2013data_u0fix_IA_8000sets.pkl"
+done
+
+echo "Task done"
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run manifest of the simulation and cost drivers
+
+Each run appends a 'start' and an 'end' record (JSON lines) to the manifest of
+its host in the folder given by the COLTRANE_MANIFEST_DIR environment variable
+(nothing is written if it is not set). The end record has the status of the
+run ('ok' or 'failed') and its metrics. The manifest is read by sweep_progress.py.
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import json
+import time
+import fcntl
+import socket
+from contextlib import contextmanager
+
+MANIFEST_DIR_ENV = 'COLTRANE_MANIFEST_DIR'
+
+def worker_name():
+    """Name of the worker: host and GNU parallel job slot (or process id)."""
+    slot = os.environ.get('PARALLEL_JOBSLOT') or f'pid{os.getpid()}'
+    return f'{socket.gethostname()}:{slot}'
+
+def append_record(manifest_dir, record):
+    """
+    Append one record to the manifest of the host. The line is written with a
+    single write under an exclusive lock, so that concurrent workers of the
+    same host never interleave their records.
+    """
+    os.makedirs(manifest_dir, exist_ok=True)
+    path = os.path.join(manifest_dir, f'manifest_{socket.gethostname()}.jsonl')
+    line = json.dumps(record, default=str) + '\n'
+
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.write(line)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+@contextmanager
+def run_record(driver, run_id, manifest_dir=None):
+    """
+    Record the start and the end of a run in the manifest.
+
+    Usage:
+        with run_record('compute_RMSE_cost', file_model_outputs) as record:
+            outputs = run_cost_function(...)
+            record['metrics'] = outputs['metrics']
+
+    Parameters
+    ----------
+    driver : str
+        Name of the driver.
+    run_id : str
+        Identifier of the run (paramosome, model output file...).
+    manifest_dir : str
+        Folder of the manifest (default: COLTRANE_MANIFEST_DIR, no record if unset).
+
+    Yields
+    ------
+    record : dict
+        Extra information to add to the end record (e.g. 'metrics').
+
+    """
+    manifest_dir = manifest_dir or os.environ.get(MANIFEST_DIR_ENV)
+    record = {}
+
+    if not manifest_dir:
+        yield record
+        return
+
+    base = {'driver': driver, 'run_id': str(run_id), 'worker': worker_name(), 'pid': os.getpid()}
+    start = time.time()
+    append_record(manifest_dir, {**base, 'event': 'start', 'time': start})
+
+    try:
+        yield record
+    except BaseException as e:
+        append_record(manifest_dir, {**base, 'event': 'end', 'time': time.time(), 'start': start,
+                                     'status': 'failed', 'error': repr(e), **record})
+        raise
+
+    append_record(manifest_dir, {**base, 'event': 'end', 'time': time.time(), 'start': start,
+                                 'status': 'ok', **record})
+
+class ManifestReader:
+    """
+    Incremental reader of the manifests of a folder: each call to read()
+    returns only the records appended since the previous call.
+    """
+
+    def __init__(self, manifest_dir):
+        self.manifest_dir = manifest_dir
+        self.offsets = {}
+
+    def read(self):
+        records = []
+
+        if not os.path.isdir(self.manifest_dir):
+            return records
+
+        for file_name in sorted(os.listdir(self.manifest_dir)):
+            if not (file_name.startswith('manifest_') and file_name.endswith('.jsonl')):
+                continue
+
+            path = os.path.join(self.manifest_dir, file_name)
+            with open(path, 'rb') as f:
+                f.seek(self.offsets.get(path, 0))
+                data = f.read()
+
+            # Only complete lines, a line being written is read next time
+            end = data.rfind(b'\n') + 1
+            self.offsets[path] = self.offsets.get(path, 0) + end
+
+            for line in data[:end].splitlines():
+                if line.strip():
+                    records.append(json.loads(line))
+
+        return records
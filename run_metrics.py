@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-phase timing and memory metrics of the simulation and cost drivers
+
+Each phase (forcing, simulation, selection, extraction, observation load,
+histogram, MMD kernel, serialization...) records its wall time, CPU time and
+peak RSS. The peak RSS of a phase is the high-water mark of the process if it
+rose during the phase, else the RSS at its start and end (the phase stayed
+below an earlier peak). The high-water mark is not reset by default, so that
+the peak of the whole process (ru_maxrss read by memory_runner.py, seff...)
+stays exact. With COLTRANE_RESET_PEAK_RSS=1, it is reset at the start of each
+phase (/proc/self/clear_refs, Linux only) to measure the exact peak of every
+phase, at the cost of the peak of the process.
+
+The metrics are stored in the outputs of each paramosome (key 'metrics') and
+can be summarized over a folder of outputs to size the SLURM --time and
+--mem-per-cpu:
+
+    python run_metrics.py ./coltrane_outputs_sim2
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import sys
+import time
+import pickle
+import resource
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+
+## Environment variable enabling the reset of the high-water mark at each phase
+RESET_PEAK_ENV = 'COLTRANE_RESET_PEAK_RSS'
+
+def _read_status_mb(field, pid='self'):
+    """Value of a memory field of /proc/{pid}/status in MB (None if unavailable)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return None
+
+def _reset_peak_rss():
+    """Reset the peak RSS of the process (Linux only), True if it worked."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """Peak RSS of the process in MB (since the last reset if COLTRANE_RESET_PEAK_RSS is set)."""
+    peak = _read_status_mb('VmHWM')
+    if peak is None:
+        # ru_maxrss is in kB on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != 'darwin' else 1024**2)
+
+    return peak
+
+def rss_mb():
+    """Current RSS of the process in MB."""
+    rss = _read_status_mb('VmRSS')
+    return rss if rss is not None else peak_rss_mb()
+
+def process_rss_mb(pid):
+    """Current RSS of another process in MB (Linux only, None if unavailable)."""
+    return _read_status_mb('VmRSS', pid)
+
+class RunMetrics:
+    """
+    Metrics of the phases of one run.
+
+    Usage:
+        metrics = RunMetrics()
+        with metrics.phase('simulation'):
+            pop, popts = coltrane_population(forcing, p, 2)
+        outputs['metrics'] = metrics.to_dict()
+
+    A phase entered several times (e.g. 'histogram' for each stage and month)
+    accumulates its wall and CPU times and keeps its maximum peak RSS.
+    """
+
+    def __init__(self, reset_peak=None):
+        self.reset_peak = os.environ.get(RESET_PEAK_ENV) == '1' if reset_peak is None else reset_peak
+        self.phases = {}
+        self._open = []
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    @contextmanager
+    def phase(self, name):
+        start_peak = peak_rss_mb()
+        start_rss = rss_mb()
+
+        if self.reset_peak:
+            # Keep the peak of the enclosing phases before resetting it
+            for running in self._open:
+                running['peak'] = max(running['peak'], start_peak)
+
+            running = {'peak': 0.}
+            self._open.append(running)
+            _reset_peak_rss()
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+
+            peak = peak_rss_mb()
+
+            if self.reset_peak:
+                self._open.pop()
+                for enclosing in self._open:
+                    enclosing['peak'] = max(enclosing['peak'], peak)
+                peak = max(peak, running['peak'])
+            elif peak <= start_peak:
+                # The peak of the process was reached before the phase
+                peak = max(start_rss, rss_mb())
+
+            metrics = self.phases.setdefault(name, {'wall_time_s': 0., 'cpu_time_s': 0., 'peak_rss_mb': 0., 'calls': 0})
+            metrics['wall_time_s'] += wall
+            metrics['cpu_time_s'] += cpu
+            metrics['peak_rss_mb'] = max(metrics['peak_rss_mb'], peak)
+            metrics['calls'] += 1
+
+    def add(self, name, metrics):
+        """Add the metrics of a phase measured elsewhere (e.g. once per worker)."""
+        self.phases[name] = dict(metrics)
+
+    def to_dict(self):
+        """Metrics of all the phases and of the whole run so far."""
+        return {'phases': {name: dict(metrics) for name, metrics in self.phases.items()},
+                'wall_time_s': time.perf_counter() - self._start_wall,
+                'cpu_time_s': time.process_time() - self._start_cpu,
+                'rss_mb': rss_mb(),
+                'peak_rss_mb': max([peak_rss_mb(), *[m['peak_rss_mb'] for m in self.phases.values()]]),
+                'hostname': os.uname().nodename,
+                'pid': os.getpid()
+                }
+
+def metrics_table(folder_path):
+    """
+    Flatten the metrics of all the outputs of a folder into a table with one
+    row per run and phase.
+
+    Parameters
+    ----------
+    folder_path : str
+        Folder of the outputs (pickle files with a 'metrics' key).
+
+    Returns
+    -------
+    table : DataFrame
+        Columns 'file', 'species', 'phase', 'wall_time_s', 'cpu_time_s',
+        'peak_rss_mb' and 'calls'. The phase 'total' is the whole run.
+
+    """
+    rows = []
+
+    for file_name in sorted(os.listdir(folder_path)):
+        if not file_name.endswith('.pkl'):
+            continue
+
+        with open(os.path.join(folder_path, file_name), 'rb') as f:
+            outputs = pickle.load(f)
+
+        if not isinstance(outputs, dict) or 'metrics' not in outputs:
+            continue
+
+        metrics = outputs['metrics']
+        species = outputs.get('species')
+
+        for phase, phase_metrics in metrics['phases'].items():
+            rows.append({'file': file_name, 'species': species, 'phase': phase, **phase_metrics})
+
+        rows.append({'file': file_name, 'species': species, 'phase': 'total',
+                     'wall_time_s': metrics['wall_time_s'], 'cpu_time_s': metrics['cpu_time_s'],
+                     'peak_rss_mb': metrics['peak_rss_mb'], 'calls': 1})
+
+    return pd.DataFrame(rows)
+
+def summarize_metrics(table):
+    """
+    Median, 95th percentile and maximum of the wall time and peak RSS of each
+    phase and species.
+    """
+    return table.groupby(['species', 'phase'], sort=False).agg(
+        runs=('file', 'nunique'),
+        wall_median_s=('wall_time_s', 'median'),
+        wall_p95_s=('wall_time_s', lambda x: np.percentile(x, 95)),
+        wall_max_s=('wall_time_s', 'max'),
+        cpu_median_s=('cpu_time_s', 'median'),
+        peak_rss_p95_mb=('peak_rss_mb', lambda x: np.percentile(x, 95)),
+        peak_rss_max_mb=('peak_rss_mb', 'max'),
+    )
+
+if __name__ == '__main__':
+
+    table = metrics_table(sys.argv[1])
+
+    if table.empty:
+        print(f"No metrics found in {sys.argv[1]}")
+    else:
+        with pd.option_context('display.width', 200, 'display.max_columns', 20):
+            print(summarize_metrics(table).round(3))
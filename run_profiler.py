@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of a sample of the runs of a sweep
+
+When the environment variable COLTRANE_PROFILE is set to a fraction (e.g.
+0.02), this fraction of the runs of the simulation and cost drivers is run
+under cProfile and the profile of each run is written in the folder
+COLTRANE_PROFILE_DIR (default ./profiles). The runs are sampled from a hash
+of their run id, so that the same paramosomes are profiled if a sweep is run
+again. The profiles of a sweep are aggregated into a table of the hot spots
+(cumulative time by function over all the runs profiled):
+
+    export COLTRANE_PROFILE=0.02
+    python run_profiler.py ./profiles 30
+    python run_profiler.py ./profiles 30 compute_all_costs
+
+The profiled runs are flagged in the run manifest ('profiled'), since the
+profiler slows them down.
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import sys
+import pstats
+import marshal
+import hashlib
+import cProfile
+import pandas as pd
+from contextlib import contextmanager
+
+from run_cache import atomic_write
+
+PROFILE_ENV = 'COLTRANE_PROFILE'
+PROFILE_DIR_ENV = 'COLTRANE_PROFILE_DIR'
+PROFILE_SUFFIX = '.prof'
+
+## Functions always reported in the hot-spot table
+KEY_FUNCTIONS = ['coltrane_population', 'select_C4_C6_repro', 'cost_function', 'joint_cost_function', 'compute_weighted_mmd']
+
+def sampled(run_id, fraction):
+    """True for a fraction of the run ids, always the same ones."""
+    digest = hashlib.sha1(str(run_id).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') / 2**64 < fraction
+
+@contextmanager
+def profile_run(driver, run_id, record=None):
+    """
+    Profile the run if it is in the sample of COLTRANE_PROFILE (nothing is
+    done if it is not set).
+
+    Usage:
+        with run_record('compute_all_costs', file_model_outputs) as record, profile_run('compute_all_costs', file_model_outputs, record):
+            ...
+
+    Parameters
+    ----------
+    driver : str
+        Name of the driver (prefix of the profile file).
+    run_id : str
+        Identifier of the run (paramosome, model output file...).
+    record : dict
+        Record of the run manifest, flagged with 'profiled'.
+
+    Yields
+    ------
+    profiled : bool
+        True if the run is profiled.
+
+    """
+    fraction = float(os.environ.get(PROFILE_ENV) or 0)
+
+    if not sampled(run_id, fraction):
+        yield False
+        return
+
+    if record is not None:
+        record['profiled'] = True
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield True
+    finally:
+        profiler.disable()
+
+        folder_path = os.environ.get(PROFILE_DIR_ENV) or './profiles'
+        os.makedirs(folder_path, exist_ok=True)
+        digest = hashlib.sha1(str(run_id).encode()).hexdigest()[:16]
+        path = os.path.join(folder_path, f'{driver}_{digest}{PROFILE_SUFFIX}')
+
+        # Same content as Profile.dump_stats, written aside then renamed
+        profiler.create_stats()
+        data = marshal.dumps(profiler.stats)
+        atomic_write(path, lambda file: file.write(data))
+
+def profile_files(folder_path, driver=None):
+    """Profile files of a folder, of one driver or of all of them."""
+    return sorted(os.path.join(folder_path, f) for f in os.listdir(folder_path)
+                  if f.endswith(PROFILE_SUFFIX) and (driver is None or f.startswith(driver + '_')))
+
+def hot_spots(files):
+    """
+    Aggregate the profiles of several runs.
+
+    Returns
+    -------
+    table : DataFrame
+        One row per function ('function', 'file', 'line'), with the number of
+        calls, the own time ('tottime_s') and the cumulative time
+        ('cumtime_s') summed over the runs, the cumulative time per run and
+        as a percentage of the total time of the runs, sorted by cumulative
+        time.
+    """
+    stats = pstats.Stats(*files)
+    n_runs = len(files)
+
+    rows = []
+    for (file_name, line, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({'function': function,
+                     'file': os.path.basename(file_name),
+                     'line': line,
+                     'ncalls': ncalls,
+                     'tottime_s': tottime,
+                     'cumtime_s': cumtime,
+                     'cumtime_per_run_s': cumtime / n_runs,
+                     'cumtime_percent': 100 * cumtime / stats.total_tt if stats.total_tt else 0.
+                     })
+
+    return pd.DataFrame(rows).sort_values('cumtime_s', ascending=False, ignore_index=True)
+
+if __name__ == '__main__':
+
+    folder_path = sys.argv[1]
+    n_top = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    driver = sys.argv[3] if len(sys.argv) > 3 else None
+
+    files = profile_files(folder_path, driver)
+
+    if not files:
+        print(f"No profiles found in {folder_path}")
+        sys.exit()
+
+    table = hot_spots(files)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', 20, 'display.max_colwidth', 40):
+        print(f"Hot spots of {len(files)} profiled runs (cumulative time)")
+        print(table.head(n_top).round(3).to_string())
+
+        print("\nKey functions")
+        print(table[table['function'].isin(KEY_FUNCTIONS)].round(3).to_string())
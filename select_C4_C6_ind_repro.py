@@ -16,12 +16,48 @@ from yearday import yearday
 import numpy as np
 import copy
 
-def select_C4_C6_repro(popts, pop):
+def day_to_month(yday):
+    """
+    Month (1-12) of each yearday (1-365*n), as the month of
+    datetime(2000, 1, 1) + timedelta(days=int(yday)) for all the days at once.
+    """
+    dates = np.datetime64('2000-01-01', 'D') + np.asarray(yday).astype(np.int64).astype('timedelta64[D]')
+    months = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+
+    return int(months) if np.ndim(months) == 0 else months
+
+def time_axis(popts):
+    """
+    Time of each step of popts, over all the individuals (the time of an
+    individual can be NaN, e.g. before it spawns). Raises a ValueError if no
+    individual has a time at some step.
+    """
+    t = popts['t'][:, 0, 0]
+
+    # The first individual usually has all the times, the others are only read if not
+    if np.isnan(t).any():
+        valid = ~np.isnan(popts['t'])
+        t = np.where(valid, popts['t'], -np.inf).max(axis=(1, 2))
+        missing = np.flatnonzero(~valid.any(axis=(1, 2)))
+        if len(missing):
+            raise ValueError(f"No time in popts['t'] at {len(missing)} time steps (first: {missing[0]})")
+
+    return t
+
+def month_time_index(popts, months):
+    """Time steps of popts in the months."""
+    return np.flatnonzero(np.isin(day_to_month(time_axis(popts)), months))
+
+def select_C4_C6_repro(popts, pop, months=None):
     """
     Select individuals of stage C4 to C6 in August that reproduced (i.e., tEcen not nan)
     by adding a mask key in popts and pop.
     This is specific for the comparison with LOKI images of 2013.
     
+    If months are given, the time series are first restricted to the time
+    steps of these months, and the stages and the mask are only computed for
+    them (popts is then not modified).
+    
     0 --> individuals that has not reproduced
     1 --> individuals that has reproduced but were not C4-C5-C6 in August
     4 --> C4 in August that has reproduced
@@ -34,14 +70,26 @@ def select_C4_C6_repro(popts, pop):
         Population time series from coltrane_population.
     pop: dict
         Population metrics from coltrane_population.
+    months: list
+        Months to keep (default: all the time steps).
 
     Returns
     -------
     select_popts: dict
-        State variables as in popts with a new key called 'mask'.
+        State variables as in popts with a new key called 'mask' (and
+        'time_idx', the time steps kept, if months are given).
 
     """
     
+    ### Keep only the time steps of the months
+    if months is not None:
+        time_idx = month_time_index(popts, months)
+        n_time = popts['D'].shape[0]
+        
+        popts = {key: value[time_idx] if isinstance(value, np.ndarray) and value.ndim == 3 and value.shape[0] == n_time else copy.deepcopy(value)
+                 for key, value in popts.items()}
+        popts['time_idx'] = time_idx
+    
     ### Initialize the mask with zeros
     mask_popts = np.zeros_like(popts['D'])
     
@@ -57,22 +105,14 @@ def select_C4_C6_repro(popts, pop):
     for i in range(0,popts['D'].shape[2]):
         popts['stage'][:,:,i] = D_to_stage(popts['D'][:,:,i])
     
-    # Identify the C4 to C6 individuals
-    C4 = np.zeros_like(popts['D'])
-    C5 = np.zeros_like(popts['D'])
-    C6 = np.zeros_like(popts['D'])
-    for i in range(0,popts['D'].shape[2]):
-        C4[:,:,i] = np.where(popts['stage'][:,:,i] == 11, 1, 0)
-        C5[:,:,i] = np.where(popts['stage'][:,:,i] == 12, 1, 0)
-        C6[:,:,i] = np.where(popts['stage'][:,:,i] == 13, 1, 0)
-    
-    ### Update the mask to have 2 for individuals that were adults in august and have reproduced
-    mask_popts[(C4 == 1) & (mask_popts == 1)] = 4
-    mask_popts[(C5 == 1) & (mask_popts == 1)] = 5
-    mask_popts[(C6 == 1) & (mask_popts == 1)] = 6
+    ### Update the mask to have 4 to 6 for the C4 to C6 individuals that have reproduced
+    reproduced_popts = (mask_popts == 1)
+    mask_popts[(popts['stage'] == 11) & reproduced_popts] = 4
+    mask_popts[(popts['stage'] == 12) & reproduced_popts] = 5
+    mask_popts[(popts['stage'] == 13) & reproduced_popts] = 6
     
-    ### Add the new key to popts
-    select_popts = copy.deepcopy(popts)
+    ### Add the new key to popts (the sliced time series are already copies)
+    select_popts = copy.deepcopy(popts) if months is None else popts
     select_popts['mask'] = mask_popts
     
     return select_popts
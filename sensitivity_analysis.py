@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Global sensitivity of the costs to the parameters, from the LHS sweeps
+
+Estimates, for each species and scenario, the Sobol indices of the seven
+parameters of PARAM_BOUNDS on the costs of the runs already done, without a
+dedicated (Saltelli) design:
+
+    - first-order index S1 by binning: the runs are split into N_BINS bins of
+      equal count along each parameter and S1 is the variance of the mean
+      cost of the bins over the variance of the cost (Var(E[Y|Xi]) / Var(Y),
+      less the part due to the noise of the bin means), which only needs the
+      LHS to fill each bin;
+    - total index ST from a quadratic surrogate (main effects, squares and
+      pairwise interactions) fitted by least squares on the runs, evaluated
+      with the Jansen estimator on a Monte-Carlo design drawn uniformly in
+      PARAM_BOUNDS. The R2 of the surrogate says how much of the variance of
+      the cost the ST account for, and its R2 on held-out runs ('r2_cv',
+      N_FOLDS-fold cross-validation) whether it can be trusted.
+
+Confidence intervals are given by bootstrap resampling of the runs. The bins
+of all the resamples are computed at once (matrix of counts from
+bootstrap_costs.py) and the surrogates of all the resamples are evaluated on
+the same Monte-Carlo design with one matrix product per parameter.
+
+    python sensitivity_analysis.py merged_RMSE_costs_files_2013data_u0fix_8000sets.pkl cost,lip_cost,full_cost 200 sensitivity_RMSE.csv
+    python sensitivity_analysis.py merged_RMSE_costs_files_2013data_u0fix_8000sets.pkl - 200 sensitivity_RMSE.csv
+
+By default ('-'), the total cost and the cost of each stage and month are
+analysed. A run without individuals in a stage and month gets the cost of
+the 5th argument ('penalty' by default, see rank_costs.fill_missing_costs)
+for it and in its total cost, so that all the runs are analysed and the
+loss of the individuals is part of the sensitivity:
+
+    python sensitivity_analysis.py merged_RMSE_costs_files_2013data_u0fix_8000sets.pkl - 200 sensitivity_RMSE.csv penalty
+
+With 'skip', the indices of a stage and month are conditioned on the runs
+that have individuals in it (a subregion of PARAM_BOUNDS): the Monte-Carlo
+design of ST is then drawn from the parameters of these runs rather than
+uniformly, and 'n' is lower than 'n_group'.
+
+The costs are log-transformed (costs spanning several orders of magnitude
+would be driven by a few bad runs), set LOG_COSTS to False to use them as is.
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+
+from create_txt_file_paramosomes_multisp_u0fix import PARAM_BOUNDS
+from rank_costs import load_costs_table, add_total_costs, cost_columns, fill_missing_costs, MISSING_COST
+from paramosome_index import normalize, GROUPS
+from bootstrap_costs import bootstrap_indices, bootstrap_counts
+
+## Number of bins per parameter of the first-order indices
+N_BINS = 20
+
+## Minimum number of runs per bin (fewer bins for fewer runs)
+MIN_RUNS_PER_BIN = 10
+
+## Number of points of the Monte-Carlo design of the total indices
+N_MC = 16384
+
+## Number of folds of the held-out R2 of the surrogate
+N_FOLDS = 5
+
+## Sensitivity of the log of the costs
+LOG_COSTS = True
+
+def quadratic_features(x):
+    """
+    Features of the quadratic surrogate: constant, parameters, squares and
+    pairwise products.
+
+    Parameters
+    ----------
+    x : array
+        n x d normalized parameters (in [0, 1]).
+
+    Returns
+    -------
+    features : array
+        n x (1 + 2d + d(d-1)/2) matrix.
+
+    """
+    x = x - 0.5
+    i, j = np.triu_indices(x.shape[1], k=1)
+
+    return np.hstack([np.ones((len(x), 1)), x, x**2, x[:, i] * x[:, j]])
+
+def first_order_indices(x, y, counts, n_bins=N_BINS):
+    """
+    First-order indices by binning, for the original runs and all the
+    bootstrap resamples at once.
+
+    Parameters
+    ----------
+    x : array
+        n x d normalized parameters.
+    y : array
+        n costs.
+    counts : array
+        m x n number of times each run is in each resample (a row of ones for
+        the original runs).
+    n_bins : int
+        Number of bins of equal count along each parameter.
+
+    Returns
+    -------
+    s1 : array
+        m x d first-order indices.
+
+    """
+    n, d = x.shape
+
+    # Bin of each run along each parameter, from its rank
+    ranks = np.argsort(np.argsort(x, axis=0, kind='stable'), axis=0)
+    bins = ranks * n_bins // n + np.arange(d) * n_bins
+
+    # Run -> (parameter, bin) membership, the bins of all the parameters side by side
+    membership = np.zeros((n, d * n_bins))
+    np.put_along_axis(membership, bins, 1., axis=1)
+
+    total = counts.sum(axis=1, keepdims=True)
+    mean = counts @ y / total[:, 0]
+    variance = counts @ y**2 / total[:, 0] - mean**2
+
+    bin_counts = counts @ membership
+    bin_means = (counts @ (membership * y[:, None])) / np.maximum(bin_counts, 1)
+    between = (bin_counts * (bin_means - mean[:, None])**2).reshape(len(counts), d, n_bins).sum(axis=2) / total
+
+    # The noise of the bin means adds sum_b(sum c^2 / sum c) - sum c^2 / n over n times the variance
+    # within the bins, c being the counts of the runs: (n_bins - 1) / n for the original runs, more
+    # for a resample whose repeated runs make the bin means noisier
+    squares = counts**2
+    bin_squares = squares @ membership
+    repeats = (np.where(bin_counts > 0, bin_squares / np.maximum(bin_counts, 1), 0).reshape(len(counts), d, n_bins).sum(axis=2)
+               - squares.sum(axis=1, keepdims=True) / total)
+    noise = repeats / total * (variance[:, None] - between)
+
+    return (between - noise) / variance[:, None]
+
+def surrogate_cv_r2(x, y, n_folds=N_FOLDS, rng=None):
+    """R2 of the quadratic surrogate on held-out runs (n_folds-fold cross-validation)."""
+    rng = np.random.default_rng(0) if rng is None else rng
+
+    features = quadratic_features(x)
+    folds = rng.permutation(len(y)) % n_folds
+    predicted = np.empty(len(y))
+
+    for fold in range(n_folds):
+        test = folds == fold
+        coefficients, *_ = np.linalg.lstsq(features[~test], y[~test], rcond=None)
+        predicted[test] = features[test] @ coefficients
+
+    return 1 - np.mean((y - predicted)**2) / y.var()
+
+def total_indices(x, y, rows, n_mc=N_MC, rng=None, design=None):
+    """
+    Total indices of the quadratic surrogate fitted on the runs of each
+    resample (Jansen estimator on a Monte-Carlo design shared by all the
+    resamples).
+
+    Parameters
+    ----------
+    x : array
+        n x d normalized parameters.
+    y : array
+        n costs.
+    rows : array
+        m x n runs of each resample (np.arange(n) for the original runs).
+    n_mc : int
+        Number of points of the Monte-Carlo design.
+    rng : numpy.random.Generator
+        Random generator of the design.
+    design : array
+        Normalized parameters the points of the design are drawn from (e.g.
+        the runs the surrogate is fitted on, if they only cover a part of
+        PARAM_BOUNDS). None for a uniform design.
+
+    Returns
+    -------
+    st : array
+        m x d total indices.
+    r2 : array
+        m coefficients of determination of the surrogates.
+
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    d = x.shape[1]
+
+    features = quadratic_features(x)
+    coefficients = np.empty((len(rows), features.shape[1]))
+    r2 = np.empty(len(rows))
+
+    for m, resample in enumerate(rows):
+        coefficients[m], *_ = np.linalg.lstsq(features[resample], y[resample], rcond=None)
+        residuals = y[resample] - features[resample] @ coefficients[m]
+        r2[m] = 1 - residuals.var() / y[resample].var()
+
+    # Design A, and A with the column i taken from B for each parameter i
+    if design is None:
+        a = rng.random((n_mc, d))
+        b = rng.random((n_mc, d))
+    else:
+        a = design[rng.integers(len(design), size=n_mc)]
+        b = design[rng.integers(len(design), size=n_mc)]
+    f_a = quadratic_features(a) @ coefficients.T
+    st = np.empty((len(rows), d))
+
+    for i in range(d):
+        ab = a.copy()
+        ab[:, i] = b[:, i]
+        f_ab = quadratic_features(ab) @ coefficients.T
+        st[:, i] = ((f_a - f_ab)**2).mean(axis=0) / (2 * f_a.var(axis=0))
+
+    return st, r2
+
+def sensitivity_indices(x, y, n_boot=200, alpha=0.05, n_bins=N_BINS, n_mc=N_MC, rng=None, design=None):
+    """
+    First-order and total indices of the parameters on one cost, with their
+    bootstrap confidence intervals.
+
+    Parameters
+    ----------
+    x : array
+        n x d normalized parameters.
+    y : array
+        n costs.
+    n_boot : int
+        Number of bootstrap resamples of the runs.
+    alpha : float
+        The confidence intervals are the alpha/2 and 1 - alpha/2 quantiles of
+        the bootstrap indices.
+    n_bins : int
+        Maximum number of bins of the first-order indices (at least
+        MIN_RUNS_PER_BIN runs per bin).
+    n_mc : int
+        Number of points of the Monte-Carlo design of the total indices.
+    rng : numpy.random.Generator
+        Random generator of the resamples and of the design.
+    design : array
+        Parameters the design of the total indices is drawn from (None for a
+        uniform design, see total_indices).
+
+    Returns
+    -------
+    indices : dict
+        Arrays of d values 'S1', 'S1_low', 'S1_high', 'ST', 'ST_low',
+        'ST_high', 'r2' (R2 of the surrogate) and 'r2_cv' (its R2 on
+        held-out runs).
+
+    """
+    rng = np.random.default_rng(0) if rng is None else rng
+    n = len(y)
+    n_bins = max(2, min(n_bins, n // MIN_RUNS_PER_BIN))
+
+    boot_idx = bootstrap_indices(n, n_boot, rng)
+    counts = np.vstack([np.ones(n), bootstrap_counts(boot_idx, n)])
+    rows = np.vstack([np.arange(n), boot_idx])
+
+    s1 = first_order_indices(x, y, counts, n_bins)
+    st, r2 = total_indices(x, y, rows, n_mc, rng, design)
+    r2_cv = surrogate_cv_r2(x, y, rng=rng)
+
+    quantiles = [alpha / 2, 1 - alpha / 2]
+    s1_low, s1_high = np.quantile(s1[1:], quantiles, axis=0)
+    st_low, st_high = np.quantile(st[1:], quantiles, axis=0)
+
+    return {'S1': s1[0], 'S1_low': s1_low, 'S1_high': s1_high,
+            'ST': st[0], 'ST_low': st_low, 'ST_high': st_high,
+            'r2': np.full(x.shape[1], r2[0]), 'r2_cv': np.full(x.shape[1], r2_cv)}
+
+def sensitivity_table(table, costs=('cost',), n_boot=200, alpha=0.05, log=LOG_COSTS, seed=0, missing=MISSING_COST):
+    """
+    Sensitivity indices of each cost, for each species and scenario.
+
+    Parameters
+    ----------
+    table : DataFrame
+        Table from load_costs_table and add_total_costs.
+    costs : tuple
+        Cost columns to analyse.
+    n_boot : int
+        Number of bootstrap resamples of the runs.
+    alpha : float
+        Level of the confidence intervals.
+    log : bool
+        Use the log of the costs.
+    seed : int
+        Seed of the resamples and of the Monte-Carlo design.
+    missing : str
+        Cost of the stages and months without individuals in the per-cell
+        cost columns ('penalty', 'mean' or 'skip', see fill_missing_costs).
+
+    Returns
+    -------
+    indices : DataFrame
+        One row per species, scenario, cost and parameter, with the indices,
+        their confidence intervals, the R2 of the surrogate (also on held-out
+        runs), the number of runs used ('n') and of runs of the group
+        ('n_group'). If some runs of the group have no cost, the indices are
+        conditioned on the runs used and the design of ST is drawn from their
+        parameters. A group with fewer runs than needed to fit the surrogate
+        on N_FOLDS - 1 folds (or than two bins) is skipped, and a ValueError
+        is raised if all of them are.
+
+    """
+    results = []
+    n_features = quadratic_features(np.zeros((1, len(PARAM_BOUNDS)))).shape[1]
+    min_runs = max(-(-(n_features + 1) * N_FOLDS // (N_FOLDS - 1)), 2 * MIN_RUNS_PER_BIN)
+    skipped = []
+
+    cells = [c for c in costs if c in cost_columns(table, '_cost')]
+    if cells:
+        table = table.copy()
+        table[cells] = fill_missing_costs(table, cells, missing)
+
+    for (species, scenario), group in table.groupby(GROUPS, sort=False):
+        for cost in costs:
+
+            values = group[cost].to_numpy(dtype=float)
+            valid = np.isfinite(values) & (values > 0 if log else True)
+
+            if valid.sum() < min_runs:
+                print(f"{species} {scenario} {cost}: {valid.sum()} runs, skipped", file=sys.stderr)
+                skipped.append(f"{species} {scenario} {cost} ({valid.sum()} runs)")
+                continue
+
+            x = normalize(group[valid])
+            y = np.log(values[valid]) if log else values[valid]
+
+            # Conditioned on the runs with a cost: the surrogate is only evaluated where it was fitted
+            design = None if valid.all() else x
+            indices = sensitivity_indices(x, y, n_boot, alpha, rng=np.random.default_rng(seed), design=design)
+
+            result = pd.DataFrame(indices)
+            result.insert(0, 'parameter', list(PARAM_BOUNDS))
+            result.insert(0, 'cost', cost)
+            result.insert(0, 'scenario', scenario)
+            result.insert(0, 'species', species)
+            result['n'] = valid.sum()
+            result['n_group'] = len(group)
+            results.append(result)
+
+    if not results:
+        raise ValueError(f"Fewer than {min_runs} runs with a cost for all the analyses: {', '.join(skipped)}")
+
+    return pd.concat(results, ignore_index=True)
+
+def default_costs(table):
+    """Total cost and cost of each stage and month."""
+    cells = cost_columns(table, '_tot_cost') or [c for c in cost_columns(table, '_cost') if c.count('_') == 2]
+    return ['cost', *cells]
+
+if __name__ == '__main__':
+
+    merged_files = sys.argv[1].split(',')
+    costs = sys.argv[2].split(',') if len(sys.argv) > 2 and sys.argv[2] != '-' else None
+    n_boot = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    path_out = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] != '-' else None
+    missing = sys.argv[5] if len(sys.argv) > 5 else MISSING_COST
+
+    table = add_total_costs(load_costs_table(merged_files), missing=missing)
+    costs = default_costs(table) if costs is None else costs
+    indices = sensitivity_table(table, costs, n_boot, missing=missing)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(indices.round(3).to_string())
+
+    if path_out is not None:
+        indices.to_csv(path_out, index=False)
+        print(f"Sensitivity indices written in {path_out}")
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sharded storage of the model and cost outputs
+
+Instead of one small pickle file per run, each worker appends its outputs to
+its own shard file ('shard_{host}_{slot}.shard') and the offset of each record
+to the index of the shard ('shard_{host}_{slot}.idx', JSON lines). A folder of
+16000 runs is then a few dozen files instead of 16000, which is much lighter
+for the metadata servers of a parallel filesystem (listing, find, merging).
+
+A record is named as the pickle file it replaces, so that the outputs are
+referred to by the same paths whether they are in a shard or in their own file
+(e.g. './coltrane_outputs_sim2/coltrane_outputs_for_params_explo_{key}.pkl'),
+and the cost keys do not depend on the storage. The data of a record is
+written before its index line, so that a worker killed while writing never
+leaves a truncated record in the index.
+
+    python shard_store.py list ./coltrane_outputs_sim2 > model_output_files_sim2.txt
+    python shard_store.py pack ./coltrane_outputs_sim2
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import sys
+import json
+import fcntl
+import pickle
+
+from run_manifest import worker_name
+from run_cache import atomic_pickle_dump
+
+SHARD_SUFFIX = '.shard'
+INDEX_SUFFIX = '.idx'
+
+def shard_path(folder_path, name=None):
+    """Path of the shard of a worker (default: the current worker)."""
+    name = name or worker_name()
+    return os.path.join(folder_path, 'shard_' + name.replace(':', '_').replace('/', '_') + SHARD_SUFFIX)
+
+def append_to_shard(folder_path, name, data, shard=None):
+    """
+    Append one record (bytes) named name to the shard of the worker.
+
+    The shard is locked while the record and its index line are written, so
+    that two processes writing to the same shard never interleave records.
+
+    Returns
+    -------
+    path : str
+        Path of the record (folder_path/name).
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    path = shard if shard is not None else shard_path(folder_path)
+
+    with open(path, 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+            line = json.dumps({'name': name, 'offset': offset, 'length': len(data)}) + '\n'
+            with open(path[:-len(SHARD_SUFFIX)] + INDEX_SUFFIX, 'a') as index:
+                index.write(line)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    _index(folder_path).add(name, path, offset, len(data))
+
+    return os.path.join(folder_path, name)
+
+class ShardIndex:
+    """
+    Index of the records of the shards of a folder: name -> (shard, offset,
+    length). The index files are read incrementally, each call to refresh()
+    only reads the lines appended since the previous call. A record written
+    twice (e.g. a run restarted) is read from its last copy.
+    """
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.offsets = {}
+        self.records = {}
+
+    def add(self, name, path, offset, length):
+        self.records[name] = (path, offset, length)
+
+    def refresh(self):
+        if not os.path.isdir(self.folder_path):
+            return self
+
+        for file_name in sorted(os.listdir(self.folder_path)):
+            if not (file_name.startswith('shard_') and file_name.endswith(INDEX_SUFFIX)):
+                continue
+
+            index_path = os.path.join(self.folder_path, file_name)
+            path = index_path[:-len(INDEX_SUFFIX)] + SHARD_SUFFIX
+
+            with open(index_path, 'rb') as f:
+                f.seek(self.offsets.get(index_path, 0))
+                data = f.read()
+
+            # Only complete lines, a line being written is read next time
+            end = data.rfind(b'\n') + 1
+            self.offsets[index_path] = self.offsets.get(index_path, 0) + end
+
+            for line in data[:end].splitlines():
+                if line.strip():
+                    entry = json.loads(line)
+                    self.add(entry['name'], path, entry['offset'], entry['length'])
+
+        return self
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def read(self, name):
+        """Bytes of a record (random access, no other record is read)."""
+        path, offset, length = self.records[name]
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            data = os.pread(fd, length, offset)
+        finally:
+            os.close(fd)
+
+        if len(data) != length:
+            raise IOError(f"Truncated record {name} in {path}")
+
+        return data
+
+## Index of each folder, read once per process
+_indexes = {}
+
+def _index(folder_path):
+    folder_path = os.path.normpath(folder_path)
+    if folder_path not in _indexes:
+        _indexes[folder_path] = ShardIndex(folder_path).refresh()
+    return _indexes[folder_path]
+
+def output_exists(path):
+    """True if the output exists, in its own file or in a shard of its folder."""
+    return os.path.exists(path) or os.path.basename(path) in _index(os.path.dirname(path))
+
+def read_output(path):
+    """Bytes of an output, from its own file or from a shard of its folder."""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    name = os.path.basename(path)
+    index = _index(os.path.dirname(path))
+
+    # Records written by other workers since the index was read
+    if name not in index:
+        index.refresh()
+    if name not in index:
+        raise FileNotFoundError(path)
+
+    return index.read(name)
+
+def load_output(path):
+    """Unpickled output, from its own file or from a shard of its folder."""
+    return pickle.loads(read_output(path))
+
+def save_output(obj, path, shard=False):
+    """
+    Pickle an output into its own file (atomically), or append it to the shard
+    of the worker in the folder of path.
+    """
+    if shard:
+        return append_to_shard(os.path.dirname(path), os.path.basename(path), pickle.dumps(obj))
+
+    atomic_pickle_dump(obj, path)
+    return path
+
+def list_outputs(folder_path, suffix='.pkl'):
+    """
+    Paths of the outputs of a folder, in their own files or in shards. The
+    records of the shards are listed from the index files, without listing or
+    opening the records themselves.
+    """
+    names = set()
+
+    if os.path.isdir(folder_path):
+        names.update(f for f in os.listdir(folder_path) if f.endswith(suffix))
+
+    names.update(name for name in ShardIndex(folder_path).refresh().records if name.endswith(suffix))
+
+    return [os.path.join(folder_path, name) for name in sorted(names)]
+
+def pack_outputs(folder_path, suffix='.pkl', name='packed'):
+    """
+    Move the outputs of a folder stored in their own files into one shard.
+    Each file is removed once its record is indexed.
+
+    Returns
+    -------
+    n : int
+        Number of files packed.
+    """
+    path = shard_path(folder_path, name)
+    files = sorted(f for f in os.listdir(folder_path) if f.endswith(suffix))
+
+    for file_name in files:
+        file_path = os.path.join(folder_path, file_name)
+        with open(file_path, 'rb') as f:
+            append_to_shard(folder_path, file_name, f.read(), shard=path)
+        os.remove(file_path)
+
+    return len(files)
+
+if __name__ == '__main__':
+
+    command = sys.argv[1]
+    folder_path = sys.argv[2]
+
+    if command == 'list':
+        for path in list_outputs(folder_path):
+            print(path)
+    elif command == 'pack':
+        print(f"{pack_outputs(folder_path)} files packed into {shard_path(folder_path, 'packed')}")
+    else:
+        raise ValueError(f"Unknown command: {command} (list or pack)")
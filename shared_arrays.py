@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read-only arrays shared by the worker processes
+
+The inputs read by all the workers (observations, bins of the RMSE cost,
+forcing) are published once by the parent process in a shared memory block
+(multiprocessing.shared_memory). The workers receive a small descriptor
+(name of the block, offset, shape and dtype of each array, JSON) and attach
+read-only numpy views on the block, so that they neither parse nor unpickle
+the inputs again and do not hold their own copy of them.
+
+    with SharedArrays({'obs': obs_array}) as shared:
+        pool = Pool(n_workers, initializer=init_worker, initargs=(shared.descriptor, ...))
+    # in the workers
+    arrays = attach_arrays(descriptor)
+
+The forcing is published by memory_runner.py for the simulation workers in
+the environment variable COLTRANE_SHARED_FORCING (see shared_forcing). Since
+the model may write in its forcing, each run gets a copy-on-write mapping of
+the block (private=True): the pages are shared until a run writes in them,
+and the writes of a run are only seen by this run.
+
+The block is removed by the publisher when it is closed. On Python < 3.13 the
+blocks are not registered to the resource tracker (it would remove a block as
+soon as the first worker attached to it ends), so a block is only left in
+/dev/shm if the publisher is killed.
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import json
+import mmap
+import pickle
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+## Environment variable of the descriptor of the shared forcing
+FORCING_ENV = 'COLTRANE_SHARED_FORCING'
+
+## Alignment of the arrays in the block (bytes)
+ALIGNMENT = 64
+
+def _shared_memory(name=None, create=False, size=0):
+    """Shared memory block not removed by the resource tracker when the process ends."""
+    try:
+        return shared_memory.SharedMemory(name, create=create, size=size, track=False)
+    except TypeError:
+        # Python < 3.13
+        shm = shared_memory.SharedMemory(name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+class SharedArrays:
+    """
+    Publisher of arrays in a shared memory block.
+
+    Parameters
+    ----------
+    arrays : dict
+        Arrays to publish (structured arrays included). The values that are
+        not arrays are pickled in the block.
+
+    Attributes
+    ----------
+    descriptor : dict
+        Description of the block for attach_arrays (JSON serializable).
+    """
+
+    def __init__(self, arrays):
+        layout = {}
+        objects = {}
+        size = 0
+
+        for key, value in arrays.items():
+            if not isinstance(value, np.ndarray) or value.dtype == object:
+                objects[key] = value
+                continue
+
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            layout[key] = {'offset': size, 'shape': list(value.shape), 'dtype': np.lib.format.dtype_to_descr(value.dtype)}
+            size += value.nbytes
+
+        raw = pickle.dumps(objects) if objects else b''
+        self.shm = _shared_memory(create=True, size=max(size + len(raw), 1))
+
+        for key, entry in layout.items():
+            self._view(entry)[...] = arrays[key]
+        self.shm.buf[size:size + len(raw)] = raw
+
+        self.descriptor = {'name': self.shm.name, 'arrays': layout, 'objects': [size, len(raw)] if objects else None}
+
+    def _view(self, entry):
+        dtype = np.lib.format.descr_to_dtype(entry['dtype'])
+        return np.ndarray(entry['shape'], dtype=dtype, buffer=self.shm.buf, offset=entry['offset'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close and remove the block (the workers must not use it anymore)."""
+        if self.shm is None:
+            return
+
+        self.shm.close()
+        if getattr(self.shm, '_track', True):
+            # SharedMemory.unlink unregisters the block on Python < 3.13
+            resource_tracker.register(self.shm._name, 'shared_memory')
+        self.shm.unlink()
+        self.shm = None
+
+def _as_descr(descr):
+    """dtype description back from JSON (the fields of structured dtypes are lists instead of tuples)."""
+    if isinstance(descr, str):
+        return descr
+
+    fields = []
+    for name, dtype, *shape in descr:
+        fields.append((name, _as_descr(dtype), *[tuple(s) for s in shape]))
+
+    return fields
+
+## Blocks attached by the process, kept open while their views are used
+_attached = {}
+
+## Folder of the POSIX shared memory blocks
+SHM_FOLDER = '/dev/shm'
+
+def _private_mapping(name):
+    """Copy-on-write mapping of a block (None if the block is not a file of SHM_FOLDER)."""
+    try:
+        fd = os.open(os.path.join(SHM_FOLDER, name.lstrip('/')), os.O_RDONLY)
+    except OSError:
+        return None
+
+    try:
+        return mmap.mmap(fd, 0, flags=mmap.MAP_PRIVATE, prot=mmap.PROT_READ | mmap.PROT_WRITE)
+    finally:
+        os.close(fd)
+
+def attach_arrays(descriptor, private=False):
+    """
+    Views on the arrays published by SharedArrays (and the values that are
+    not arrays), from its descriptor.
+
+    The views are read-only and a block is attached once per process. With
+    private, the views are writable on a new copy-on-write mapping of the
+    block (copies of the arrays if the block cannot be mapped so).
+    """
+    name = descriptor['name']
+    buffer = _private_mapping(name) if private else None
+
+    if buffer is None:
+        if name not in _attached:
+            _attached[name] = _shared_memory(name)
+        buffer = _attached[name].buf
+
+    arrays = {}
+    for key, entry in descriptor['arrays'].items():
+        dtype = np.lib.format.descr_to_dtype(_as_descr(entry['dtype']))
+        view = np.ndarray(entry['shape'], dtype=dtype, buffer=buffer, offset=entry['offset'])
+        if not private:
+            view.flags.writeable = False
+        elif not isinstance(buffer, mmap.mmap):
+            view = view.copy()
+        arrays[key] = view
+
+    if descriptor['objects'] is not None:
+        offset, length = descriptor['objects']
+        arrays.update(pickle.loads(buffer[offset:offset + length]))
+
+    return arrays
+
+def forcing_environment(forcing, forcing_args):
+    """
+    Publish the forcing for the simulation workers started by the current
+    process. The forcing_args are stored with it so that a worker only uses
+    the shared forcing if it was computed with its own FORCING_ARGS.
+
+    Returns
+    -------
+    shared : SharedArrays
+        Publisher, to close when the workers are done.
+    env : dict
+        Environment variable to pass to the workers.
+    """
+    shared = SharedArrays({**forcing, '__forcing_args__': list(forcing_args)})
+    return shared, {FORCING_ENV: json.dumps(shared.descriptor)}
+
+def shared_forcing(forcing_args):
+    """
+    Forcing published by the parent process, None if there is none or if it
+    was computed with other forcing_args. Each call returns a new
+    copy-on-write mapping of the forcing, which the model can modify.
+    """
+    descriptor = os.environ.get(FORCING_ENV)
+    if not descriptor:
+        return None
+
+    forcing = attach_arrays(json.loads(descriptor), private=True)
+    if forcing.pop('__forcing_args__', None) != list(forcing_args):
+        return None
+
+    return forcing
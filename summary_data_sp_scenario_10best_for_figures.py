@@ -10,39 +10,25 @@ import sys
 
 # sys.path.append('./')
 
-from select_C4_C6_ind_repro import select_C4_C6_repro
+from select_C4_C6_ind_repro import select_C4_C6_repro, day_to_month
+from prefetch_loader import prefetch_files, read_bytes
+from popts_store import popts_file, load_popts
 
 import gc
 import os
 import pickle
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
 
+## Time series of popts used by select_C4_C6_repro and the summary, the
+## others are not read
+POPTS_KEYS = ['t', 'D', 'R', 'W']
 
-def day_to_month(yday_input):
-    """Convertit jour de l'année (1–365*n) en mois (1–12).
-    Accepte un entier ou un array numpy.
-    """
-    base_date = datetime(2000, 1, 1)  # année fictive pour conversion
-    is_scalar = np.isscalar(yday_input)
-    
-    yday_array = np.atleast_1d(yday_input)
-    flat = yday_array.ravel()
-    
-    months = np.array([
-        (base_date + timedelta(days=int(d))).month
-        for d in flat
-    ])
-    
-    months = months.reshape(yday_array.shape)
-    
-    if is_scalar:
-        return int(months[0])  # renvoie un int si entrée scalaire
-    return months
+## Months of the summary of the females, the stages are only computed for them
+SUMMARY_MONTHS = [8]
 
 
-def run_summary_sp_scenario_for_figures(path_params_df, path_coltrane_outputs, path_save_dir):
+def run_summary_sp_scenario_for_figures(path_params_df, path_coltrane_outputs, path_save_dir, read_ahead=1):
 
     # Fichiers et dossiers
     params_df = pd.read_csv(path_params_df)
@@ -53,11 +39,13 @@ def run_summary_sp_scenario_for_figures(path_params_df, path_coltrane_outputs, p
     # Lister tous les fichiers pop.pkl
     files = [f for f in os.listdir(path_coltrane_outputs) if f.endswith('_pop.pkl')]
     
+    # Runs to summarize, whose outputs are read in the background
+    runs = []
+    
     for f in files:
-        print(f"file:{f}")
         base = f.replace('_pop.pkl', '')
         pop_path = os.path.join(path_coltrane_outputs, f)
-        popts_path = os.path.join(path_coltrane_outputs, f"{base}_popts.pkl")
+        popts_path = popts_file(os.path.join(path_coltrane_outputs, base))
         if not os.path.exists(popts_path): continue
     
         _, _, species, scenario, sid = base.split('_')
@@ -68,12 +56,19 @@ def run_summary_sp_scenario_for_figures(path_params_df, path_coltrane_outputs, p
                         (params_df['scenario'] == scenario) &
                         (params_df['id'] == sid)]
         if row.empty: continue
-        row = row.iloc[0]
+        
+        runs.append((f, pop_path, popts_path, species, scenario, sid, row.iloc[0]))
+    
+    read_run = lambda run: (read_bytes(run[1]), read_bytes(run[2]))
+    
+    for (f, pop_path, popts_path, species, scenario, sid, row), future in prefetch_files(runs, read=read_run, read_ahead=read_ahead):
+        print(f"file:{f}")
     
         # Charger les outputs
-        with open(pop_path, 'rb') as f1, open(popts_path, 'rb') as f2:
-            pop = pickle.load(f1)
-            popts = pickle.load(f2)
+        pop_bytes, popts_bytes = future.result()
+        pop = pickle.loads(pop_bytes)
+        popts = load_popts(popts_bytes, keys=POPTS_KEYS)
+        del pop_bytes, popts_bytes
     
         # Compute the df for females in august
         results_df1 = {
@@ -82,13 +77,13 @@ def run_summary_sp_scenario_for_figures(path_params_df, path_coltrane_outputs, p
             'fitness': [],
         }
         
-        select_popts = select_C4_C6_repro(popts, pop)
+        select_popts = select_C4_C6_repro(popts, pop, months=SUMMARY_MONTHS)
         mask = select_popts['mask']  # shape (time, cop, strat)
         time_months = day_to_month(select_popts['t'])  # shape (time, cop, strat)
     
         n_cop, n_strat = pop['F2'].shape
     
-        for month in [8]:
+        for month in SUMMARY_MONTHS:
             for stage in [6]:
                 for cop in range(n_cop):
                     for strat in range(n_strat):
@@ -147,6 +142,8 @@ def run_summary_sp_scenario_for_figures(path_params_df, path_coltrane_outputs, p
 
 if __name__ == '__main__':
     
-    run_summary_sp_scenario_for_figures(sys.argv[1], sys.argv[2], sys.argv[3])
+    read_ahead = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    
+    run_summary_sp_scenario_for_figures(sys.argv[1], sys.argv[2], sys.argv[3], read_ahead)
 
     print("Done")
@@ -10,35 +10,20 @@ import sys
 
 # sys.path.append('./')
 
-from select_C4_C6_ind_repro import select_C4_C6_repro
+from select_C4_C6_ind_repro import select_C4_C6_repro, day_to_month
+from popts_store import popts_file, load_popts
 
 import os
 import pickle
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
 
+## Time series of popts used by select_C4_C6_repro and the summary, the
+## others are not read
+POPTS_KEYS = ['t', 'D', 'R', 'W']
 
-def day_to_month(yday_input):
-    """Convertit jour de l'année (1–365*n) en mois (1–12).
-    Accepte un entier ou un array numpy.
-    """
-    base_date = datetime(2000, 1, 1)  # année fictive pour conversion
-    is_scalar = np.isscalar(yday_input)
-    
-    yday_array = np.atleast_1d(yday_input)
-    flat = yday_array.ravel()
-    
-    months = np.array([
-        (base_date + timedelta(days=int(d))).month
-        for d in flat
-    ])
-    
-    months = months.reshape(yday_array.shape)
-    
-    if is_scalar:
-        return int(months[0])  # renvoie un int si entrée scalaire
-    return months
+## Months of the summary of the females, the stages are only computed for them
+SUMMARY_MONTHS = [8]
 
 
 def run_summary_sp_scenario_for_figures(path_params_df, path_coltrane_outputs, popfile,  path_save_dir):
@@ -48,7 +33,7 @@ def run_summary_sp_scenario_for_figures(path_params_df, path_coltrane_outputs, p
     print(f"file:{popfile}")
     base = popfile.replace('_pop.pkl', '')
     pop_path = os.path.join(path_coltrane_outputs, popfile)
-    popts_path = os.path.join(path_coltrane_outputs, f"{base}_popts.pkl")
+    popts_path = popts_file(os.path.join(path_coltrane_outputs, base))
     #if not os.path.exists(popts_path):
      #   continue
     print(f"pop_path:{pop_path}")
@@ -67,9 +52,9 @@ def run_summary_sp_scenario_for_figures(path_params_df, path_coltrane_outputs, p
     row = row.iloc[0]
     
     # Charger les outputs
-    with open(pop_path, 'rb') as f1, open(popts_path, 'rb') as f2:
+    with open(pop_path, 'rb') as f1:
         pop = pickle.load(f1)
-        popts = pickle.load(f2)
+    popts = load_popts(popts_path, keys=POPTS_KEYS)
     
     # Compute the df for females in august
     results_df1 = {
@@ -78,13 +63,13 @@ def run_summary_sp_scenario_for_figures(path_params_df, path_coltrane_outputs, p
             'fitness': [],
     }
         
-    select_popts = select_C4_C6_repro(popts, pop)
+    select_popts = select_C4_C6_repro(popts, pop, months=SUMMARY_MONTHS)
     mask = select_popts['mask']  # shape (time, cop, strat)
     time_months = day_to_month(select_popts['t'])  # shape (time, cop, strat)
     
     n_cop, n_strat = pop['F2'].shape
     
-    for month in [8]:
+    for month in SUMMARY_MONTHS:
         for stage in [6]:
             for cop in range(n_cop):
                 for strat in range(n_strat):
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Progress of a sweep from the run manifest
+
+Report the number of completed, failed and running runs, the throughput, the
+utilisation of each worker, the latency percentiles and the projected
+completion of a sweep, from the manifest written by the drivers (see
+run_manifest.py). Optionally write the same numbers in the Prometheus text
+format for a local scraper, and follow the manifest every few seconds.
+
+A run retried (by the work queue or by hand) has several start and end
+records: only its latest record counts, so it is done once and running
+again while it is retried. A run whose latest record is a start older than
+--stale seconds (killed without end record, e.g. a node lost) is counted as
+stale and not as running.
+
+    python sweep_progress.py ./manifest --total 16000
+    python sweep_progress.py ./manifest --total 16000 --prometheus sweep.prom --follow 60
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+from datetime import datetime, timedelta
+
+from run_manifest import ManifestReader
+
+## A run started more than STALE_AFTER seconds ago without end record is stale
+STALE_AFTER = 6 * 3600
+
+class SweepProgress:
+    """State of a sweep, updated with the records of the manifest."""
+
+    def __init__(self, window=600, stale_after=STALE_AFTER):
+        self.window = window
+        self.stale_after = stale_after
+        # Latest record of each run
+        self.runs = {}
+
+    def update(self, records):
+        for record in records:
+            key = (record['driver'], record['run_id'])
+            latest = self.runs.get(key)
+
+            # An end record is kept over the start record of the same time
+            if (latest is None or record['time'] > latest['time']
+                    or (record['time'] == latest['time'] and record['event'] == 'end')):
+                self.runs[key] = record
+
+    def summary(self, total=None, now=None):
+        """
+        Statistics of the sweep.
+
+        Parameters
+        ----------
+        total : int
+            Total number of runs of the sweep (for the remaining runs and ETA).
+        now : float
+            Current time (default: time.time()).
+
+        Returns
+        -------
+        summary : dict
+            Counts (latest state of each run), throughput (runs per minute,
+            overall and over the last window), failure rate, latency
+            percentiles (s), utilisation of each worker and projected
+            completion.
+
+        """
+        now = time.time() if now is None else now
+
+        finished = [r for r in self.runs.values() if r['event'] == 'end']
+        started = [r for r in self.runs.values() if r['event'] == 'start']
+        running = [r for r in started if now - r['time'] <= self.stale_after]
+
+        status = np.array([r['status'] for r in finished])
+        starts = np.array([r['start'] for r in finished])
+        ends = np.array([r['time'] for r in finished])
+        durations = ends - starts
+
+        n_ok = int(np.sum(status == 'ok'))
+        n_failed = int(np.sum(status == 'failed'))
+        n_done = n_ok + n_failed
+
+        first = min([*starts, *[r['time'] for r in started]], default=now)
+        elapsed = max(now - first, 1e-9)
+
+        recent = int(np.sum(ends >= now - self.window))
+        throughput = 60 * n_done / elapsed
+        throughput_recent = 60 * recent / min(self.window, elapsed)
+
+        summary = {'ok': n_ok,
+                   'failed': n_failed,
+                   'running': len(running),
+                   'stale': len(started) - len(running),
+                   'failure_rate': n_failed / n_done if n_done else 0.,
+                   'throughput_per_min': throughput,
+                   'throughput_recent_per_min': throughput_recent,
+                   'latency_s': {f'p{q}': float(np.percentile(durations, q)) if n_done else np.nan for q in (50, 90, 99)},
+                   'elapsed_s': elapsed,
+                   'workers': {}
+                   }
+
+        # Busy time of each worker (finished runs and the current one)
+        workers = np.array([r['worker'] for r in finished])
+        for worker in sorted(set(workers) | {r['worker'] for r in running}):
+            busy = float(np.sum(durations[workers == worker])) if n_done else 0.
+            busy += sum(now - r['time'] for r in running if r['worker'] == worker)
+            summary['workers'][worker] = {'runs': int(np.sum(workers == worker)),
+                                          'utilisation': busy / elapsed}
+
+        if total is not None:
+            remaining = max(total - n_done, 0)
+            rate = throughput_recent if throughput_recent > 0 else throughput
+            summary['total'] = total
+            summary['remaining'] = remaining
+            summary['eta_s'] = 60 * remaining / rate if rate > 0 else np.inf
+
+        return summary
+
+def format_summary(summary):
+    """Human readable report of a summary."""
+    lines = [f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+             f"ok {summary['ok']}, failed {summary['failed']} ({100 * summary['failure_rate']:.1f}%), running {summary['running']}, stale {summary['stale']}",
+             f"throughput {summary['throughput_per_min']:.1f} runs/min (last window {summary['throughput_recent_per_min']:.1f} runs/min)",
+             "latency " + ", ".join(f"{q} {v:.1f}s" for q, v in summary['latency_s'].items())]
+
+    if 'total' in summary:
+        eta = summary['eta_s']
+        finish = 'unknown' if not np.isfinite(eta) else (datetime.now() + timedelta(seconds=eta)).strftime('%Y-%m-%d %H:%M')
+        lines.append(f"remaining {summary['remaining']} / {summary['total']}, projected completion {finish}")
+
+    utilisation = [w['utilisation'] for w in summary['workers'].values()]
+    if utilisation:
+        lines.append(f"{len(utilisation)} workers, utilisation mean {100 * np.mean(utilisation):.0f}%, min {100 * np.min(utilisation):.0f}%")
+
+    return "\n".join(lines)
+
+def write_prometheus(summary, path):
+    """Write the summary in the Prometheus text format (atomically)."""
+    lines = ['# TYPE coltrane_sweep_runs gauge']
+    for status in ['ok', 'failed', 'running', 'stale']:
+        lines.append(f'coltrane_sweep_runs{{status="{status}"}} {summary[status]}')
+
+    lines += ['# TYPE coltrane_sweep_failure_rate gauge',
+              f"coltrane_sweep_failure_rate {summary['failure_rate']}",
+              '# TYPE coltrane_sweep_throughput_per_minute gauge',
+              f"coltrane_sweep_throughput_per_minute{{window=\"all\"}} {summary['throughput_per_min']}",
+              f"coltrane_sweep_throughput_per_minute{{window=\"recent\"}} {summary['throughput_recent_per_min']}",
+              '# TYPE coltrane_sweep_latency_seconds gauge']
+    for q, v in summary['latency_s'].items():
+        lines.append(f'coltrane_sweep_latency_seconds{{quantile="0.{q[1:]}"}} {v}')
+
+    lines.append('# TYPE coltrane_sweep_worker_utilisation gauge')
+    for worker, w in summary['workers'].items():
+        lines.append(f'coltrane_sweep_worker_utilisation{{worker="{worker}"}} {w["utilisation"]}')
+
+    if 'total' in summary:
+        lines += ['# TYPE coltrane_sweep_remaining_runs gauge',
+                  f"coltrane_sweep_remaining_runs {summary['remaining']}",
+                  '# TYPE coltrane_sweep_eta_seconds gauge',
+                  f"coltrane_sweep_eta_seconds {summary['eta_s']}"]
+
+    with open(path + '.tmp', 'w') as f:
+        f.write("\n".join(lines).replace(' inf', ' +Inf').replace(' nan', ' NaN') + "\n")
+
+    os.replace(path + '.tmp', path)
+
+def sweep_progress(manifest_dir, total=None, prometheus=None, follow=0, window=600, stale_after=STALE_AFTER):
+    """
+    Report the progress of a sweep once, or every follow seconds.
+
+    Parameters
+    ----------
+    manifest_dir : str
+        Folder of the manifest.
+    total : int
+        Total number of runs of the sweep.
+    prometheus : str
+        Path of the Prometheus text file (optional).
+    follow : float
+        Refresh period in seconds (0 to report once).
+    window : float
+        Window (s) of the recent throughput used for the ETA.
+    stale_after : float
+        Age (s) of a start record without end record after which the run is
+        stale.
+
+    Returns
+    -------
+    summary : dict
+        Last summary.
+
+    """
+    reader = ManifestReader(manifest_dir)
+    progress = SweepProgress(window=window, stale_after=stale_after)
+
+    while True:
+        progress.update(reader.read())
+        summary = progress.summary(total=total)
+
+        print(format_summary(summary), flush=True)
+        if prometheus:
+            write_prometheus(summary, prometheus)
+
+        if not follow or ('total' in summary and summary['remaining'] == 0 and summary['running'] == 0):
+            return summary
+
+        time.sleep(follow)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Progress of a sweep from the run manifest.")
+    parser.add_argument('manifest_dir', help="Folder of the manifest (COLTRANE_MANIFEST_DIR of the drivers).")
+    parser.add_argument('--total', type=int, default=None, help="Total number of runs of the sweep.")
+    parser.add_argument('--prometheus', default=None, help="Write the metrics in this Prometheus text file.")
+    parser.add_argument('--follow', type=float, default=0, help="Refresh every FOLLOW seconds.")
+    parser.add_argument('--window', type=float, default=600, help="Window (s) of the recent throughput.")
+    parser.add_argument('--stale', type=float, default=STALE_AFTER, help="Age (s) of a run without end record after which it is stale.")
+    args = parser.parse_args()
+
+    sweep_progress(args.manifest_dir, args.total, args.prometheus, args.follow, args.window, args.stale)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Work queue of a sweep on a shared filesystem
+
+The lines of a parameter file are split into batches stored as files in the
+folder of the queue, and the runners of any number of nodes (SLURM array
+tasks, or several local runners for a test) claim the batches one at a time,
+instead of splitting the parameter file by hand. No server is needed, the
+queue only relies on the atomicity of os.rename on the shared filesystem:
+
+    pending/batch_000012.txt                          batch to run
+    claimed/batch_000012.txt@node17_pid4242           batch claimed by a runner
+    done/batch_000012.txt                             batch run
+    failed/batch_000012.txt                           lines of the batch that failed
+
+A runner claims a batch by renaming it from pending/ to claimed/ (only one
+runner can succeed), touches it every HEARTBEAT_INTERVAL seconds while its
+lines run (with memory_runner.py) and moves it to done/ at the end. A claim
+that was not touched for STALE_TIMEOUT seconds (runner killed, node lost) is
+moved back to pending/ by the other runners, the runs of the batch already
+done being skipped by the run cache when it is run again. A runner that finds
+its claim requeued (e.g. it was suspended) kills the workers of the batch and
+leaves it to the runner that claims it again.
+
+    python work_queue.py init ./queue_sim2 ./multisp_parameters_u0fix_IA_8000_ordered.txt 64
+    python work_queue.py run ./queue_sim2 32 python -u coltrane_save_outputs_for_multiple_costs.py {1} {2} {3} {4} {5} {6} {7} {8} {9} {10} ./coltrane_outputs_sim2 1
+    python work_queue.py status ./queue_sim2
+    python work_queue.py requeue ./queue_sim2 1     # stale claims, and the failed lines (1)
+
+@author: Lucie Bourreau
+@date: 2026/10
+"""
+
+import os
+import sys
+import time
+import threading
+
+from job_scheduler import read_param_lines, write_lines
+from memory_runner import MemoryRunner, memory_budget_mb
+from run_manifest import worker_name
+
+## Folders of the batches in each state
+STATES = ('pending', 'claimed', 'done', 'failed')
+
+## Interval between two touches of a claimed batch (s)
+HEARTBEAT_INTERVAL = 30
+
+## A claim not touched for this time (s) is given back to the queue
+STALE_TIMEOUT = 600
+
+## Interval between two checks of the queue while other runners hold the last batches (s)
+QUEUE_POLL = 30
+
+def queue_folders(queue_path):
+    """Folder of each state of the queue."""
+    return {state: os.path.join(queue_path, state) for state in STATES}
+
+def batch_name(file_name):
+    """Name of a batch from the name of its file (without the runner of a claim)."""
+    return file_name.split('@')[0]
+
+def init_queue(queue_path, params_file, batch_size):
+    """
+    Split the lines of a parameter file into batches of batch_size lines, in
+    the order of the file (e.g. ordered longest first by job_scheduler.py).
+
+    Returns
+    -------
+    n : int
+        Number of batches.
+    """
+    folders = queue_folders(queue_path)
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+
+    if any(os.listdir(folder) for folder in folders.values()):
+        raise ValueError(f"The queue {queue_path} is not empty")
+
+    lines = read_param_lines(params_file)
+    batches = [lines[i:i + batch_size] for i in range(0, len(lines), batch_size)]
+
+    for n, batch in enumerate(batches):
+        # Written aside, then renamed, so that a runner never claims a partial batch
+        tmp_path = os.path.join(queue_path, f'.batch_{n:06d}.txt.tmp')
+        write_lines(batch, tmp_path)
+        os.rename(tmp_path, os.path.join(folders['pending'], f'batch_{n:06d}.txt'))
+
+    return len(batches)
+
+def claim_batch(queue_path, worker=None):
+    """
+    Claim the first pending batch.
+
+    Returns
+    -------
+    path : str
+        Path of the claimed batch (None if there is no pending batch).
+    """
+    folders = queue_folders(queue_path)
+    worker = (worker or worker_name()).replace(':', '_').replace('/', '_')
+
+    for file_name in sorted(os.listdir(folders['pending'])):
+        path = os.path.join(folders['claimed'], f'{file_name}@{worker}')
+        try:
+            os.rename(os.path.join(folders['pending'], file_name), path)
+        except FileNotFoundError:
+            # Claimed by another runner in the meantime
+            continue
+
+        # The claim is fresh, whatever the age of the batch file
+        os.utime(path)
+        return path
+
+    return None
+
+def requeue_stale(queue_path, timeout=STALE_TIMEOUT, failed=False):
+    """
+    Move back to pending/ the claims not touched for timeout seconds and, if
+    failed, the lines that failed.
+
+    Returns
+    -------
+    n : int
+        Number of batches requeued.
+    """
+    folders = queue_folders(queue_path)
+    now = time.time()
+    n = 0
+
+    for file_name in sorted(os.listdir(folders['claimed'])):
+        path = os.path.join(folders['claimed'], file_name)
+        try:
+            if now - os.path.getmtime(path) < timeout:
+                continue
+            os.rename(path, os.path.join(folders['pending'], batch_name(file_name)))
+        except FileNotFoundError:
+            # Done or requeued by another runner in the meantime
+            continue
+
+        print(f"Stale claim requeued: {file_name}", flush=True)
+        n += 1
+
+    if failed:
+        for file_name in sorted(os.listdir(folders['failed'])):
+            try:
+                os.rename(os.path.join(folders['failed'], file_name),
+                          os.path.join(folders['pending'], f'retry_{file_name}'))
+            except FileNotFoundError:
+                continue
+            n += 1
+
+    return n
+
+class Heartbeat:
+    """Touch a claimed batch every interval seconds, in a background thread."""
+
+    def __init__(self, path, interval=HEARTBEAT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                # Requeued by another runner, which runs it again: the batch is stopped (see run_queue)
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+def finish_batch(queue_path, path, failed_lines):
+    """Move a claimed batch to done/, its failed lines being written in failed/."""
+    folders = queue_folders(queue_path)
+    name = batch_name(os.path.basename(path))
+
+    if failed_lines:
+        write_lines(failed_lines, os.path.join(folders['failed'], name))
+
+    try:
+        os.rename(path, os.path.join(folders['done'], name))
+    except FileNotFoundError:
+        # Requeued as stale while it was running, it will be run again (cached runs)
+        print(f"Claim of {name} lost while it was running", flush=True)
+
+def run_queue(queue_path, command, n_jobs, budget_mb=None, timeout=STALE_TIMEOUT, poll=QUEUE_POLL):
+    """
+    Claim and run batches until the queue is empty and no other runner holds
+    a batch. The lines of a batch are run by a MemoryRunner with at most
+    n_jobs workers.
+
+    Returns
+    -------
+    n_batches : int
+        Number of batches run by this runner.
+    """
+    folders = queue_folders(queue_path)
+    budget_mb = memory_budget_mb() if budget_mb is None else budget_mb
+    n_batches = 0
+
+    while True:
+        requeue_stale(queue_path, timeout)
+        path = claim_batch(queue_path)
+
+        if path is None:
+            if not os.listdir(folders['claimed']):
+                break
+            # Wait for the batches of the other runners, in case they are lost
+            time.sleep(poll)
+            continue
+
+        print(f"Run {os.path.basename(path)}", flush=True)
+
+        with Heartbeat(path, min(HEARTBEAT_INTERVAL, timeout / 4)) as heartbeat:
+            failed = MemoryRunner(command, n_jobs, budget_mb).run(read_param_lines(path), stop=lambda: heartbeat.lost)
+
+        if heartbeat.lost:
+            # Neither done nor failed, the runner that claimed it again writes them
+            print(f"Claim of {os.path.basename(path)} lost, batch stopped", flush=True)
+            continue
+
+        finish_batch(queue_path, path, failed)
+        n_batches += 1
+
+    return n_batches
+
+def queue_status(queue_path, timeout=STALE_TIMEOUT):
+    """Number of batches and lines in each state, and number of stale claims."""
+    folders = queue_folders(queue_path)
+    status = {}
+    now = time.time()
+
+    for state, folder in folders.items():
+        files = sorted(os.listdir(folder))
+        status[state] = {'batches': len(files),
+                         'lines': sum(len(read_param_lines(os.path.join(folder, f))) for f in files)}
+
+    status['claimed']['stale'] = sum(now - os.path.getmtime(os.path.join(folders['claimed'], f)) >= timeout
+                                     for f in os.listdir(folders['claimed']))
+
+    return status
+
+if __name__ == '__main__':
+
+    command = sys.argv[1]
+    queue_path = sys.argv[2]
+
+    if command == 'init':
+        n = init_queue(queue_path, sys.argv[3], int(sys.argv[4]))
+        print(f"{n} batches in {queue_path}")
+
+    elif command == 'run':
+        n = run_queue(queue_path, sys.argv[4:], int(sys.argv[3]))
+        print(f"{n} batches run by {worker_name()}")
+
+    elif command == 'requeue':
+        failed = bool(int(sys.argv[3])) if len(sys.argv) > 3 else False
+        timeout = float(sys.argv[4]) if len(sys.argv) > 4 else STALE_TIMEOUT
+        print(f"{requeue_stale(queue_path, timeout, failed)} batches requeued")
+
+    elif command == 'status':
+        for state, counts in queue_status(queue_path).items():
+            print(f"{state}: " + ", ".join(f"{n} {name}" for name, n in counts.items()))
+
+    else:
+        raise ValueError(f"Unknown command: {command} (init, run, requeue or status)")